@@ -0,0 +1,117 @@
+"""
+Coalescing of field-level autosave patches.
+
+Editors send small ``campos`` changes every few seconds per open document.
+Patches for the same document that arrive within ``window`` seconds are
+merged in memory and persisted by a single backend write; every request in
+the batch waits for that write and gets the resulting version back.
+
+Changes use JSON merge-patch semantics at the field level: a value replaces
+the field, ``None`` removes it. Each batch is pinned to the document version
+it was based on, so a write that lost a race (e.g. against another worker)
+fails with ``VersionConflict`` instead of overwriting newer data. Patches
+that arrive while a batch is being written, still based on the version that
+write replaces, are chained onto the version it produces and written after
+it.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+class VersionConflict(Exception):
+    """The document changed since the version the patch was based on."""
+
+    def __init__(self, current_version: Optional[int] = None):
+        super().__init__("version conflict")
+        self.current_version = current_version
+
+class PendingPatch:
+    def __init__(self, usuario_id: str, base_version: int, plantilla_id: Optional[str] = None,
+                 origin_version: Optional[int] = None):
+        self.usuario_id = usuario_id
+        self.base_version = base_version
+        # Oldest version a patch in this batch may be based on: batches chained
+        # onto in-flight writes also take patches sent before those landed
+        self.origin_version = base_version if origin_version is None else origin_version
+        self.plantilla_id = plantilla_id
+        self.changes: Dict[str, Any] = {}
+        self.requests = 0
+        self.future: "asyncio.Future[Dict[str, Any]]" = asyncio.get_running_loop().create_future()
+
+def merge_fields(campos: Dict[str, Any], changes: Dict[str, Any]) -> Dict[str, Any]:
+    """Apply field-level changes; ``None`` deletes the field."""
+    merged = dict(campos)
+    for field, value in changes.items():
+        if value is None:
+            merged.pop(field, None)
+        else:
+            merged[field] = value
+    return merged
+
+class AutosaveCoalescer:
+    """Per-document patch buffer flushed ``window`` seconds after its first patch.
+
+    ``flush(document_id, pending)`` performs the write and returns the
+    response shared by every request in the batch.
+    """
+
+    def __init__(self, flush: Callable[[str, PendingPatch], Awaitable[Dict[str, Any]]], window: float):
+        self.flush = flush
+        self.window = window
+        self._pending: Dict[str, PendingPatch] = {}
+        # Latest batch being written per document
+        self._inflight: Dict[str, PendingPatch] = {}
+        self._flushing: List[asyncio.Task] = []
+
+    def pending_for(self, document_id: str) -> Optional[PendingPatch]:
+        """The batch buffered for the document, or else the one being written."""
+        return self._pending.get(document_id) or self._inflight.get(document_id)
+
+    async def submit(self, document_id: str, usuario_id: str, base_version: int, changes: Dict[str, Any],
+                     plantilla_id: Optional[str] = None) -> Dict[str, Any]:
+        pending = self._pending.get(document_id)
+        if pending is not None and not pending.origin_version <= base_version <= pending.base_version:
+            raise VersionConflict(pending.base_version)
+        if pending is None:
+            inflight = self._inflight.get(document_id)
+            if inflight is not None and inflight.origin_version <= base_version <= inflight.base_version:
+                pending = PendingPatch(usuario_id, inflight.base_version + 1, plantilla_id, inflight.origin_version)
+            else:
+                pending = PendingPatch(usuario_id, base_version, plantilla_id)
+            self._pending[document_id] = pending
+            asyncio.get_running_loop().call_later(self.window, self._start_flush, document_id, pending)
+        pending.changes.update(changes)
+        pending.requests += 1
+        # Shielded so one client disconnecting does not cancel the shared write
+        return await asyncio.shield(pending.future)
+
+    def _start_flush(self, document_id: str, pending: PendingPatch):
+        if self._pending.get(document_id) is not pending:
+            return
+        del self._pending[document_id]
+        previous = self._inflight.get(document_id)
+        self._inflight[document_id] = pending
+        task = asyncio.ensure_future(self._flush(document_id, pending, previous))
+        self._flushing.append(task)
+        task.add_done_callback(self._flushing.remove)
+
+    async def _flush(self, document_id: str, pending: PendingPatch, previous: Optional[PendingPatch]):
+        try:
+            if previous is not None:
+                # Written in order; if the previous write failed this one conflicts
+                await asyncio.wait([previous.future])
+            result = await self.flush(document_id, pending)
+        except Exception as e:
+            pending.future.set_exception(e)
+        else:
+            pending.future.set_result(result)
+        finally:
+            if self._inflight.get(document_id) is pending:
+                del self._inflight[document_id]
+
+    async def drain(self):
+        """Write every buffered batch now; used on shutdown."""
+        for document_id, pending in list(self._pending.items()):
+            self._start_flush(document_id, pending)
+        if self._flushing:
+            await asyncio.gather(*self._flushing, return_exceptions=True)
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Benchmark: per-row pydantic validation vs. bulk TypeAdapter validation
+(trusted_rows.load_rows) for establishment rows as they come back from MongoDB.
+Unvalidated model_construct is included for reference.
+
+Usage:
+    python bench_trusted_rows.py [--rows 10000] [--repeat 5]
+"""
+
+import argparse
+import os
+import time
+import uuid
+from datetime import datetime
+
+from bson import ObjectId
+
+os.environ.setdefault('MONGO_URL', 'mongodb://localhost:27017')
+os.environ.setdefault('DB_NAME', 'bench_database')
+
+from server import Establishment  # noqa: E402
+from trusted_rows import load_rows  # noqa: E402
+
+def make_rows(count: int):
+    rows = []
+    for i in range(count):
+        row = {
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "usuario_id": str(uuid.uuid4()),
+            "giro": "CONSULTORIO_ODONTO",
+            "servicios": ["Limpieza dental", "Ortodoncia"],
+            "numero_salas": i % 5,
+            "equipo_especial": ["Rayos X dental", "Autoclave"],
+            "maneja_rpbi": True,
+            "responsable_sanitario": True,
+            "ubicacion_estado": "Ciudad de México",
+            "farmacia_anexo": False,
+            "notas_estatales": None,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+        rows.append(row)
+    return rows
+
+def best_of(repeat: int, fn) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = make_rows(args.rows)
+
+    cases = [
+        ("per-row Establishment(**row)", lambda: [Establishment(**row) for row in rows]),
+        ("bulk load_rows(Establishment, rows)", lambda: load_rows(Establishment, rows)),
+        ("per-row model_construct (no checks)", lambda: [Establishment.model_construct(**row) for row in rows]),
+    ]
+
+    print(f"Rows: {args.rows}, best of {args.repeat}")
+    baseline = None
+    for name, fn in cases:
+        elapsed = best_of(args.repeat, fn)
+        baseline = baseline or elapsed
+        print(f"  {name:<36} {elapsed * 1000:8.1f} ms  ({baseline / elapsed:4.1f}x)")
+
+if __name__ == "__main__":
+    main()
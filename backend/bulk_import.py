@@ -0,0 +1,126 @@
+"""
+Incremental parsing of CSV / NDJSON request bodies for bulk imports.
+
+The body is consumed chunk by chunk from ``request.stream()``, so memory use
+is bounded by the largest single record rather than by the upload size.
+"""
+
+import codecs
+import csv
+import json
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pydantic import ValidationError
+
+SUPPORTED_FORMATS = ("csv", "ndjson")
+
+# Content types accepted for each format when no explicit format is given
+CONTENT_TYPES = {
+    "text/csv": "csv",
+    "application/csv": "csv",
+    "application/x-ndjson": "ndjson",
+    "application/ndjson": "ndjson",
+    "application/jsonl": "ndjson",
+    "application/json-lines": "ndjson",
+}
+
+# CSV cells for list fields hold several values separated by this character
+CSV_LIST_SEPARATOR = ";"
+
+def detect_format(content_type: Optional[str], explicit: Optional[str] = None) -> Optional[str]:
+    """Resolve the import format from a query parameter or the Content-Type header."""
+    if explicit:
+        explicit = explicit.lower()
+        return explicit if explicit in SUPPORTED_FORMATS else None
+    if content_type:
+        return CONTENT_TYPES.get(content_type.split(";")[0].strip().lower())
+    return None
+
+async def iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """Yield decoded lines from a stream of byte chunks."""
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        lines = pending.split("\n")
+        pending = lines.pop()
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending:
+        yield pending.rstrip("\r")
+
+async def iter_ndjson(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """Yield ``(row_number, record, error)`` for every non-blank NDJSON line."""
+    row_number = 0
+    async for line in iter_lines(chunks):
+        if not line.strip():
+            continue
+        row_number += 1
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield row_number, None, f"JSON inválido: {e.msg}"
+            continue
+        if not isinstance(record, dict):
+            yield row_number, None, "Cada línea debe ser un objeto JSON"
+            continue
+        yield row_number, record, None
+
+async def iter_csv(chunks: AsyncIterator[bytes], list_fields: Iterable[str] = ()) -> AsyncIterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """Yield ``(row_number, record, error)`` for every CSV data row.
+
+    The first row is the header. Quoted cells may span several lines. Empty
+    cells are dropped so model defaults apply; cells of ``list_fields`` are split
+    on ``CSV_LIST_SEPARATOR``.
+    """
+    list_fields = set(list_fields)
+    header: Optional[List[str]] = None
+    record_text = ""
+    row_number = 0
+
+    async for line in iter_lines(chunks):
+        record_text = f"{record_text}\n{line}" if record_text else line
+        # An odd number of quotes means a quoted cell continues on the next line
+        if record_text.count('"') % 2:
+            continue
+        text, record_text = record_text, ""
+        if not text.strip():
+            continue
+
+        cells = next(csv.reader([text]))
+        if header is None:
+            header = [cell.strip() for cell in cells]
+            continue
+
+        row_number += 1
+        if len(cells) > len(header):
+            yield row_number, None, f"Se esperaban {len(header)} columnas, se recibieron {len(cells)}"
+            continue
+
+        record: Dict[str, Any] = {}
+        for column, cell in zip(header, cells):
+            cell = cell.strip()
+            if not cell:
+                continue
+            if column in list_fields:
+                record[column] = [item.strip() for item in cell.split(CSV_LIST_SEPARATOR) if item.strip()]
+            else:
+                record[column] = cell
+        yield row_number, record, None
+
+    if record_text:
+        row_number += 1
+        yield row_number, None, "Fila incompleta: comillas sin cerrar"
+
+def iter_records(chunks: AsyncIterator[bytes], fmt: str, list_fields: Iterable[str] = ()):
+    """Dispatch to the parser for ``fmt``."""
+    if fmt == "csv":
+        return iter_csv(chunks, list_fields)
+    return iter_ndjson(chunks)
+
+def format_validation_error(error: ValidationError) -> str:
+    """Flatten a pydantic ValidationError into a single report line."""
+    return "; ".join(
+        f"{'.'.join(str(part) for part in item['loc'])}: {item['msg']}" for item in error.errors()
+    )
@@ -0,0 +1,215 @@
+"""
+Materialized compliance state (the user's expediente).
+
+The expediente row stores the inputs of the compliance calculation (the
+required items from the active selection, how many LISTO documents exist per
+template, completed trámites and their expiry) next to the derived
+``avance``, ``estatus_cumplimiento`` and ``vencimientos``. Events update the
+inputs and re-derive the outputs from the row alone, so reads never scan
+documents. ``ComplianceStore`` applies events with a compare-and-swap on
+``rev`` so concurrent events for the same user are not lost.
+"""
+
+import copy
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+SELECCION_ACTIVADA = "SELECCION_ACTIVADA"
+DOCUMENTO_LISTO = "DOCUMENTO_LISTO"
+TRAMITE_COMPLETADO = "TRAMITE_COMPLETADO"
+VENCIMIENTO = "VENCIMIENTO"
+
+class ComplianceConflict(Exception):
+    """The expediente kept changing while an event was being applied."""
+
+def empty_state(usuario_id: str) -> Dict[str, Any]:
+    return {
+        "usuario_id": usuario_id,
+        "items": {"plantillas": [], "tramites": []},
+        "documentos_listos": {},
+        "tramites_completados": {},
+        "rev": 0,
+    }
+
+def parse_timestamp(value: Any) -> Optional[datetime]:
+    """Naive UTC datetime from a stored timestamp (ISO string or datetime)."""
+    if value is None:
+        return None
+    if not isinstance(value, datetime):
+        value = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+def apply_event(state: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of ``state`` with the event's change to the inputs."""
+    state = copy.deepcopy(state)
+    tipo = event["tipo"]
+    if tipo == SELECCION_ACTIVADA:
+        items = event.get("items") or {}
+        state["items"] = {"plantillas": list(items.get("plantillas", [])), "tramites": list(items.get("tramites", []))}
+    elif tipo == DOCUMENTO_LISTO:
+        # delta is +1 when a document becomes LISTO and -1 when it goes back
+        listos = state.setdefault("documentos_listos", {})
+        count = listos.get(event["plantilla_id"], 0) + event.get("delta", 1)
+        if count > 0:
+            listos[event["plantilla_id"]] = count
+        else:
+            listos.pop(event["plantilla_id"], None)
+    elif tipo == TRAMITE_COMPLETADO:
+        state.setdefault("tramites_completados", {})[event["tramite_id"]] = {
+            "completado_en": event["completado_en"],
+            "vence": event.get("vence"),
+        }
+    elif tipo != VENCIMIENTO:
+        raise ValueError(f"unknown compliance event {tipo}")
+    return state
+
+def derive(state: Dict[str, Any], now: datetime, warning_days: int, red_threshold: int) -> Dict[str, Any]:
+    """Outputs of the compliance calculation for ``state`` at ``now``.
+
+    Expired trámites no longer count as done. ``proximo_evento`` is the next
+    time the outputs change without any event (a deadline entering the
+    warning window or passing).
+    """
+    items = state.get("items") or {}
+    plantillas, tramites = items.get("plantillas", []), items.get("tramites", [])
+    listos = state.get("documentos_listos") or {}
+    completados = state.get("tramites_completados") or {}
+    warning = timedelta(days=warning_days)
+
+    done = sum(1 for plantilla_id in plantillas if listos.get(plantilla_id, 0) > 0)
+    vencimientos: List[Dict[str, Any]] = []
+    upcoming: List[datetime] = []
+    expired = warned = False
+    for tramite_id in tramites:
+        completado = completados.get(tramite_id)
+        if not completado:
+            continue
+        vence = parse_timestamp(completado.get("vence"))
+        if vence is None:
+            done += 1
+            continue
+        if vence <= now:
+            estado = "VENCIDO"
+            expired = True
+        elif vence - warning <= now:
+            estado = "POR_VENCER"
+            warned = True
+            done += 1
+            upcoming.append(vence)
+        else:
+            estado = "VIGENTE"
+            done += 1
+            upcoming.append(vence - warning)
+        vencimientos.append({"tramite_id": tramite_id, "fecha": vence.isoformat(), "estado": estado})
+    vencimientos.sort(key=lambda v: v["fecha"])
+
+    total = len(plantillas) + len(tramites)
+    avance = round(100 * done / total) if total else 0
+    if expired or avance < red_threshold:
+        estatus = "ROJO"
+    elif avance < 100 or warned:
+        estatus = "AMARILLO"
+    else:
+        estatus = "VERDE"
+    return {
+        "avance": avance,
+        "estatus_cumplimiento": estatus,
+        "vencimientos": vencimientos,
+        "proximo_evento": min(upcoming).isoformat() if upcoming else None,
+    }
+
+def reminders(row: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Reminders for the trámites of ``row`` that are about to expire or expired.
+
+    Ids are derived from the deadline and its state, so storing the same
+    reminder twice can be detected.
+    """
+    result = []
+    for vencimiento in row.get("vencimientos") or []:
+        if vencimiento["estado"] not in ("POR_VENCER", "VENCIDO"):
+            continue
+        key = f"{row['usuario_id']}:{vencimiento['tramite_id']}:{vencimiento['fecha']}:{vencimiento['estado']}"
+        result.append({
+            "id": str(uuid.uuid5(uuid.NAMESPACE_URL, key)),
+            "usuario_id": row["usuario_id"],
+            "tramite_id": vencimiento["tramite_id"],
+            "tipo": vencimiento["estado"],
+            "fecha": vencimiento["fecha"],
+            "estatus_cumplimiento": row.get("estatus_cumplimiento"),
+        })
+    return result
+
+def differences(stored: Dict[str, Any], expected: Dict[str, Any], fields) -> List[str]:
+    """Fields whose stored value differs from the recomputed one."""
+    return [field for field in fields if (stored.get(field) or None) != (expected.get(field) or None)]
+
+class ComplianceStore:
+    """Applies events to expediente rows with optimistic concurrency.
+
+    ``load(usuario_id)`` returns the row or None. ``save(row, expected_rev)``
+    writes it only if the stored ``rev`` still equals ``expected_rev`` (or,
+    with ``expected_rev == 0``, inserts it if there is no row yet) and
+    returns whether it did. ``on_saved(row)``, if given, is called after
+    every write (e.g. to reschedule the row's next deadline).
+    """
+
+    def __init__(
+        self,
+        load: Callable[[str], Awaitable[Optional[Dict[str, Any]]]],
+        save: Callable[[Dict[str, Any], int], Awaitable[bool]],
+        warning_days: int,
+        red_threshold: int,
+        max_attempts: int = 5,
+        on_saved: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.load = load
+        self.save = save
+        self.warning_days = warning_days
+        self.red_threshold = red_threshold
+        self.max_attempts = max_attempts
+        self.on_saved = on_saved
+
+    def derive(self, state: Dict[str, Any], now: Optional[datetime] = None) -> Dict[str, Any]:
+        return derive(state, now or datetime.utcnow(), self.warning_days, self.red_threshold)
+
+    async def read(self, usuario_id: str) -> Dict[str, Any]:
+        row = await self.load(usuario_id)
+        if row is None:
+            state = empty_state(usuario_id)
+            return {**state, **self.derive(state)}
+        return row
+
+    async def apply(self, usuario_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        for _ in range(self.max_attempts):
+            current = await self.load(usuario_id) or empty_state(usuario_id)
+            updated = apply_event(current, event)
+            updated.update(self.derive(updated))
+            updated["rev"] = current.get("rev", 0) + 1
+            if await self.save(updated, current.get("rev", 0)):
+                if self.on_saved:
+                    self.on_saved(updated)
+                return updated
+        raise ComplianceConflict(f"expediente of {usuario_id} changed {self.max_attempts} times while updating")
+
+    async def reconcile(self, row: Dict[str, Any], documentos_listos: Dict[str, int]) -> List[str]:
+        """Compare ``row`` with a full recompute from ``documentos_listos`` counted
+        in the documents themselves, and rewrite it if anything differs.
+
+        Returns the fields that differed. Derived fields also change when time
+        alone moves a deadline; only ``documentos_listos`` means events were lost.
+        If an event lands meanwhile the rewrite is skipped, as that event has
+        already re-derived the row.
+        """
+        expected = {**row, "documentos_listos": documentos_listos}
+        expected.update(self.derive(expected))
+        # Timestamp columns may come back in another format (e.g. with an offset)
+        stored = {**row, "proximo_evento": row.get("proximo_evento") and parse_timestamp(row["proximo_evento"]).isoformat()}
+        drift = differences(stored, expected, ("documentos_listos", "avance", "estatus_cumplimiento", "vencimientos", "proximo_evento"))
+        if drift:
+            expected["rev"] = row.get("rev", 0) + 1
+            if await self.save(expected, row.get("rev", 0)) and self.on_saved:
+                self.on_saved(expected)
+        return drift
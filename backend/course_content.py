@@ -0,0 +1,217 @@
+"""
+Course modules prepared for delivery.
+
+``contenido_html`` is stored as authored. Before it is served it goes
+through an allowlist sanitizer (unknown tags are dropped but their text
+kept; scripts, styles and embeds are dropped with their content; only
+safe attributes and http(s)/mailto/relative links survive), and its h2/h3
+headings get stable ids and are collected for navigation.
+
+That work is done once per module version: ``CourseCache`` keeps each
+prepared module, already serialized with its ETag, keyed by id and
+``updated_at``, and rebuilds the ordered module index (by ``orden``, then
+``slug``) only when some module changed.
+"""
+
+import hashlib
+import json
+import re
+import unicodedata
+from html import escape
+from html.parser import HTMLParser
+from typing import Any, Dict, List, Optional, Tuple
+
+ALLOWED_TAGS = frozenset({
+    "a", "b", "blockquote", "br", "code", "em", "figcaption", "figure", "h2", "h3", "h4", "hr", "i", "img", "li",
+    "ol", "p", "pre", "span", "strong", "sub", "sup", "table", "tbody", "td", "th", "thead", "tr", "u", "ul",
+})
+VOID_TAGS = frozenset({"br", "hr", "img"})
+# Dropped together with everything inside them
+DROPPED_TAGS = frozenset({"script", "style", "iframe", "object", "embed", "template", "noscript", "svg", "math"})
+ALLOWED_ATTRIBUTES = {
+    "a": frozenset({"href", "title"}),
+    "img": frozenset({"src", "alt", "title", "width", "height"}),
+    "td": frozenset({"colspan", "rowspan"}),
+    "th": frozenset({"colspan", "rowspan"}),
+}
+URL_ATTRIBUTES = frozenset({"href", "src"})
+SAFE_SCHEMES = ("http:", "https:", "mailto:")
+# Authored h1 headings would compete with the page title
+RENAMED_TAGS = {"h1": "h2", "h5": "h4", "h6": "h4"}
+NAVIGATION_LEVELS = {"h2": 2, "h3": 3}
+
+def _safe_url(value: str) -> bool:
+    compact = re.sub(r"[\x00-\x20]", "", value).lower()
+    if compact.startswith(("#", "/")) or ":" not in compact.split("/", 1)[0]:
+        return True
+    return compact.startswith(SAFE_SCHEMES)
+
+def heading_id(text: str) -> str:
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    ascii_text = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return re.sub(r"[^a-z0-9]+", "-", ascii_text).strip("-") or "seccion"
+
+class _Sanitizer(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.out: List[str] = []
+        self.open: List[str] = []
+        self.headings: List[Dict[str, Any]] = []
+        self._dropping: List[str] = []
+        self._heading: Optional[Tuple[str, int, List[str]]] = None
+        self._ids: Dict[str, int] = {}
+
+    def handle_starttag(self, tag, attrs):
+        if self._dropping:
+            if tag in DROPPED_TAGS:
+                self._dropping.append(tag)
+            return
+        if tag in DROPPED_TAGS:
+            self._dropping.append(tag)
+            return
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag not in ALLOWED_TAGS:
+            return
+        allowed = ALLOWED_ATTRIBUTES.get(tag, frozenset())
+        kept = []
+        for name, value in attrs:
+            if name not in allowed or value is None:
+                continue
+            if name in URL_ATTRIBUTES and not _safe_url(value):
+                continue
+            kept.append(f' {name}="{escape(value, quote=True)}"')
+        if tag == "a" and any(part.startswith(' href="http') for part in kept):
+            kept.append(' rel="noopener noreferrer" target="_blank"')
+        if tag in NAVIGATION_LEVELS and self._heading is None:
+            # The id is only known once the text is read; filled in at the end tag
+            self._heading = (tag, len(self.out), [])
+            self.out.append("")
+            self.open.append(tag)
+            return
+        self.out.append(f"<{tag}{''.join(kept)}>")
+        if tag not in VOID_TAGS:
+            self.open.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in DROPPED_TAGS:
+            # Self-closed, so there is no content or end tag to drop
+            return
+        self.handle_starttag(tag, attrs)
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag not in VOID_TAGS and not self._dropping:
+            self.handle_endtag(tag)
+
+    def handle_endtag(self, tag):
+        if self._dropping:
+            if tag == self._dropping[-1]:
+                self._dropping.pop()
+            return
+        tag = RENAMED_TAGS.get(tag, tag)
+        if tag not in self.open:
+            return
+        # Close anything left open inside this element first
+        while self.open:
+            current = self.open.pop()
+            self._close(current)
+            if current == tag:
+                break
+
+    def _close(self, tag: str):
+        if self._heading is not None and tag == self._heading[0]:
+            level_tag, position, text_parts = self._heading
+            self._heading = None
+            text = " ".join("".join(text_parts).split())
+            base = heading_id(text)
+            count = self._ids.get(base, 0)
+            self._ids[base] = count + 1
+            anchor = base if count == 0 else f"{base}-{count + 1}"
+            self.out[position] = f'<{level_tag} id="{anchor}">'
+            self.headings.append({"nivel": NAVIGATION_LEVELS[level_tag], "texto": text, "id": anchor})
+        self.out.append(f"</{tag}>")
+
+    def handle_data(self, data):
+        if self._dropping:
+            return
+        if self._heading is not None:
+            self._heading[2].append(data)
+        self.out.append(escape(data, quote=False))
+
+    def close(self):
+        super().close()
+        while self.open:
+            self._close(self.open.pop())
+
+def sanitize_html(html: str) -> Tuple[str, List[Dict[str, Any]]]:
+    """Sanitized HTML and its navigation headings (``nivel``, ``texto``, ``id``)."""
+    sanitizer = _Sanitizer()
+    sanitizer.feed(html or "")
+    sanitizer.close()
+    return "".join(sanitizer.out), sanitizer.headings
+
+def _serialize(payload: Any) -> Tuple[bytes, str]:
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+    return body, f'"{hashlib.sha256(body).hexdigest()[:32]}"'
+
+class PreparedModule:
+    def __init__(self, module: Dict[str, Any]):
+        self.id = module["id"]
+        self.version = str(module.get("updated_at"))
+        self.slug = module["slug"]
+        self.orden = module.get("orden", 0)
+        self.titulo = module["titulo"]
+        contenido_html, encabezados = sanitize_html(module.get("contenido_html") or "")
+        self.summary = {
+            "id": self.id,
+            "slug": self.slug,
+            "titulo": self.titulo,
+            "orden": self.orden,
+            "objetivos": module.get("objetivos") or "",
+            "encabezados": encabezados,
+        }
+        self.detail = {
+            **self.summary,
+            "contenido_html": contenido_html,
+            "referencias": module.get("referencias"),
+            "recursos": module.get("recursos") or [],
+            "quiz": module.get("quiz") or {},
+            "updated_at": self.version,
+        }
+        self.body: bytes = b""
+        self.etag = ""
+
+class CourseCache:
+    """Prepared modules by id plus the serialized, ordered module index."""
+
+    def __init__(self):
+        self._modules: Dict[str, PreparedModule] = {}
+        self._by_slug: Dict[str, PreparedModule] = {}
+        self.index_body, self.index_etag = _serialize([])
+
+    def update(self, modules: List[Dict[str, Any]]) -> int:
+        """Replace the cached set with ``modules`` (the active rows), preparing
+        only those whose ``updated_at`` changed; returns how many were prepared.
+        """
+        prepared: Dict[str, PreparedModule] = {}
+        changed = 0
+        for module in modules:
+            current = self._modules.get(module["id"])
+            if current is None or current.version != str(module.get("updated_at")):
+                current = PreparedModule(module)
+                changed += 1
+            prepared[module["id"]] = current
+        if not changed and prepared.keys() == self._modules.keys():
+            return 0
+
+        ordered = sorted(prepared.values(), key=lambda m: (m.orden, m.slug))
+        for position, module in enumerate(ordered):
+            # Neighbours are part of the payload, so order changes re-serialize every module
+            module.detail["anterior"] = ordered[position - 1].slug if position > 0 else None
+            module.detail["siguiente"] = ordered[position + 1].slug if position + 1 < len(ordered) else None
+            module.body, module.etag = _serialize(module.detail)
+        self._modules = prepared
+        self._by_slug = {module.slug: module for module in ordered}
+        self.index_body, self.index_etag = _serialize([module.summary for module in ordered])
+        return changed
+
+    def get(self, slug: str) -> Optional[PreparedModule]:
+        return self._by_slug.get(slug)
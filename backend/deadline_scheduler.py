@@ -0,0 +1,146 @@
+"""
+In-process scheduler for expediente deadlines.
+
+Rows are indexed on their next due time (``proximo_evento``). Instead of
+polling every row, the scheduler loads only the rows due within the next
+``horizon`` into a heap, pops them as they come due and hands them to
+``fire`` in batches. The due time of the last fired batch is persisted as
+a cursor, so after a restart loading resumes from there rather than from
+the beginning of the index.
+
+The window is reloaded every ``refresh_interval`` to pick up rows changed
+by other workers; changes made in this worker are pushed in directly with
+``schedule``. Firing is expected to be idempotent, since a row can be
+fired again after a restart or when its due time was changed elsewhere.
+Keys that fail to fire are retried on the next tick, and the cursor does
+not move past the earliest of them until they succeed.
+"""
+
+import heapq
+import logging
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Due = Tuple[datetime, str]
+
+class DeadlineScheduler:
+    """Min-heap of ``(due, key)`` over the window ``[cursor, loaded_until]``.
+
+    ``load_window(start, end, limit)`` returns up to ``limit`` ``(due, key)``
+    pairs with ``start <= due <= end`` (no lower bound when ``start`` is
+    None) in due order. ``fire(keys)`` handles one batch of due keys and
+    returns the ones that failed.
+    """
+
+    def __init__(
+        self,
+        load_window: Callable[[Optional[datetime], datetime, int], Awaitable[List[Due]]],
+        fire: Callable[[List[str]], Awaitable[List[str]]],
+        load_cursor: Callable[[], Awaitable[Optional[datetime]]],
+        save_cursor: Callable[[datetime], Awaitable[None]],
+        horizon: float,
+        refresh_interval: float,
+        batch_size: int,
+        max_loaded: int,
+    ):
+        self.load_window = load_window
+        self.fire = fire
+        self.load_cursor = load_cursor
+        self.save_cursor = save_cursor
+        self.horizon = timedelta(seconds=horizon)
+        self.refresh_interval = timedelta(seconds=refresh_interval)
+        self.batch_size = batch_size
+        self.max_loaded = max_loaded
+        self.cursor: Optional[datetime] = None
+        self.loaded_until: Optional[datetime] = None
+        self._next_refresh: Optional[datetime] = None
+        self._heap: List[Due] = []
+        # Latest due time per key; heap entries that disagree are stale
+        self._due: Dict[str, datetime] = {}
+        # Keys whose firing failed, with the earliest due time that failed
+        self._retry: Dict[str, datetime] = {}
+        # Latest due time handed to ``fire``
+        self._fired_until: Optional[datetime] = None
+
+    def __len__(self) -> int:
+        return len(self._due)
+
+    def schedule(self, key: str, due: Optional[datetime]):
+        """Record a new due time for ``key`` (None when it has none)."""
+        if due is None:
+            self._due.pop(key, None)
+            self._retry.pop(key, None)
+            return
+        if self.loaded_until is None or due > self.loaded_until:
+            # Outside the loaded window: a later refresh reads it from the index
+            self._due.pop(key, None)
+            return
+        if self._due.get(key) == due:
+            return
+        self._due[key] = due
+        heapq.heappush(self._heap, (due, key))
+
+    async def refresh(self, now: datetime):
+        stored = await self.load_cursor()
+        if stored is not None and (self.cursor is None or stored > self.cursor):
+            self.cursor = stored
+        until = now + self.horizon
+        rows = await self.load_window(self.cursor, until, self.max_loaded)
+        self.loaded_until = until
+        if len(rows) >= self.max_loaded:
+            # Too many to hold at once: stop the window at the last one loaded
+            self.loaded_until = rows[-1][0]
+        for due, key in rows:
+            self.schedule(key, due)
+        # Failed keys no longer due (changed elsewhere) stop holding the cursor back
+        loaded = {key for _, key in rows}
+        for key in [key for key in self._retry if key not in loaded]:
+            del self._retry[key]
+        self._next_refresh = now + self.refresh_interval
+
+    def _pop_due(self, now: datetime) -> List[Due]:
+        popped: List[Due] = []
+        while self._heap and self._heap[0][0] <= now:
+            due, key = heapq.heappop(self._heap)
+            if self._due.get(key) != due:
+                continue
+            del self._due[key]
+            popped.append((due, key))
+        return popped
+
+    async def tick(self, now: Optional[datetime] = None) -> int:
+        """Fire everything due by ``now``; returns how many keys were fired."""
+        now = now or datetime.utcnow()
+        if self._next_refresh is None or now >= self._next_refresh:
+            await self.refresh(now)
+        # Only what was due when the tick started; keys rescheduled while
+        # firing wait for the next tick
+        due = self._pop_due(now)
+        fired = 0
+        for start in range(0, len(due), self.batch_size):
+            batch = due[start:start + self.batch_size]
+            keys = [key for _, key in batch]
+            try:
+                failed = set(await self.fire(keys))
+            except Exception as e:
+                logger.error(f"Deadline batch failed: {e}")
+                failed = set(keys)
+            for key_due, key in batch:
+                if key in failed:
+                    self._retry[key] = min(self._retry.get(key, key_due), key_due)
+                    if key not in self._due:
+                        self.schedule(key, key_due)
+                else:
+                    self._retry.pop(key, None)
+            fired += len(batch) - len(failed)
+            self._fired_until = max(self._fired_until or batch[-1][0], batch[-1][0])
+            # The cursor stays at the earliest failure so reloads include it
+            position = min([self._fired_until, *self._retry.values()])
+            if self.cursor is None or position > self.cursor:
+                self.cursor = position
+                await self.save_cursor(self.cursor)
+        if due:
+            logger.info(f"Deadlines fired: {fired}" + (f", {len(due) - fired} to retry" if fired < len(due) else ""))
+        return fired
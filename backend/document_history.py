@@ -0,0 +1,102 @@
+"""
+Delta-encoded version history for document instances.
+
+Each save of ``campos`` stores one history entry in its own collection/table
+instead of appending a full copy to the document row. Most entries are JSON
+patches (RFC 6902 ``add``/``remove``/``replace`` operations) against the
+previous version; every ``interval`` versions a keyframe with the full
+``campos`` is stored instead, so rebuilding any version applies at most
+``interval - 1`` patches to the nearest keyframe.
+"""
+
+import copy
+from typing import Any, Dict, Iterable, List
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+def json_diff(old: Any, new: Any, path: str = "") -> List[Dict[str, Any]]:
+    """Patch operations turning ``old`` into ``new``.
+
+    Objects are diffed key by key; any other changed value (including lists)
+    is replaced whole.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        operations = [{"op": "remove", "path": f"{path}/{_escape(key)}"} for key in old if key not in new]
+        for key, value in new.items():
+            child = f"{path}/{_escape(key)}"
+            if key not in old:
+                operations.append({"op": "add", "path": child, "value": value})
+            elif old[key] != value:
+                operations.extend(json_diff(old[key], value, child))
+        return operations
+    if old != new:
+        return [{"op": "replace", "path": path, "value": new}]
+    return []
+
+def _apply_in_place(document: Any, operations: Iterable[Dict[str, Any]]) -> Any:
+    for operation in operations:
+        path = operation["path"]
+        if path == "":
+            document = copy.deepcopy(operation["value"])
+            continue
+        tokens = [_unescape(token) for token in path.split("/")[1:]]
+        parent = document
+        for token in tokens[:-1]:
+            parent = parent[int(token)] if isinstance(parent, list) else parent[token]
+        last = tokens[-1]
+        if isinstance(parent, list):
+            last = int(last)
+        if operation["op"] == "remove":
+            del parent[last]
+        else:
+            parent[last] = copy.deepcopy(operation["value"])
+    return document
+
+def apply_patch(document: Any, operations: Iterable[Dict[str, Any]]) -> Any:
+    """Apply operations produced by ``json_diff``; ``document`` is not modified."""
+    return _apply_in_place(copy.deepcopy(document), operations)
+
+def is_keyframe(version: int, interval: int) -> bool:
+    """Version 1 and every ``interval`` versions after it are keyframes."""
+    return interval <= 1 or (version - 1) % interval == 0
+
+def history_entry(documento_id: str, version: int, previous: Dict[str, Any], campos: Dict[str, Any],
+                  interval: int, autor_id: str, force_keyframe: bool = False) -> Dict[str, Any]:
+    """Entry recording ``campos`` as ``version``; ``previous`` is version - 1.
+
+    ``force_keyframe`` is for versions with no recorded entry before them,
+    so there is nothing to apply a delta to.
+    """
+    entry = {"documento_id": documento_id, "version": version, "autor_id": autor_id}
+    if force_keyframe or is_keyframe(version, interval):
+        entry.update(tipo="keyframe", campos=campos)
+    else:
+        entry.update(tipo="delta", patch=json_diff(previous, campos))
+    return entry
+
+def rebuild_version(entries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Rebuild ``campos`` from a keyframe followed by its deltas, in version order."""
+    if not entries or entries[0]["tipo"] != "keyframe":
+        raise ValueError("history must start at a keyframe")
+    campos = copy.deepcopy(entries[0]["campos"])
+    for entry in entries[1:]:
+        campos = _apply_in_place(campos, entry["patch"])
+    return campos
+
+def summarize_entry(entry: Dict[str, Any]) -> Dict[str, Any]:
+    """Listing view of an entry: which top-level fields changed, without values."""
+    if entry["tipo"] == "keyframe":
+        campos_cambiados = sorted(entry.get("campos") or {})
+    else:
+        campos_cambiados = sorted({_unescape(op["path"].split("/")[1]) for op in entry.get("patch", []) if op["path"]})
+    return {
+        "version": entry["version"],
+        "tipo": entry["tipo"],
+        "autor_id": entry.get("autor_id"),
+        "campos_cambiados": campos_cambiados,
+        "created_at": entry.get("created_at"),
+    }
@@ -0,0 +1,108 @@
+"""
+Bulk creation of the documents suggested for an establishment.
+
+``prefill_campos`` fills a template's fields from the establishment profile
+(only values its compiled validator accepts). ``render_pdfs`` renders the
+created documents with bounded concurrency and reports progress after each
+one; ``JobRunner`` keeps those background jobs referenced and cancels them
+on shutdown.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Set
+
+from field_validators import TemplateValidator
+
+logger = logging.getLogger(__name__)
+
+# Template field name -> profile key it can be prefilled from
+PREFILL_SOURCES = {
+    "giro": "giro",
+    "servicios": "servicios",
+    "areas": "servicios",
+    "equipo_especial": "equipo_especial",
+    "equipos": "equipo_especial",
+    "numero_salas": "numero_salas",
+    "ubicacion_estado": "ubicacion_estado",
+    "estado": "ubicacion_estado",
+    "responsable": "responsable",
+    "razon_social": "razon_social",
+    "rfc": "rfc",
+}
+
+def prefill_campos(template: Dict[str, Any], validator: TemplateValidator, perfil: Dict[str, Any]) -> Dict[str, Any]:
+    """Initial ``campos`` for a template: profile values where they fit, empty otherwise."""
+    campos: Dict[str, Any] = {}
+    for name, config in (template.get("campos_definicion") or {}).items():
+        source = PREFILL_SOURCES.get(name)
+        value = perfil.get(source) if source else None
+        if value is not None and validator.accepts(name, value):
+            campos[name] = value
+        else:
+            campos[name] = [] if isinstance(config, dict) and config.get("type") == "array" else ""
+    return campos
+
+async def render_pdfs(
+    documents: Iterable[Dict[str, Any]],
+    render_one: Callable[[Dict[str, Any]], Awaitable[None]],
+    progress: Callable[[int, int], Awaitable[None]],
+    concurrency: int,
+):
+    """Render every document, at most ``concurrency`` at a time.
+
+    ``progress(generados, fallidos)`` is called with the running totals after
+    each document; a failed render is counted and does not stop the rest.
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    counts = {"generados": 0, "fallidos": 0}
+    lock = asyncio.Lock()
+
+    async def run(document: Dict[str, Any]):
+        async with semaphore:
+            try:
+                await render_one(document)
+                outcome = "generados"
+            except Exception as e:
+                logger.warning(f"PDF render failed for document {document.get('id')}: {e}")
+                outcome = "fallidos"
+        # Serialized so totals are written in increasing order
+        async with lock:
+            counts[outcome] += 1
+            await progress(counts["generados"], counts["fallidos"])
+
+    await asyncio.gather(*(run(document) for document in documents))
+
+class JobRunner:
+    """Keeps references to running background jobs."""
+
+    def __init__(self):
+        self._tasks: Set[asyncio.Task] = set()
+
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    def start(self, job: Awaitable[None], name: Optional[str] = None) -> asyncio.Task:
+        task = asyncio.ensure_future(job)
+        self._tasks.add(task)
+        task.add_done_callback(self._finished)
+        if name:
+            task.set_name(name)
+        return task
+
+    def _finished(self, task: asyncio.Task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Background job {task.get_name()} failed: {task.exception()}")
+
+    async def stop(self, timeout: float = 10.0):
+        """Give running jobs ``timeout`` seconds to finish, then cancel them."""
+        if not self._tasks:
+            return
+        pending: List[asyncio.Task] = list(self._tasks)
+        _, still_running = await asyncio.wait(pending, timeout=timeout)
+        for task in still_running:
+            task.cancel()
+        if still_running:
+            logger.warning(f"Cancelled {len(still_running)} background jobs on shutdown")
+            await asyncio.gather(*still_running, return_exceptions=True)
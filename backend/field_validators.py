@@ -0,0 +1,197 @@
+"""
+Validation of document ``campos`` against a template's ``campos_definicion``.
+
+Each definition is compiled once into a ``TemplateValidator``: one check
+function per field with its options already turned into sets and its
+patterns compiled, plus the list of required fields. ``ValidatorCache``
+keeps one validator per template and rebuilds it when the template version
+changes. Results are per field and go into ``DocumentInstance.validaciones``.
+"""
+
+import logging
+import re
+from collections import OrderedDict
+from datetime import date
+from typing import Any, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Check = Callable[[Any], Optional[str]]
+
+REQUIRED_MESSAGE = "Este campo es obligatorio"
+
+def _is_empty(value: Any) -> bool:
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return not value.strip()
+    if isinstance(value, (list, dict)):
+        return not value
+    return False
+
+def _compile_text(config: Dict[str, Any]) -> Check:
+    min_length, max_length = config.get("min_length"), config.get("max_length")
+    pattern = None
+    if config.get("pattern"):
+        try:
+            pattern = re.compile(config["pattern"])
+        except re.error as e:
+            # A broken template pattern must not block saving its documents
+            logger.error(f"Ignoring invalid pattern {config['pattern']!r} in campos_definicion: {e}")
+
+    def check(value: Any) -> Optional[str]:
+        if not isinstance(value, str):
+            return "Debe ser texto"
+        if min_length is not None and len(value) < min_length:
+            return f"Debe tener al menos {min_length} caracteres"
+        if max_length is not None and len(value) > max_length:
+            return f"Debe tener como máximo {max_length} caracteres"
+        if pattern is not None and not pattern.fullmatch(value):
+            return "Formato inválido"
+        return None
+    return check
+
+def _compile_select(config: Dict[str, Any]) -> Check:
+    options = frozenset(config.get("options") or ())
+
+    def check(value: Any) -> Optional[str]:
+        if not isinstance(value, str) or (options and value not in options):
+            return "Opción no válida"
+        return None
+    return check
+
+def _compile_array(config: Dict[str, Any]) -> Check:
+    min_items, max_items = config.get("min_items"), config.get("max_items")
+    options = frozenset(config.get("options") or ())
+
+    def check(value: Any) -> Optional[str]:
+        if not isinstance(value, list):
+            return "Debe ser una lista"
+        if min_items is not None and len(value) < min_items:
+            return f"Debe tener al menos {min_items} elementos"
+        if max_items is not None and len(value) > max_items:
+            return f"Debe tener como máximo {max_items} elementos"
+        if options:
+            invalid = [item for item in value if not isinstance(item, str) or item not in options]
+            if invalid:
+                return f"Opciones no válidas: {', '.join(map(str, invalid))}"
+        elif any(not isinstance(item, str) or not item.strip() for item in value):
+            return "Los elementos deben ser texto no vacío"
+        return None
+    return check
+
+def _compile_number(config: Dict[str, Any]) -> Check:
+    minimum, maximum = config.get("min"), config.get("max")
+    integer = config.get("type") == "integer"
+
+    def check(value: Any) -> Optional[str]:
+        if isinstance(value, bool) or not isinstance(value, (int, float)) or (integer and not isinstance(value, int)):
+            return "Debe ser un número entero" if integer else "Debe ser un número"
+        if minimum is not None and value < minimum:
+            return f"Debe ser mayor o igual a {minimum}"
+        if maximum is not None and value > maximum:
+            return f"Debe ser menor o igual a {maximum}"
+        return None
+    return check
+
+def _compile_boolean(config: Dict[str, Any]) -> Check:
+    def check(value: Any) -> Optional[str]:
+        return None if isinstance(value, bool) else "Debe ser sí o no"
+    return check
+
+def _compile_date(config: Dict[str, Any]) -> Check:
+    def check(value: Any) -> Optional[str]:
+        try:
+            date.fromisoformat(value[:10])
+        except (TypeError, ValueError):
+            return "Fecha inválida (AAAA-MM-DD)"
+        return None
+    return check
+
+def _accept(value: Any) -> Optional[str]:
+    return None
+
+_COMPILERS: Dict[str, Callable[[Dict[str, Any]], Check]] = {
+    "string": _compile_text,
+    "text": _compile_text,
+    "textarea": _compile_text,
+    "select": _compile_select,
+    "array": _compile_array,
+    "number": _compile_number,
+    "integer": _compile_number,
+    "boolean": _compile_boolean,
+    "date": _compile_date,
+}
+
+def schema_version(template: Dict[str, Any]) -> str:
+    """Version of a template's field definitions; templates are rewritten with a new updated_at."""
+    return f"{template.get('updated_at')}:{len(template.get('versiones') or ())}"
+
+class TemplateValidator:
+    """Compiled ``campos_definicion``. Fields of unknown type only get the required check."""
+
+    def __init__(self, campos_definicion: Dict[str, Any]):
+        self.checks: Dict[str, Check] = {}
+        for name, config in campos_definicion.items():
+            config = config if isinstance(config, dict) else {}
+            compiler = _COMPILERS.get(config.get("type"))
+            self.checks[name] = compiler(config) if compiler else _accept
+        self.required = tuple(
+            name for name, config in campos_definicion.items() if isinstance(config, dict) and config.get("required")
+        )
+        self._required_set = frozenset(self.required)
+
+    def validate(self, campos: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+        """Per-field results for every defined field, or only ``fields`` if given.
+
+        Fields not in the definition are left out.
+        """
+        names = self.checks if fields is None else [name for name in fields if name in self.checks]
+        results: Dict[str, Dict[str, Any]] = {}
+        for name in names:
+            value = campos.get(name)
+            if _is_empty(value):
+                error = REQUIRED_MESSAGE if name in self._required_set else None
+            else:
+                error = self.checks[name](value)
+            results[name] = {"valido": False, "mensaje": error} if error else {"valido": True}
+        return results
+
+    def accepts(self, name: str, value: Any) -> bool:
+        """Whether ``value`` is a valid, non-empty value for defined field ``name``."""
+        return name in self.checks and not _is_empty(value) and self.checks[name](value) is None
+
+    def missing(self, campos: Dict[str, Any]) -> Tuple[str, ...]:
+        """Required fields that are empty in ``campos``."""
+        return tuple(name for name in self.required if _is_empty(campos.get(name)))
+
+class ValidatorCache:
+    """Compiled validators by template id, least recently used evicted first."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, TemplateValidator]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, template: Dict[str, Any]) -> TemplateValidator:
+        template_id = template["id"]
+        version = schema_version(template)
+        entry = self._entries.get(template_id)
+        if entry is not None and entry[0] == version:
+            self._entries.move_to_end(template_id)
+            return entry[1]
+        # New template or new version: the stale validator is replaced
+        validator = TemplateValidator(template.get("campos_definicion") or {})
+        self._entries[template_id] = (version, validator)
+        self._entries.move_to_end(template_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return validator
+
+    def invalidate(self, template_id: Optional[str] = None):
+        if template_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(template_id, None)
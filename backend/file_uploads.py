@@ -0,0 +1,168 @@
+"""
+Streaming receipt of uploaded files.
+
+``receive_upload`` parses a multipart/form-data body straight from the
+request stream instead of letting the framework buffer it: every chunk of
+the ``file`` part is hashed (SHA-256) and appended to a temporary file as it
+arrives, so memory use is bounded by the chunk size whatever the file size,
+and the content hash is known as soon as the body ends.
+
+Stored objects are addressed by that hash (``blob_path``), so identical files
+uploaded by different users or branches are kept once; per-user metadata
+(name, folder) lives in its own rows pointing at the blob.
+"""
+
+import asyncio
+import hashlib
+import mimetypes
+import os
+import tempfile
+from pathlib import Path
+from typing import AsyncIterator, Dict, List, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+
+FILE_FIELD = b"file"
+# Limit for the plain form fields sent with the file (e.g. the folder)
+MAX_FIELD_SIZE = 4096
+
+class MalformedUpload(Exception):
+    """The body is not a multipart upload with exactly one ``file`` part."""
+
+class UploadTooLarge(Exception):
+    """The file part exceeds the maximum size."""
+
+class ReceivedUpload:
+    """A file received to a temporary path, with its hash and form fields."""
+
+    def __init__(self, spool_dir: Path):
+        spool_dir.mkdir(parents=True, exist_ok=True)
+        fd, path = tempfile.mkstemp(prefix="upload-", dir=spool_dir)
+        self.file = os.fdopen(fd, "wb")
+        self.path = Path(path)
+        self.filename: Optional[str] = None
+        self.content_type = "application/octet-stream"
+        self.size = 0
+        self.fields: Dict[str, str] = {}
+        self.digest = hashlib.sha256()
+
+    @property
+    def sha256(self) -> str:
+        return self.digest.hexdigest()
+
+    def discard(self):
+        self.file.close()
+        self.path.unlink(missing_ok=True)
+
+def blob_path(sha256: str) -> str:
+    """Storage path of the content with the given hash."""
+    return f"blobs/{sha256[:2]}/{sha256}"
+
+class _UploadParser:
+    """``MultipartParser`` callbacks; file data is queued and written by ``receive_upload``."""
+
+    def __init__(self, upload: ReceivedUpload, max_size: int):
+        self.upload = upload
+        self.max_size = max_size
+        self.pending: List[bytes] = []
+        self._header_name = b""
+        self._header_value = b""
+        self._headers: Dict[bytes, bytes] = {}
+        self._field: Optional[str] = None
+        self._field_data = b""
+        self._in_file = False
+
+    def on_part_begin(self):
+        self._headers = {}
+        self._field = None
+        self._field_data = b""
+        self._in_file = False
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._headers[self._header_name.lower()] = self._header_value
+        self._header_name = b""
+        self._header_value = b""
+
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name")
+        if name is None:
+            raise MalformedUpload("Parte del formulario sin nombre")
+        if name == FILE_FIELD and b"filename" in options:
+            if self.upload.filename is not None:
+                raise MalformedUpload("Solo se permite un archivo por solicitud")
+            self._in_file = True
+            self.upload.filename = Path(options[b"filename"].decode("utf-8", "replace")).name or "archivo"
+            content_type = self._headers.get(b"content-type", b"").decode("latin-1").strip()
+            guessed, _ = mimetypes.guess_type(self.upload.filename)
+            self.upload.content_type = content_type or guessed or "application/octet-stream"
+        else:
+            self._field = name.decode("utf-8", "replace")
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        chunk = data[start:end]
+        if self._in_file:
+            self.upload.size += len(chunk)
+            if self.upload.size > self.max_size:
+                raise UploadTooLarge()
+            self.upload.digest.update(chunk)
+            self.pending.append(chunk)
+        elif self._field is not None:
+            self._field_data += chunk
+            if len(self._field_data) > MAX_FIELD_SIZE:
+                raise MalformedUpload(f"El campo {self._field} es demasiado largo")
+
+    def on_part_end(self):
+        if self._field is not None:
+            self.upload.fields[self._field] = self._field_data.decode("utf-8", "replace")
+
+async def receive_upload(content_type: str, stream: AsyncIterator[bytes], spool_dir: Path, max_size: int) -> ReceivedUpload:
+    """Read a multipart body with a ``file`` part from ``stream``.
+
+    The caller owns the returned upload and must ``discard()`` it. Raises
+    ``MalformedUpload`` or ``UploadTooLarge``; the temporary file is removed
+    in that case.
+    """
+    mime, params = parse_options_header(content_type or "")
+    boundary = params.get(b"boundary")
+    if mime != b"multipart/form-data" or not boundary:
+        raise MalformedUpload("Se esperaba un formulario multipart/form-data")
+
+    upload = ReceivedUpload(spool_dir)
+    handler = _UploadParser(upload, max_size)
+    parser = MultipartParser(boundary, {
+        "on_part_begin": handler.on_part_begin,
+        "on_part_data": handler.on_part_data,
+        "on_part_end": handler.on_part_end,
+        "on_header_field": handler.on_header_field,
+        "on_header_value": handler.on_header_value,
+        "on_header_end": handler.on_header_end,
+        "on_headers_finished": handler.on_headers_finished,
+    })
+    try:
+        async for chunk in stream:
+            parser.write(chunk)
+            if handler.pending:
+                data = b"".join(handler.pending)
+                handler.pending.clear()
+                # Disk writes stay off the event loop
+                await asyncio.to_thread(upload.file.write, data)
+        parser.finalize()
+        if upload.filename is None:
+            raise MalformedUpload("Falta el archivo")
+        await asyncio.to_thread(upload.file.close)
+    except MultipartParseError as e:
+        upload.discard()
+        raise MalformedUpload(f"Formulario inválido: {e}")
+    except Exception:
+        upload.discard()
+        raise
+    return upload
@@ -0,0 +1,86 @@
+"""
+Periodic background work that must run in a single worker.
+
+Every worker starts the task, but each tick first takes (or renews) a named
+lease in the database; only the holder runs the work. A lease outlives a few
+ticks, so a crashed holder is replaced once its lease expires.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+def lease_owner() -> str:
+    """Identifier for this worker process."""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+class LeasedTask:
+    """Run ``run_once`` every ``interval`` seconds while holding lease ``name``.
+
+    ``acquire(name, owner, ttl)`` must atomically take the lease if it is free,
+    expired or already held by ``owner``, and return whether it did.
+    ``release(name, owner)`` drops it on shutdown so another worker can take
+    over without waiting for the TTL.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        run_once: Callable[[], Awaitable[None]],
+        acquire: Callable[[str, str, float], Awaitable[bool]],
+        release: Callable[[str, str], Awaitable[None]],
+        interval: float,
+        lease_ttl: Optional[float] = None,
+    ):
+        self.name = name
+        self.run_once = run_once
+        self.acquire = acquire
+        self.release = release
+        self.interval = interval
+        self.lease_ttl = lease_ttl if lease_ttl is not None else interval * 3
+        self.owner = lease_owner()
+        self._task: Optional[asyncio.Task] = None
+
+    async def renew(self) -> bool:
+        """Extend the lease during a long run; False means it was lost."""
+        return await self.acquire(self.name, self.owner, self.lease_ttl)
+
+    async def tick(self) -> bool:
+        """Run once if the lease can be taken; returns whether it ran."""
+        if not await self.renew():
+            return False
+        await self.run_once()
+        return True
+
+    async def run(self):
+        while True:
+            try:
+                await self.tick()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"{self.name} failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None and self.interval > 0:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        try:
+            await self.release(self.name, self.owner)
+        except Exception as e:
+            logger.warning(f"Could not release lease {self.name}: {e}")
@@ -0,0 +1,356 @@
+"""
+SQLite-backed stand-in for the Supabase client, for demo and test mode.
+
+Implements the same table / auth / storage surface as the in-memory mock
+classes in server_supabase.py, but keeps everything in one SQLite file in WAL
+mode. Every uvicorn worker opens the same file, so users, rows and uploaded
+objects are shared across workers and survive restarts.
+
+Rows are stored as JSON documents per table; equality-filtered columns get a
+JSON expression index the first time they are filtered on.
+"""
+
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS rows (
+    tabla TEXT NOT NULL,
+    id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (tabla, id)
+);
+CREATE TABLE IF NOT EXISTS auth_users (
+    email TEXT PRIMARY KEY,
+    id TEXT NOT NULL,
+    password TEXT,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS storage_objects (
+    bucket TEXT NOT NULL,
+    path TEXT NOT NULL,
+    data BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    updated_at TEXT NOT NULL,
+    PRIMARY KEY (bucket, path)
+);
+"""
+
+_COLUMN_NAME = re.compile(r"^[A-Za-z_][A-Za-z0-9_]*$")
+
+class LocalAPIError(Exception):
+    """Raised for constraint violations, like PostgREST's APIError."""
+
+class LocalResponse:
+    def __init__(self, data, error=None):
+        self.data = data if data is not None else []
+        self.error = error
+    
+    def execute(self):
+        return self
+
+class LocalDatabase:
+    """One SQLite connection per process, serialized with a lock."""
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.RLock()
+        self.indexed_columns = set()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+    
+    @property
+    def conn(self) -> sqlite3.Connection:
+        # Reconnect after fork: SQLite connections must not be shared across processes
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.executescript(_SCHEMA)
+            self._conn = conn
+            self._pid = os.getpid()
+            self.indexed_columns = set()
+        return self._conn
+    
+    def ensure_index(self, column: str):
+        if column in self.indexed_columns:
+            return
+        with self.lock:
+            self.conn.execute(
+                f"CREATE INDEX IF NOT EXISTS idx_rows_{column} ON rows (tabla, json_extract(data, '$.{column}'))"
+            )
+            self.indexed_columns.add(column)
+
+def _column(column: str) -> str:
+    if not _COLUMN_NAME.match(column):
+        raise ValueError(f"Invalid column name: {column}")
+    return column
+
+def _json_default(value):
+    return value.isoformat() if isinstance(value, datetime) else str(value)
+
+def _sql_value(value):
+    """Bind a Python filter value the way json_extract returns the stored one."""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, separators=(",", ":"), default=_json_default)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+class LocalTable:
+    def __init__(self, db: LocalDatabase, name: str):
+        self.db = db
+        self.name = name
+    
+    def _prepare(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        row = row.copy()  # Don't modify original
+        row.setdefault("id", str(uuid.uuid4()))
+        row["created_at"] = datetime.utcnow().isoformat()
+        row["updated_at"] = datetime.utcnow().isoformat()
+        # Round-trip through JSON so stored and returned rows look alike
+        return json.loads(json.dumps(row, default=_json_default))
+    
+    def insert(self, data):
+        # Accept a single row or a list of rows, like the PostgREST builder
+        rows = [self._prepare(row) for row in (data if isinstance(data, list) else [data]) if isinstance(row, dict)]
+        with self.db.lock:
+            try:
+                with self.db.conn:
+                    self.db.conn.execute("BEGIN")
+                    self.db.conn.executemany(
+                        "INSERT INTO rows (tabla, id, data) VALUES (?, ?, ?)",
+                        [(self.name, str(row["id"]), json.dumps(row)) for row in rows]
+                    )
+            except sqlite3.IntegrityError as e:
+                raise LocalAPIError(f"duplicate key value in {self.name}: {e}")
+        return LocalResponse(rows)
+    
+    def upsert(self, data, on_conflict="id"):
+        rows = [self._prepare(row) for row in (data if isinstance(data, list) else [data]) if isinstance(row, dict)]
+        with self.db.lock:
+            with self.db.conn:
+                self.db.conn.execute("BEGIN")
+                self.db.conn.executemany(
+                    "INSERT INTO rows (tabla, id, data) VALUES (?, ?, ?) "
+                    "ON CONFLICT (tabla, id) DO UPDATE SET data = excluded.data",
+                    [(self.name, str(row["id"]), json.dumps(row)) for row in rows]
+                )
+        return LocalResponse(rows)
+    
+    def select(self, columns="*"):
+        return LocalQuery(self, columns=columns)
+    
+    def update(self, data):
+        return LocalQuery(self, operation="update", payload=data)
+    
+    def delete(self):
+        return LocalQuery(self, operation="delete")
+
+class LocalQuery:
+    """Chainable query with the same semantics as MockQuery, compiled to SQL."""
+    _OPERATORS = {"eq": "=", "neq": "!=", "gt": ">", "gte": ">=", "lt": "<", "lte": "<="}
+    
+    def __init__(self, table: LocalTable, operation="select", columns="*", payload=None):
+        self.table = table
+        self.operation = operation
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",") if c.strip()]
+        self.payload = payload
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.limit_count = None
+    
+    def _filter(self, op, column, value):
+        self.filters.append((op, _column(column), value))
+        return self
+    
+    def eq(self, column, value):
+        return self._filter("eq", column, value)
+    
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+    
+    def in_(self, column, values):
+        return self._filter("in", column, list(values))
+    
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+    
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+    
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+    
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+    
+    def order(self, column, desc=False):
+        self.orders.append((_column(column), desc))
+        return self
+    
+    def limit(self, count):
+        self.limit_count = count
+        return self
+    
+    def range(self, start, end):
+        # Inclusive bounds, as in PostgREST
+        self.offset = start
+        self.limit_count = end - start + 1
+        return self
+    
+    def _where(self):
+        clauses = ["tabla = ?"]
+        params: List[Any] = [self.table.name]
+        for op, column, value in self.filters:
+            expression = f"json_extract(data, '$.{column}')"
+            if op in ("eq", "in"):
+                self.table.db.ensure_index(column)
+            if op == "in":
+                if not value:
+                    clauses.append("0")
+                    continue
+                clauses.append(f"{expression} IN ({', '.join('?' for _ in value)})")
+                params.extend(_sql_value(v) for v in value)
+            else:
+                clauses.append(f"{expression} {self._OPERATORS[op]} ?")
+                params.append(_sql_value(value))
+        return " AND ".join(clauses), params
+    
+    def _project(self, row):
+        if self.columns is None:
+            return row
+        return {column: row.get(column) for column in self.columns}
+    
+    def execute(self):
+        db = self.table.db
+        where, params = self._where()
+        
+        with db.lock:
+            if self.operation == "select":
+                sql = f"SELECT data FROM rows WHERE {where}"
+                if self.orders:
+                    # Nulls last ascending, first descending (PostgreSQL default)
+                    sql += " ORDER BY " + ", ".join(
+                        f"json_extract(data, '$.{column}') IS NULL {'DESC' if desc else 'ASC'}, "
+                        f"json_extract(data, '$.{column}') {'DESC' if desc else 'ASC'}"
+                        for column, desc in self.orders
+                    )
+                if self.offset or self.limit_count is not None:
+                    sql += " LIMIT ? OFFSET ?"
+                    params += [-1 if self.limit_count is None else self.limit_count, self.offset]
+                rows = [json.loads(data) for (data,) in db.conn.execute(sql, params)]
+                return LocalResponse([self._project(row) for row in rows])
+            
+            with db.conn:
+                db.conn.execute("BEGIN IMMEDIATE")
+                matched = [json.loads(data) for (data,) in db.conn.execute(f"SELECT data FROM rows WHERE {where}", params)]
+                if self.operation == "delete":
+                    db.conn.execute(f"DELETE FROM rows WHERE {where}", params)
+                    return LocalResponse(matched)
+                
+                payload = json.loads(json.dumps(self.payload, default=_json_default))
+                updated = []
+                for row in matched:
+                    row = {**row, **payload, "updated_at": datetime.utcnow().isoformat(), "id": row["id"]}
+                    db.conn.execute(
+                        "UPDATE rows SET data = ? WHERE tabla = ? AND id = ?",
+                        (json.dumps(row), self.table.name, str(row["id"]))
+                    )
+                    updated.append(row)
+                return LocalResponse(updated)
+
+class LocalAuth:
+    """Same demo semantics as MockAuth, persisted in SQLite."""
+    def __init__(self, db: LocalDatabase):
+        self.db = db
+    
+    def _get(self, email):
+        row = self.db.conn.execute("SELECT id, created_at FROM auth_users WHERE email = ?", (email,)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "email": email, "created_at": row[1]}
+    
+    def _create(self, email, password):
+        user_id = str(uuid.uuid4())
+        with self.db.conn:
+            cursor = self.db.conn.execute(
+                "INSERT OR IGNORE INTO auth_users (email, id, password, created_at) VALUES (?, ?, ?, ?)",
+                (email, user_id, password, datetime.utcnow().isoformat())
+            )
+        return cursor.rowcount == 1
+    
+    def sign_up(self, credentials):
+        email = credentials.get("email")
+        with self.db.lock:
+            if not self._create(email, credentials.get("password")):
+                return LocalResponse(None, error="User already exists")
+            user = self._get(email)
+        return LocalResponse({"user": user, "session": {"access_token": f"mock_token_{user['id']}"}})
+    
+    def sign_in_with_password(self, credentials):
+        email = credentials.get("email")
+        with self.db.lock:
+            # For demo, unknown emails are registered on the fly and any password is accepted
+            self._create(email, credentials.get("password"))
+            user = self._get(email)
+        return LocalResponse({"user": user, "session": {"access_token": f"mock_token_{user['id']}"}})
+
+class LocalBucket:
+    def __init__(self, db: LocalDatabase, name: str):
+        self.db = db
+        self.bucket_name = name
+    
+    def upload(self, path, file_data, file_options=None):
+        if isinstance(file_data, (str, os.PathLike)):
+            with open(file_data, "rb") as f:
+                file_data = f.read()
+        elif hasattr(file_data, "read"):
+            file_data = file_data.read()
+        with self.db.lock:
+            with self.db.conn:
+                self.db.conn.execute(
+                    "INSERT INTO storage_objects (bucket, path, data, size, updated_at) VALUES (?, ?, ?, ?, ?) "
+                    "ON CONFLICT (bucket, path) DO UPDATE SET data = excluded.data, size = excluded.size, updated_at = excluded.updated_at",
+                    (self.bucket_name, path, file_data, len(file_data), datetime.utcnow().isoformat())
+                )
+        return LocalResponse({"path": path, "size": len(file_data)})
+    
+    def download(self, path):
+        with self.db.lock:
+            row = self.db.conn.execute(
+                "SELECT data FROM storage_objects WHERE bucket = ? AND path = ?", (self.bucket_name, path)
+            ).fetchone()
+        if row is None:
+            raise LocalAPIError(f"Object not found: {self.bucket_name}/{path}")
+        return row[0]
+    
+    def create_signed_url(self, path, expires_in=3600):
+        # Plain dicts, like storage3
+        url = f"https://mock-storage.supabase.co/{self.bucket_name}/{path}?expires_in={expires_in}"
+        return {"signedURL": url, "signedUrl": url}
+    
+    def create_signed_urls(self, paths, expires_in=3600):
+        return [{"path": path, "error": None, **self.create_signed_url(path, expires_in)} for path in paths]
+
+class LocalStorage:
+    def __init__(self, db: LocalDatabase):
+        self.db = db
+    
+    def from_(self, bucket):
+        return LocalBucket(self.db, bucket)
+
+class LocalSupabaseClient:
+    def __init__(self, path: str):
+        self.db = LocalDatabase(path)
+        self.auth = LocalAuth(self.db)
+        self.storage = LocalStorage(self.db)
+    
+    def table(self, name):
+        return LocalTable(self.db, name)
@@ -1,18 +1,22 @@
-<file>
-      <absolute_file_name>/app/backend/migrate_to_supabase.py</absolute_file_name>
-      <content>#!/usr/bin/env python3
+#!/usr/bin/env python3
 """
 Migration script to transfer data from MongoDB to Supabase
 for COFEPRIS Compliance Application
 """
 
+import argparse
 import asyncio
+import hashlib
 import os
 import json
-from datetime import datetime
+import re
+import time
+import uuid
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Optional, Set, Tuple
 
+from bson import json_util
 from dotenv import load_dotenv
 from motor.motor_asyncio import AsyncIOMotorClient
 from supabase import create_client, Client
@@ -34,6 +38,51 @@ DB_NAME = os.environ.get('DB_NAME', 'test_database')
 SUPABASE_URL = os.environ.get('SUPABASE_URL')
 SUPABASE_SERVICE_KEY = os.environ.get('SUPABASE_SERVICE_KEY')
 
+# Rows sent per insert request; override with --batch-size
+DEFAULT_BATCH_SIZE = int(os.environ.get('MIGRATION_BATCH_SIZE', '500'))
+
+# Converted batches allowed to wait for upload while Mongo keeps reading.
+# Memory per collection is bounded by roughly (depth + 2) * batch_size documents.
+PIPELINE_DEPTH = int(os.environ.get('MIGRATION_PIPELINE_DEPTH', '4'))
+
+# Collections migrated at the same time; override with --concurrency
+DEFAULT_CONCURRENCY = int(os.environ.get('MIGRATION_CONCURRENCY', '4'))
+
+# Foreign keys in this schema decide which tables must be loaded first
+SCHEMA_PATH = ROOT_DIR / 'supabase_schema.sql'
+
+# Per-collection progress, so an interrupted run can resume; override with --checkpoint-file
+DEFAULT_CHECKPOINT_FILE = ROOT_DIR / 'migration_checkpoint.json'
+
+# Namespace for ids derived from Mongo _id when a document has no "id" field,
+# so re-running the migration upserts the same rows instead of duplicating them
+MONGO_ID_NAMESPACE = uuid.UUID('6f1c2a52-8d0e-4c5b-9a43-7f3b1e0c9d21')
+
+# Collection to table mappings
+MIGRATION_MAPPING = {
+    'usuarios': 'users',
+    'establecimientos': 'establishments',
+    'documento_plantillas': 'document_templates',
+    'tramites': 'tramites',
+    'reglas_sugerencia': 'suggestion_rules',
+    'selecciones': 'selections',
+    'documento_instancias': 'document_instances',
+    'documento_versiones': 'document_versions',
+    'expediente': 'expediente',
+    'curso_modulos': 'course_modules',
+    'curso_progreso': 'course_progress',
+    'consultas': 'consultations'
+}
+
+# Verification: rows are bucketed by the first VERIFY_PREFIX_LENGTH hex chars
+# of their id; mismatched buckets are then compared row by row
+VERIFY_PREFIX_LENGTH = 2
+VERIFY_PAGE_SIZE = int(os.environ.get('VERIFY_PAGE_SIZE', '1000'))
+VERIFY_MAX_REPORTED_IDS = 20
+
+# Columns maintained by database triggers, which never match the source
+VERIFY_IGNORED_COLUMNS = {'updated_at'}
+
 # Initialize clients
 mongo_client = AsyncIOMotorClient(MONGO_URL)
 mongo_db = mongo_client[DB_NAME]
@@ -44,16 +93,219 @@ else:
     logger.warning("Supabase configuration not found. Running in demo mode.")
     supabase = None
 
+def load_table_dependencies(schema_path: Path = SCHEMA_PATH) -> Dict[str, Set[str]]:
+    """Map each table in the schema to the tables its foreign keys reference."""
+    dependencies: Dict[str, Set[str]] = {}
+    sql = schema_path.read_text(encoding='utf-8')
+    for match in re.finditer(r'CREATE TABLE IF NOT EXISTS public\.(\w+)\s*\((.*?)\n\);', sql, re.S):
+        table_name, body = match.groups()
+        referenced = set(re.findall(r'REFERENCES public\.(\w+)', body))
+        dependencies[table_name] = referenced - {table_name}
+    return dependencies
+
+def load_uuid_id_tables(schema_path: Path = SCHEMA_PATH) -> Set[str]:
+    """Tables in the schema whose ``id`` column is a UUID."""
+    sql = schema_path.read_text(encoding='utf-8')
+    return {
+        table_name
+        for table_name, body in re.findall(r'CREATE TABLE IF NOT EXISTS public\.(\w+)\s*\((.*?)\n\);', sql, re.S)
+        if re.search(r'^\s*id\s+UUID\b', body, re.M | re.I)
+    }
+
+def id_lower_bound(prefix: str, uuid_ids: bool) -> str:
+    """Smallest id starting with ``prefix``; UUID columns reject partial values."""
+    if uuid_ids and re.fullmatch(r'[0-9a-f]{1,32}', prefix):
+        return str(uuid.UUID(prefix.ljust(32, '0')))
+    return prefix
+
+def check_acyclic(dependencies: Dict[str, Set[str]]) -> List[List[str]]:
+    """Group tables into dependency levels, raising ValueError on FK cycles."""
+    remaining = {table: set(deps) for table, deps in dependencies.items()}
+    levels = []
+    while remaining:
+        ready = sorted(table for table, deps in remaining.items() if not deps)
+        if not ready:
+            raise ValueError(f"Foreign key cycle between tables: {', '.join(sorted(remaining))}")
+        levels.append(ready)
+        for table in ready:
+            del remaining[table]
+        for deps in remaining.values():
+            deps.difference_update(ready)
+    return levels
+
+_ISO_TIMESTAMP = re.compile(r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}:\d{2}')
+_DIGEST_MODULUS = 1 << 128
+
+def canonical_value(value: Any) -> Any:
+    """Normalize a value so Mongo and Postgres representations compare equal.
+    
+    Empty values (None, "", [], {}) are dropped, since the schema fills them in
+    as column defaults; timestamps become naive UTC with millisecond precision
+    (Mongo's resolution) and integral floats become ints (numeric columns).
+    """
+    if isinstance(value, dict):
+        return {k: canonical_value(v) for k, v in value.items() if v not in (None, "", [], {})}
+    if isinstance(value, list):
+        return [canonical_value(v) for v in value]
+    if isinstance(value, str) and _ISO_TIMESTAMP.match(value):
+        try:
+            value = datetime.fromisoformat(value)
+        except ValueError:
+            return value
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.isoformat(timespec='milliseconds')
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def row_hash(row: Dict) -> int:
+    """128-bit hash of a canonicalized row."""
+    canonical = canonical_value({k: v for k, v in row.items() if k not in VERIFY_IGNORED_COLUMNS})
+    encoded = json.dumps(canonical, sort_keys=True, separators=(',', ':'), ensure_ascii=False, default=str)
+    return int.from_bytes(hashlib.sha256(encoded.encode('utf-8')).digest()[:16], 'big')
+
+class TableDigest:
+    """Order-independent digest of a table, bucketed by id prefix.
+    
+    Each bucket keeps a row count and the sum of row hashes modulo 2**128, so
+    rows can be added in any order and two sides compared bucket by bucket.
+    With ``keep_buckets`` set, per-row hashes of those buckets are also kept
+    for the drill-down pass. ``without_created_at`` collects the ids of source
+    rows that have no ``created_at``, whose migrated value cannot be compared.
+    """
+    
+    def __init__(self, keep_buckets: Optional[Set[str]] = None):
+        self.buckets: Dict[str, List[int]] = {}
+        self.keep_buckets = keep_buckets
+        self.rows: Dict[str, int] = {}
+        self.without_created_at: Set[str] = set()
+        self.count = 0
+    
+    def add(self, row: Dict):
+        row_id = str(row.get('id', '')).lower()
+        prefix = row_id[:VERIFY_PREFIX_LENGTH]
+        digest = row_hash(row)
+        bucket = self.buckets.setdefault(prefix, [0, 0])
+        bucket[0] += 1
+        bucket[1] = (bucket[1] + digest) % _DIGEST_MODULUS
+        self.count += 1
+        if self.keep_buckets is not None and prefix in self.keep_buckets:
+            self.rows[row_id] = digest
+    
+    def mismatched_buckets(self, other: 'TableDigest') -> Set[str]:
+        prefixes = set(self.buckets) | set(other.buckets)
+        return {p for p in prefixes if self.buckets.get(p) != other.buckets.get(p)}
+
+def migration_query(state: Dict[str, Any]) -> Dict[str, Any]:
+    """Mongo filter for the documents still to migrate in the run of ``state``."""
+    changed = []
+    if state.get('since') is not None:
+        changed.append({'updated_at': {'$gt': state['since']}})
+    if state.get('since_id') is not None:
+        # New documents, including those without updated_at
+        changed.append({'_id': {'$gt': state['since_id']}})
+    clauses = [{'$or': changed}] if len(changed) > 1 else changed
+    if state.get('last_id') is not None:
+        clauses.append({'_id': {'$gt': state['last_id']}})
+    if not clauses:
+        return {}
+    return clauses[0] if len(clauses) == 1 else {'$and': clauses}
+
+class MigrationCheckpoint:
+    """Progress per collection, persisted to a JSON file after every batch.
+    
+    For each collection it keeps the last migrated ``_id`` (documents are read
+    in ``_id`` order), the highest ``updated_at`` seen, the ``updated_at`` and
+    ``_id`` lower bounds of the current run and whether the run completed.
+    Values are stored with bson.json_util so ObjectIds and datetimes round-trip.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self.collections: Dict[str, Dict[str, Any]] = {}
+        if self.path.exists():
+            self.collections = json_util.loads(self.path.read_text(encoding='utf-8')).get('collections', {})
+    
+    def save(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + '.tmp')
+        tmp_path.write_text(json_util.dumps({'collections': self.collections}, indent=2), encoding='utf-8')
+        os.replace(tmp_path, self.path)
+    
+    def reset(self):
+        self.collections = {}
+        if self.path.exists():
+            self.path.unlink()
+    
+    def begin(self, collection_name: str, incremental: bool):
+        """Return the state to migrate from, or None if there is nothing to do.
+        
+        An unfinished run is resumed where it stopped. A finished collection is
+        skipped in full mode; in incremental mode a new run starts with only
+        documents updated after the previous run's newest ``updated_at`` or
+        inserted after its highest ``_id`` (collections without ``updated_at``
+        only have the latter).
+        """
+        state = self.collections.get(collection_name)
+        if state and not state.get('completed'):
+            return state
+        if state and not incremental:
+            return None
+        
+        since = state.get('max_updated_at') if (state and incremental) else None
+        since_id = None
+        if state and incremental:
+            previous_ids = [i for i in (state.get('since_id'), state.get('last_id')) if i is not None]
+            since_id = max(previous_ids) if previous_ids else None
+        state = {
+            'since': since,
+            'since_id': since_id,
+            'last_id': None,
+            'max_updated_at': since,
+            'completed': False,
+            'started_at': datetime.utcnow()
+        }
+        self.collections[collection_name] = state
+        self.save()
+        return state
+    
+    def advance(self, collection_name: str, last_id: Any, max_updated_at: Any):
+        state = self.collections[collection_name]
+        state['last_id'] = last_id
+        if max_updated_at is not None and (state['max_updated_at'] is None or max_updated_at > state['max_updated_at']):
+            state['max_updated_at'] = max_updated_at
+        self.save()
+    
+    def complete(self, collection_name: str):
+        self.collections[collection_name]['completed'] = True
+        self.collections[collection_name]['completed_at'] = datetime.utcnow()
+        self.save()
+
 class DataMigrator:
     """Handles migration from MongoDB to Supabase"""
     
-    def __init__(self):
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, upsert: bool = True, pipeline_depth: int = PIPELINE_DEPTH,
+                 concurrency: int = DEFAULT_CONCURRENCY, checkpoint_file: Path = DEFAULT_CHECKPOINT_FILE,
+                 incremental: bool = False):
         self.mongo_db = mongo_db
         self.supabase = supabase
+        self.batch_size = max(1, batch_size)
+        self.concurrency = max(1, concurrency)
+        self.upsert = upsert
+        self.incremental = incremental
+        self.checkpoint = MigrationCheckpoint(checkpoint_file)
+        try:
+            self.uuid_id_tables = load_uuid_id_tables()
+        except OSError as e:
+            logger.warning(f"Could not read {SCHEMA_PATH.name} ({e}); treating ids as text")
+            self.uuid_id_tables = set()
+        self.pipeline_depth = max(1, pipeline_depth)
         self.migration_stats = {
             'collections_migrated': 0,
             'documents_migrated': 0,
-            'errors': []
+            'errors': [],
+            'collections': {}
         }
     
     def convert_mongodb_id(self, doc: Dict) -> Dict:
@@ -74,19 +326,28 @@ class DataMigrator:
         
         return doc
     
-    def validate_data(self, data: Dict, table_name: str) -> Dict:
-        """Validate and clean data for Supabase insertion"""
-        cleaned_data = self.convert_mongodb_id(data.copy())
+    def validate_data(self, data: Dict, table_name: str, fill_timestamps: bool = True) -> Dict:
+        """Validate and clean data for Supabase insertion.
+        
+        Cleans ``data`` in place: documents come straight from the cursor and
+        are not reused, so copying them would only double memory per batch.
+        Missing timestamps are set to the current time unless
+        ``fill_timestamps`` is False (verification must be repeatable).
+        """
+        mongo_id = data.get('_id')
+        cleaned_data = self.convert_mongodb_id(data)
         
-        # Add UUID if not present
+        # Add UUID if not present, derived from _id so reruns hit the same row
         if 'id' not in cleaned_data:
-            import uuid
-            cleaned_data['id'] = str(uuid.uuid4())
+            if mongo_id is not None:
+                cleaned_data['id'] = str(uuid.uuid5(MONGO_ID_NAMESPACE, f"{table_name}:{mongo_id}"))
+            else:
+                cleaned_data['id'] = str(uuid.uuid4())
         
         # Ensure required timestamps
-        if 'created_at' not in cleaned_data:
+        if fill_timestamps and 'created_at' not in cleaned_data:
             cleaned_data['created_at'] = datetime.utcnow().isoformat()
-        if 'updated_at' not in cleaned_data:
+        if fill_timestamps and 'updated_at' not in cleaned_data:
             cleaned_data['updated_at'] = datetime.utcnow().isoformat()
         
         # Table-specific validation
@@ -110,47 +371,153 @@ class DataMigrator:
         
         return cleaned_data
     
-    async def migrate_collection(self, collection_name: str, table_name: str) -> bool:
-        """Migrate a single MongoDB collection to Supabase table"""
+    def _send_batch(self, table_name: str, rows: List[Dict]):
+        """Send one list insert (or upsert on id) request."""
+        table = self.supabase.table(table_name)
+        query = table.upsert(rows, on_conflict='id') if self.upsert else table.insert(rows)
+        result = query.execute()
+        if getattr(result, 'error', None):
+            raise RuntimeError(result.error)
+    
+    def insert_batch(self, table_name: str, rows: List[Dict]) -> int:
+        """Insert rows in one request, splitting the batch in halves on failure.
+        
+        A bad row only costs its own insert: the rest of its batch is retried in
+        smaller requests until the failing row is isolated and reported.
+        Returns the number of rows written.
+        """
+        if not rows:
+            return 0
+        
+        if not self.supabase:
+            # Demo mode - just log
+            logger.info(f"Demo: Would migrate {len(rows)} {table_name} rows")
+            return len(rows)
+        
         try:
-            logger.info(f"Starting migration: {collection_name} -> {table_name}")
-            
-            # Get documents from MongoDB
-            cursor = self.mongo_db[collection_name].find()
-            documents = await cursor.to_list(None)
-            
-            if not documents:
-                logger.info(f"No documents found in collection {collection_name}")
-                return True
-            
-            logger.info(f"Found {len(documents)} documents in {collection_name}")
+            self._send_batch(table_name, rows)
+            return len(rows)
+        except Exception as e:
+            if len(rows) == 1:
+                error_msg = f"Error migrating document {rows[0].get('id', 'unknown')} in {table_name}: {str(e)}"
+                logger.error(error_msg)
+                self.migration_stats['errors'].append(error_msg)
+                return 0
+            middle = len(rows) // 2
+            return self.insert_batch(table_name, rows[:middle]) + self.insert_batch(table_name, rows[middle:])
+    
+    def record_collection_stats(self, collection_name: str, migrated_count: int, total: int, elapsed: float):
+        docs_per_sec = migrated_count / elapsed if elapsed > 0 else 0.0
+        self.migration_stats['collections'][collection_name] = {
+            'documents': migrated_count,
+            'total': total,
+            'seconds': round(elapsed, 3),
+            'docs_per_sec': round(docs_per_sec, 1)
+        }
+        logger.info(f"Successfully migrated {migrated_count}/{total} documents from {collection_name} "
+                    f"in {elapsed:.2f}s ({docs_per_sec:.1f} docs/sec)")
+    
+    async def read_batches(self, collection_name: str, table_name: str, queue: asyncio.Queue, counters: Dict[str, int],
+                           state: Dict[str, Any]):
+        """Read stage: page through the cursor and queue converted batches.
+        
+        ``queue.put`` blocks while the upload stage is PIPELINE_DEPTH batches
+        behind, which keeps memory bounded regardless of collection size.
+        Documents are read in ``_id`` order starting after the checkpoint, and
+        each queued batch carries the ``_id``/``updated_at`` to checkpoint once
+        it is written.
+        """
+        try:
+            query = migration_query(state)
+            cursor = self.mongo_db[collection_name].find(query).sort('_id', 1).batch_size(self.batch_size)
             
-            # Migrate documents to Supabase
-            migrated_count = 0
-            for doc in documents:
+            batch = []
+            last_id = None
+            max_updated_at = None
+            async for doc in cursor:
+                counters['read'] += 1
+                last_id = doc.get('_id')
+                updated_at = doc.get('updated_at')
+                if updated_at is not None and (max_updated_at is None or updated_at > max_updated_at):
+                    max_updated_at = updated_at
                 try:
                     # Validate and clean data
-                    clean_doc = self.validate_data(doc, table_name)
-                    
-                    if self.supabase:
-                        # Insert into Supabase
-                        result = self.supabase.table(table_name).insert(clean_doc).execute()
-                        if result.error:
-                            logger.error(f"Supabase error for {table_name}: {result.error}")
-                        else:
-                            migrated_count += 1
-                    else:
-                        # Demo mode - just log
-                        logger.info(f"Demo: Would migrate {table_name} document: {clean_doc.get('id', 'unknown')}")
-                        migrated_count += 1
-                
+                    batch.append(self.validate_data(doc, table_name))
                 except Exception as e:
                     error_msg = f"Error migrating document in {table_name}: {str(e)}"
                     logger.error(error_msg)
                     self.migration_stats['errors'].append(error_msg)
+                    continue
+                
+                if len(batch) >= self.batch_size:
+                    await queue.put((batch, last_id, max_updated_at))
+                    batch = []
+            
+            if batch or last_id is not None:
+                await queue.put((batch, last_id, max_updated_at))
+        finally:
+            await queue.put(None)
+    
+    async def write_batches(self, collection_name: str, table_name: str, queue: asyncio.Queue, counters: Dict[str, int]):
+        """Upload stage: send queued batches while the read stage keeps fetching.
+        
+        The checkpoint only advances past fully written batches. Once a batch
+        loses rows the remaining batches are still sent, but the checkpoint
+        stays at the last good ``_id`` so a rerun upserts from there again.
+        """
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            batch, last_id, max_updated_at = item
+            # The Supabase client is synchronous; run it off the loop so reads continue
+            written = await asyncio.to_thread(self.insert_batch, table_name, batch)
+            counters['migrated'] += written
+            counters['lost'] += len(batch) - written
+            if not counters['lost']:
+                self.checkpoint.advance(collection_name, last_id, max_updated_at)
+    
+    async def migrate_collection(self, collection_name: str, table_name: str) -> bool:
+        """Migrate a single MongoDB collection to Supabase table"""
+        try:
+            state = self.checkpoint.begin(collection_name, self.incremental)
+            if state is None:
+                logger.info(f"{collection_name} already migrated; use --incremental for changes or --reset to start over")
+                return True
+            if state.get('last_id') is not None:
+                logger.info(f"Resuming migration: {collection_name} -> {table_name} after _id {state['last_id']}")
+            elif state.get('since') is not None or state.get('since_id') is not None:
+                logger.info(f"Incremental migration: {collection_name} -> {table_name}, "
+                            f"updated after {state['since']} or after _id {state.get('since_id')}")
+            else:
+                logger.info(f"Starting migration: {collection_name} -> {table_name}")
+            started = time.perf_counter()
+            
+            counters = {'read': 0, 'migrated': 0, 'lost': 0}
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.pipeline_depth)
+            reader = asyncio.create_task(self.read_batches(collection_name, table_name, queue, counters, state))
+            try:
+                await self.write_batches(collection_name, table_name, queue, counters)
+            finally:
+                if not reader.done():
+                    reader.cancel()
+            # Re-raise errors from the read stage, if any
+            await reader
+            if counters['lost']:
+                self.record_collection_stats(collection_name, counters['migrated'], counters['read'], time.perf_counter() - started)
+                error_msg = (f"{counters['lost']} rows of {collection_name} were not written; "
+                             f"rerun to resume after _id {self.checkpoint.collections[collection_name]['last_id']}")
+                logger.error(error_msg)
+                self.migration_stats['errors'].append(error_msg)
+                return False
+            self.checkpoint.complete(collection_name)
             
-            logger.info(f"Successfully migrated {migrated_count}/{len(documents)} documents from {collection_name}")
-            self.migration_stats['documents_migrated'] += migrated_count
+            if not counters['read']:
+                logger.info(f"No documents found in collection {collection_name}")
+                return True
+            
+            self.record_collection_stats(collection_name, counters['migrated'], counters['read'], time.perf_counter() - started)
+            self.migration_stats['documents_migrated'] += counters['migrated']
             self.migration_stats['collections_migrated'] += 1
             return True
             
@@ -160,6 +527,60 @@ class DataMigrator:
             self.migration_stats['errors'].append(error_msg)
             return False
     
+    def build_migration_plan(self, migration_mapping: Dict[str, str]) -> Dict[str, Set[str]]:
+        """Return, for each collection, the collections that must finish before it."""
+        collection_for_table = {table: collection for collection, table in migration_mapping.items()}
+        try:
+            table_dependencies = load_table_dependencies()
+        except OSError as e:
+            # Without the schema, fall back to the mapping order (fully sequential)
+            logger.warning(f"Could not read {SCHEMA_PATH.name} ({e}); migrating collections sequentially")
+            collections = list(migration_mapping)
+            return {collection: set(collections[:i]) for i, collection in enumerate(collections)}
+        
+        plan = {}
+        for collection_name, table_name in migration_mapping.items():
+            plan[collection_name] = {
+                collection_for_table[dep] for dep in table_dependencies.get(table_name, set())
+                if dep in collection_for_table
+            }
+        return plan
+    
+    async def migrate_collections(self, migration_mapping: Dict[str, str]):
+        """Migrate collections concurrently in foreign-key order.
+        
+        Each collection starts as soon as every collection it references has
+        finished, with at most ``self.concurrency`` collections in flight. If a
+        referenced collection fails, its dependents are skipped.
+        """
+        plan = self.build_migration_plan(migration_mapping)
+        levels = check_acyclic(plan)
+        logger.info("Migration plan: " + " -> ".join("[" + ", ".join(level) + "]" for level in levels))
+        
+        semaphore = asyncio.Semaphore(self.concurrency)
+        finished = {collection: asyncio.Event() for collection in migration_mapping}
+        succeeded: Dict[str, bool] = {}
+        
+        async def run(collection_name: str, table_name: str):
+            try:
+                for dependency in plan[collection_name]:
+                    await finished[dependency].wait()
+                failed_dependencies = sorted(d for d in plan[collection_name] if not succeeded.get(d))
+                if failed_dependencies:
+                    error_msg = f"Skipped {collection_name}: dependencies failed ({', '.join(failed_dependencies)})"
+                    logger.error(error_msg)
+                    self.migration_stats['errors'].append(error_msg)
+                    succeeded[collection_name] = False
+                    return
+                async with semaphore:
+                    succeeded[collection_name] = await self.migrate_collection(collection_name, table_name)
+                if not succeeded[collection_name]:
+                    logger.warning(f"Migration failed for {collection_name} -> {table_name}")
+            finally:
+                finished[collection_name].set()
+        
+        await asyncio.gather(*(run(c, t) for c, t in migration_mapping.items()))
+    
     async def create_sample_data(self):
         """Create sample data if no MongoDB data exists"""
         logger.info("Creating sample data for Supabase...")
@@ -251,40 +672,134 @@ class DataMigrator:
         
         for table_name, data_list in sample_data:
             try:
-                for item in data_list:
-                    if self.supabase:
-                        result = self.supabase.table(table_name).insert(item).execute()
-                        if result.error:
-                            logger.error(f"Error inserting sample data into {table_name}: {result.error}")
-                        else:
-                            logger.info(f"Inserted sample data into {table_name}: {item['nombre']}")
-                    else:
-                        logger.info(f"Demo: Would insert into {table_name}: {item.get('nombre', item.get('id'))}")
-                        
-                self.migration_stats['documents_migrated'] += len(data_list)
+                inserted = self.insert_batch(table_name, data_list)
+                logger.info(f"Inserted {inserted}/{len(data_list)} sample rows into {table_name}")
+                self.migration_stats['documents_migrated'] += inserted
             except Exception as e:
                 error_msg = f"Error creating sample data for {table_name}: {str(e)}"
                 logger.error(error_msg)
                 self.migration_stats['errors'].append(error_msg)
     
+    async def digest_mongo(self, collection_name: str, table_name: str, keep_buckets: Optional[Set[str]] = None) -> TableDigest:
+        """Stream a collection through the same normalization used when migrating.
+        
+        Timestamps are not filled in; rows without ``created_at`` are recorded
+        so the Supabase side leaves the value set at migration time out.
+        """
+        digest = TableDigest(keep_buckets)
+        async for doc in self.mongo_db[collection_name].find().batch_size(VERIFY_PAGE_SIZE):
+            row = self.validate_data(doc, table_name, fill_timestamps=False)
+            if 'created_at' not in row:
+                digest.without_created_at.add(str(row['id']).lower())
+            digest.add(row)
+        return digest
+    
+    def _fetch_supabase_page(self, table_name: str, after_id: Optional[str], prefix: Optional[str]) -> List[Dict]:
+        query = self.supabase.table(table_name).select('*')
+        if after_id is not None:
+            query = query.gt('id', after_id)
+        elif prefix is not None:
+            query = query.gte('id', id_lower_bound(prefix, table_name in self.uuid_id_tables))
+        return query.order('id').limit(VERIFY_PAGE_SIZE).execute().data
+    
+    async def digest_supabase(self, table_name: str, keep_buckets: Optional[Set[str]] = None,
+                              without_created_at: Set[str] = frozenset()) -> TableDigest:
+        """Stream a table with keyset pagination on id.
+        
+        On the drill-down pass only the id ranges of ``keep_buckets`` are read.
+        ``created_at`` is left out for the ids in ``without_created_at``.
+        """
+        digest = TableDigest(keep_buckets)
+        prefixes = sorted(keep_buckets) if keep_buckets is not None else [None]
+        for prefix in prefixes:
+            after_id = None
+            while True:
+                rows = await asyncio.to_thread(self._fetch_supabase_page, table_name, after_id, prefix)
+                in_range = [row for row in rows if prefix is None or str(row['id']).lower().startswith(prefix)]
+                for row in in_range:
+                    if str(row['id']).lower() in without_created_at:
+                        row = {k: v for k, v in row.items() if k != 'created_at'}
+                    digest.add(row)
+                if len(rows) < VERIFY_PAGE_SIZE or len(in_range) < len(rows):
+                    break
+                after_id = rows[-1]['id']
+        return digest
+    
+    async def verify_table(self, collection_name: str, table_name: str) -> Dict[str, Any]:
+        """Compare one collection with its table; drill into mismatched id ranges."""
+        started = time.perf_counter()
+        # The Supabase pass needs to know which source rows had no created_at
+        mongo_digest = await self.digest_mongo(collection_name, table_name)
+        supabase_digest = await self.digest_supabase(table_name, without_created_at=mongo_digest.without_created_at)
+        mismatched = mongo_digest.mismatched_buckets(supabase_digest)
+        result: Dict[str, Any] = {
+            'mongo_rows': mongo_digest.count,
+            'supabase_rows': supabase_digest.count,
+            'match': not mismatched,
+            'mismatched_ranges': len(mismatched),
+            'missing_in_supabase': [],
+            'extra_in_supabase': [],
+            'different': []
+        }
+        
+        if mismatched:
+            mongo_rows, supabase_rows = await asyncio.gather(
+                self.digest_mongo(collection_name, table_name, keep_buckets=mismatched),
+                self.digest_supabase(table_name, keep_buckets=mismatched, without_created_at=mongo_digest.without_created_at)
+            )
+            mongo_ids, supabase_ids = set(mongo_rows.rows), set(supabase_rows.rows)
+            result['missing_in_supabase'] = sorted(mongo_ids - supabase_ids)[:VERIFY_MAX_REPORTED_IDS]
+            result['extra_in_supabase'] = sorted(supabase_ids - mongo_ids)[:VERIFY_MAX_REPORTED_IDS]
+            result['different'] = sorted(
+                row_id for row_id in mongo_ids & supabase_ids if mongo_rows.rows[row_id] != supabase_rows.rows[row_id]
+            )[:VERIFY_MAX_REPORTED_IDS]
+        
+        result['seconds'] = round(time.perf_counter() - started, 3)
+        return result
+    
+    async def run_verification(self) -> bool:
+        """Verify every migrated collection, several tables at a time."""
+        if not self.supabase:
+            logger.error("Verification needs a Supabase connection")
+            return False
+        
+        logger.info("Verifying MongoDB against Supabase...")
+        semaphore = asyncio.Semaphore(self.concurrency)
+        
+        async def verify(collection_name: str, table_name: str) -> Tuple[str, Dict[str, Any]]:
+            async with semaphore:
+                try:
+                    return collection_name, await self.verify_table(collection_name, table_name)
+                except Exception as e:
+                    return collection_name, {'match': False, 'error': str(e)}
+        
+        results = dict(await asyncio.gather(*(verify(c, t) for c, t in MIGRATION_MAPPING.items())))
+        
+        logger.info("\n" + "="*50)
+        logger.info("VERIFICATION SUMMARY")
+        logger.info("="*50)
+        for collection_name, result in results.items():
+            if 'error' in result:
+                logger.error(f"  {collection_name}: ERROR {result['error']}")
+                continue
+            status = "OK" if result['match'] else "MISMATCH"
+            logger.info(f"  {collection_name}: {status} ({result['mongo_rows']} mongo / {result['supabase_rows']} supabase rows, "
+                        f"{result['seconds']}s)")
+            if not result['match']:
+                logger.info(f"    mismatched id ranges: {result['mismatched_ranges']}")
+                for key in ('missing_in_supabase', 'extra_in_supabase', 'different'):
+                    if result[key]:
+                        logger.info(f"    {key}: {', '.join(result[key])}")
+        logger.info("="*50)
+        
+        self.migration_stats['verification'] = results
+        return all(result['match'] for result in results.values())
+    
     async def run_migration(self):
         """Run the complete migration process"""
         logger.info("Starting MongoDB to Supabase migration...")
         
-        # Define collection to table mappings
-        migration_mapping = {
-            'usuarios': 'users',
-            'establecimientos': 'establishments',
-            'documento_plantillas': 'document_templates',
-            'tramites': 'tramites',
-            'reglas_sugerencia': 'suggestion_rules',
-            'selecciones': 'selections',
-            'documento_instancias': 'document_instances',
-            'expediente': 'expediente',
-            'curso_modulos': 'course_modules',
-            'curso_progreso': 'course_progress',
-            'consultas': 'consultations'
-        }
+        migration_mapping = MIGRATION_MAPPING
         
         # Check if MongoDB has any data
         has_data = False
@@ -302,10 +817,7 @@ class DataMigrator:
             await self.create_sample_data()
         else:
             # Migrate existing data
-            for collection_name, table_name in migration_mapping.items():
-                success = await self.migrate_collection(collection_name, table_name)
-                if not success:
-                    logger.warning(f"Migration failed for {collection_name} -> {table_name}")
+            await self.migrate_collections(migration_mapping)
         
         # Print migration summary
         logger.info("\n" + "="*50)
@@ -314,6 +826,9 @@ class DataMigrator:
         logger.info(f"Collections migrated: {self.migration_stats['collections_migrated']}")
         logger.info(f"Documents migrated: {self.migration_stats['documents_migrated']}")
         logger.info(f"Errors encountered: {len(self.migration_stats['errors'])}")
+        for collection_name, stats in self.migration_stats['collections'].items():
+            logger.info(f"  {collection_name}: {stats['documents']}/{stats['total']} docs, "
+                        f"{stats['seconds']}s, {stats['docs_per_sec']} docs/sec")
         
         if self.migration_stats['errors']:
             logger.info("\nERRORS:")
@@ -324,11 +839,37 @@ class DataMigrator:
         
         return len(self.migration_stats['errors']) == 0
 
+def parse_args():
+    parser = argparse.ArgumentParser(description="Migrate COFEPRIS data from MongoDB to Supabase")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per insert request (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument("--insert-only", action="store_true",
+                        help="plain inserts instead of upsert on id (fails on rows that already exist)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only migrate documents updated or added since the last completed run")
+    parser.add_argument("--checkpoint-file", type=Path, default=DEFAULT_CHECKPOINT_FILE,
+                        help="where per-collection progress is kept")
+    parser.add_argument("--reset", action="store_true",
+                        help="discard saved progress and migrate everything again")
+    parser.add_argument("--verify", action="store_true",
+                        help="compare MongoDB and Supabase contents instead of migrating")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"collections migrated at the same time (default: {DEFAULT_CONCURRENCY})")
+    return parser.parse_args()
+
 async def main():
     """Main migration function"""
-    migrator = DataMigrator()
+    args = parse_args()
+    migrator = DataMigrator(batch_size=args.batch_size, upsert=not args.insert_only, concurrency=args.concurrency,
+                            checkpoint_file=args.checkpoint_file, incremental=args.incremental)
+    if args.reset:
+        migrator.checkpoint.reset()
     
     try:
+        if args.verify:
+            verified = await migrator.run_verification()
+            exit(0 if verified else 1)
+        
         success = await migrator.run_migration()
         
         if success:
@@ -347,5 +888,4 @@ async def main():
         mongo_client.close()
 
 if __name__ == "__main__":
-    asyncio.run(main())</content>
-    </file>
\ No newline at end of file
+    asyncio.run(main())
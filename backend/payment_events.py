@@ -0,0 +1,156 @@
+"""
+Payment webhook ingestion: signature check, dedupe, queue and batched apply.
+
+Providers retry deliveries aggressively, so the webhook only verifies the
+request, drops keys it has already seen and enqueues the event before acking.
+A single consumer task drains the queue, coalesces events per user and hands
+each batch to a backend-specific ``apply`` coroutine.
+"""
+
+import asyncio
+import hashlib
+import hmac
+import logging
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+def verify_signature(secret: Optional[str], body: bytes, signature: Optional[str]) -> bool:
+    """Check a hex HMAC-SHA256 of the raw body; accept everything without a secret."""
+    if not secret:
+        return True
+    if not signature:
+        return False
+    expected = hmac.new(secret.encode(), body, hashlib.sha256).hexdigest()
+    if signature.startswith("sha256="):
+        signature = signature[len("sha256="):]
+    return hmac.compare_digest(expected, signature)
+
+def idempotency_key(payload: Dict[str, Any], body: bytes, header: Optional[str] = None) -> str:
+    """Key used to drop redeliveries: explicit header, provider event id, or body hash."""
+    if header:
+        return header
+    for field in ("event_id", "id"):
+        if payload.get(field):
+            return str(payload[field])
+    return hashlib.sha256(body).hexdigest()
+
+class SeenKeys:
+    """Set of recently seen keys bounded to ``max_size`` entries (oldest evicted)."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._keys: "OrderedDict[str, None]" = OrderedDict()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def add(self, key: str):
+        self._keys[key] = None
+        self._keys.move_to_end(key)
+        while len(self._keys) > self.max_size:
+            self._keys.popitem(last=False)
+
+    def discard(self, key: str):
+        self._keys.pop(key, None)
+
+class PaymentEventQueue:
+    """Bounded queue of payment events with a batching consumer.
+
+    ``apply`` receives ``{user_id: event}`` with only the latest event per
+    user in the batch, and must raise if the batch was not written.
+    """
+
+    def __init__(
+        self,
+        apply: Callable[[Dict[str, Dict[str, Any]]], Awaitable[None]],
+        max_size: int,
+        seen_keys: int,
+        batch_size: int,
+        flush_interval: float,
+        max_retries: int = 3,
+    ):
+        self.apply = apply
+        self.queue: "asyncio.Queue[Dict[str, Any]]" = asyncio.Queue(maxsize=max_size)
+        self.seen = SeenKeys(seen_keys)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, key: str, user_id: str, payload: Dict[str, Any]) -> str:
+        """Enqueue an event; returns "queued", "duplicate" or "full"."""
+        if key in self.seen:
+            return "duplicate"
+        event = {"key": key, "user_id": user_id, "payload": payload, "received_at": datetime.utcnow()}
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            return "full"
+        self.seen.add(key)
+        return "queued"
+
+    async def next_batch(self) -> List[Dict[str, Any]]:
+        """Wait for one event, then collect more until the batch or interval is full."""
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def flush(self, batch: List[Dict[str, Any]]):
+        latest: Dict[str, Dict[str, Any]] = {}
+        for event in batch:
+            latest[event["user_id"]] = event
+        for attempt in range(1, self.max_retries + 1):
+            try:
+                await self.apply(latest)
+                return
+            except Exception as e:
+                logger.warning(f"Payment batch failed (attempt {attempt}/{self.max_retries}): {e}")
+                if attempt < self.max_retries:
+                    await asyncio.sleep(0.5 * 2 ** (attempt - 1))
+        # Forget the keys so a provider redelivery is accepted again
+        for event in batch:
+            self.seen.discard(event["key"])
+        logger.error(f"Dropped payment events for users: {', '.join(latest)}")
+
+    async def run(self):
+        while True:
+            batch = await self.next_batch()
+            try:
+                await self.flush(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self, timeout: float = 10.0):
+        """Give queued events ``timeout`` seconds to be applied, then cancel the consumer."""
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.error(f"Stopping with {self.queue.qsize()} payment events still queued")
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
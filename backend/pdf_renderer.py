@@ -0,0 +1,267 @@
+"""
+Server-side PDF rendering of document instances.
+
+``render_document_pdf`` is a pure function of the template and the filled-in
+``campos``: it writes a small text-only PDF (standard Helvetica fonts, no
+external dependencies) with no timestamps, so the same input always produces
+the same bytes. ``PdfRenderer`` runs it in a separate process pool and keeps
+the output in a disk cache addressed by a hash of the template version plus
+the fields, so re-downloads of unchanged documents never re-render.
+"""
+
+import asyncio
+import hashlib
+import json
+import multiprocessing
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+# Bump when the layout changes so cached PDFs are not reused
+RENDERER_VERSION = "1"
+
+# Template keys that affect the rendered output
+TEMPLATE_RENDER_KEYS = ("id", "nombre", "categoria", "campos_definicion", "versiones", "updated_at")
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 56
+TITLE_SIZE, LABEL_SIZE, TEXT_SIZE, FOOTER_SIZE = 16, 11, 10, 8
+LINE_SPACING = 1.35
+
+# Helvetica advance widths (1/1000 em) for printable ASCII; other characters
+# use the width of a lowercase letter
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_BOLD_FACTOR = 1.08
+
+def template_version(template: Dict[str, Any]) -> str:
+    """Hash of the parts of a template that change its rendering."""
+    relevant = {key: template.get(key) for key in TEMPLATE_RENDER_KEYS}
+    encoded = json.dumps(relevant, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def pdf_cache_key(template: Dict[str, Any], campos: Dict[str, Any]) -> str:
+    """Content address of a rendered document."""
+    encoded = json.dumps(
+        {"renderer": RENDERER_VERSION, "template": template_version(template), "campos": campos},
+        sort_keys=True, ensure_ascii=False, default=str
+    )
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+def _text_width(text: str, size: float, bold: bool = False) -> float:
+    width = 0
+    for char in text:
+        code = ord(char)
+        width += _HELVETICA_WIDTHS[code - 32] if 32 <= code < 127 else 556
+    return width * size / 1000 * (_BOLD_FACTOR if bold else 1)
+
+def _wrap(text: str, size: float, max_width: float, bold: bool = False) -> List[str]:
+    """Greedy word wrap; words longer than a line are split."""
+    lines: List[str] = []
+    for paragraph in text.split("\n"):
+        current = ""
+        for word in paragraph.split(" "):
+            candidate = f"{current} {word}" if current else word
+            if _text_width(candidate, size, bold) <= max_width:
+                current = candidate
+                continue
+            if current:
+                lines.append(current)
+            while _text_width(word, size, bold) > max_width:
+                cut = len(word) - 1
+                while cut > 1 and _text_width(word[:cut], size, bold) > max_width:
+                    cut -= 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            current = word
+        lines.append(current)
+    return lines
+
+def _field_label(name: str) -> str:
+    label = name.replace("_", " ").strip()
+    return label[:1].upper() + label[1:]
+
+def _format_value(value: Any) -> List[str]:
+    """Paragraphs for a field value; lists become bullet items."""
+    if value is None or value == "" or value == [] or value == {}:
+        return ["—"]
+    if isinstance(value, bool):
+        return ["Sí" if value else "No"]
+    if isinstance(value, list):
+        return [f"• {', '.join(_format_value(item))}" for item in value]
+    if isinstance(value, dict):
+        return [f"{_field_label(str(k))}: {', '.join(_format_value(v))}" for k, v in value.items()]
+    return [str(value)]
+
+def _escape(text: str) -> bytes:
+    encoded = text.encode("cp1252", errors="replace")
+    return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+class _Layout:
+    """Places lines top to bottom, starting new pages as needed."""
+
+    def __init__(self):
+        self.pages: List[List[bytes]] = [[]]
+        self.y = PAGE_HEIGHT - MARGIN
+
+    def line(self, text: str, size: float, bold: bool = False, indent: float = 0):
+        height = size * LINE_SPACING
+        if self.y - height < MARGIN + FOOTER_SIZE * 2:
+            self.pages.append([])
+            self.y = PAGE_HEIGHT - MARGIN
+        self.y -= height
+        font = b"F2" if bold else b"F1"
+        self.pages[-1].append(
+            b"BT /" + font + b" %d Tf %.2f %.2f Td (" % (size, MARGIN + indent, self.y) + _escape(text) + b") Tj ET"
+        )
+
+    def paragraph(self, text: str, size: float, bold: bool = False, indent: float = 0):
+        for line in _wrap(text, size, PAGE_WIDTH - 2 * MARGIN - indent, bold):
+            self.line(line, size, bold, indent)
+
+    def space(self, points: float):
+        self.y -= points
+
+def _build_pdf(pages: List[List[bytes]], title: str) -> bytes:
+    objects: List[bytes] = []
+    page_count = len(pages)
+    first_page = 5  # catalog, pages, two fonts, info come first
+
+    objects.append(b"<< /Type /Catalog /Pages 2 0 R >>")
+    kids = b" ".join(b"%d 0 R" % (first_page + 1 + 2 * i) for i in range(page_count))
+    objects.append(b"<< /Type /Pages /Kids [" + kids + b"] /Count %d >>" % page_count)
+    for base_font in (b"Helvetica", b"Helvetica-Bold"):
+        objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /" + base_font + b" /Encoding /WinAnsiEncoding >>")
+    objects.append(b"<< /Title (" + _escape(title) + b") /Producer (COFEPRIS Pro) >>")
+
+    for number, operations in enumerate(pages, start=1):
+        footer = f"Página {number} de {page_count}"
+        operations = operations + [
+            b"BT /F1 %d Tf %.2f %.2f Td (" % (FOOTER_SIZE, PAGE_WIDTH - MARGIN - _text_width(footer, FOOTER_SIZE), MARGIN / 2)
+            + _escape(footer) + b") Tj ET"
+        ]
+        stream = zlib.compress(b"\n".join(operations), 9)
+        content_id = first_page + 2 + 2 * (number - 1)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] " % (PAGE_WIDTH, PAGE_HEIGHT)
+            + b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(stream) + stream + b"\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R /Info 5 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref_offset)
+    return bytes(output)
+
+def render_document_pdf(template: Dict[str, Any], campos: Dict[str, Any]) -> bytes:
+    """Render a template filled with ``campos`` to PDF bytes."""
+    title = template.get("nombre") or "Documento"
+    layout = _Layout()
+    layout.paragraph(title, TITLE_SIZE, bold=True)
+    if template.get("categoria"):
+        layout.paragraph(f"Categoría: {template['categoria']}", TEXT_SIZE)
+    layout.space(TEXT_SIZE)
+
+    # Fields in template order, then any extra fields present in the instance
+    field_names = list(template.get("campos_definicion") or {})
+    field_names += [name for name in campos if name not in field_names]
+    for name in field_names:
+        layout.paragraph(_field_label(name), LABEL_SIZE, bold=True)
+        for paragraph in _format_value(campos.get(name)):
+            layout.paragraph(paragraph, TEXT_SIZE, indent=12)
+        layout.space(TEXT_SIZE * 0.6)
+
+    return _build_pdf(layout.pages, title)
+
+def _lower_priority(niceness: int):
+    # Keep renders from competing with the API workers for CPU
+    try:
+        os.nice(niceness)
+    except OSError:
+        pass
+
+class PdfRenderer:
+    """Process-pool renderer with a content-addressed disk cache.
+
+    The pool is created on first use with the spawn start method, so workers
+    do not inherit the server's event loop or database clients. Concurrent
+    requests for the same document share a single render.
+    """
+
+    def __init__(self, cache_dir: Path, workers: int, niceness: int = 10):
+        self.cache_dir = Path(cache_dir)
+        self.workers = workers
+        self.niceness = niceness
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    def cache_path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.pdf"
+
+    def _pool_executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_lower_priority,
+                initargs=(self.niceness,),
+            )
+        return self._pool
+
+    def _read_cached(self, key: str) -> Optional[bytes]:
+        try:
+            return self.cache_path(key).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def _write_cached(self, key: str, pdf: bytes):
+        path = self.cache_path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        tmp_path.write_bytes(pdf)
+        os.replace(tmp_path, path)
+
+    async def _render(self, key: str, template: Dict[str, Any], campos: Dict[str, Any]) -> bytes:
+        loop = asyncio.get_running_loop()
+        try:
+            pdf = await loop.run_in_executor(self._pool_executor(), render_document_pdf, template, campos)
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool on the next render
+            self.shutdown()
+            raise
+        await asyncio.to_thread(self._write_cached, key, pdf)
+        return pdf
+
+    async def render(self, template: Dict[str, Any], campos: Dict[str, Any]) -> Tuple[str, bytes, bool]:
+        """Return ``(key, pdf, cached)`` for a template filled with ``campos``."""
+        key = pdf_cache_key(template, campos)
+        pdf = await asyncio.to_thread(self._read_cached, key)
+        if pdf is not None:
+            return key, pdf, True
+
+        future = self._inflight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._render(key, template, campos))
+            self._inflight[key] = future
+            future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return key, await asyncio.shield(future), False
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
@@ -0,0 +1,44 @@
+"""
+Short-lived cache of authenticated principals.
+
+Every authenticated request resolves its token to a user row; caching the
+result for a few seconds removes that lookup from the hot path. Anything that
+changes what a principal may do (subscription state, role) must call
+``invalidate`` for the affected users.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Iterable, Optional, Tuple
+
+class PrincipalCache:
+    def __init__(self, ttl: float, max_size: int):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, user_id: str) -> Optional[Any]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return principal
+
+    def put(self, user_id: str, principal: Any):
+        if self.ttl <= 0:
+            return
+        self._entries[user_id] = (time.monotonic() + self.ttl, principal)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_ids: Iterable[str]):
+        for user_id in user_ids:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        self._entries.clear()
@@ -0,0 +1,247 @@
+"""
+In-process full-text search over the catalog and users' documents.
+
+Text is folded (lowercase, accents removed), split into words, stripped of
+Spanish stop words and reduced with a light Spanish stemmer, so "Licencias",
+"licencia" and "licéncia" are the same term. ``SearchIndex`` keeps one
+inverted index per partition: the shared catalog (templates and trámites)
+and one per user holding their documents, so a query only walks the
+postings of the catalog and of the user searching, however many documents
+other users have. Entries are replaced or removed one at a time as
+documents change; a partition is rebuilt from the database on the first
+search after it is ``ttl`` seconds old, which picks up changes made by
+other workers.
+
+Queries match entries containing every query term and are ranked with BM25.
+"""
+
+import math
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Text of an entry as (text, weight) pairs, title first; a term counts
+# ``weight`` times
+Fields = Sequence[Tuple[str, float]]
+
+STOP_WORDS = frozenset("""
+a al algo ante antes como con contra cual cuando de del desde donde durante e el ella ellas ellos en entre era es esa
+ese eso esta este esto estos estas fue ha hay la las le les lo los mas me mi muy ni no nos o otra otro para pero por
+que se segun ser si sin sobre son su sus tambien te tiene todo tu un una uno unos unas y ya
+""".split())
+
+_WORD = re.compile(r"[a-z0-9]+")
+_VOWELS = frozenset("aeiou")
+# Derivational endings, longest first; only stripped from words long enough
+_SUFFIXES = tuple(sorted((
+    "amiento", "imiento", "acion", "icion", "ucion", "cion", "mente", "idad", "ista", "able", "ible", "ando", "iendo",
+), key=len, reverse=True))
+_MIN_STEM = 3
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+def fold(text: str) -> str:
+    """Lowercase without accents (``"Señalética"`` -> ``"senaletica"``)."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+def stem(word: str) -> str:
+    """Light stemmer for folded Spanish words: plurals, common suffixes, final vowel."""
+    if len(word) <= _MIN_STEM + 1 or word.isdigit():
+        return word
+    if word.endswith("es") and word[-3] not in _VOWELS and len(word) - 2 >= _MIN_STEM:
+        word = word[:-2]
+    elif word.endswith("s"):
+        word = word[:-1]
+    for suffix in _SUFFIXES:
+        if word.endswith(suffix) and len(word) - len(suffix) >= _MIN_STEM:
+            return word[:-len(suffix)]
+    if word[-1] in "aeo" and len(word) > _MIN_STEM + 1:
+        word = word[:-1]
+    return word
+
+def terms(text: str) -> List[str]:
+    return [stem(word) for word in _WORD.findall(fold(text)) if len(word) > 1 and word not in STOP_WORDS]
+
+def snippet(text: str, query_terms: Iterable[str], width: int = 160) -> str:
+    """About ``width`` characters of ``text`` around the first query term."""
+    if len(text) <= width:
+        return text
+    folded = fold(text)
+    # Folding keeps positions for precomposed Spanish text; otherwise start at 0
+    start = 0
+    if len(folded) == len(text):
+        positions = [folded.find(term) for term in query_terms]
+        positions = [position for position in positions if position >= 0]
+        if positions:
+            start = max(0, min(positions) - width // 4)
+    start = max(0, min(start, len(text) - width))
+    excerpt = text[start:start + width].strip()
+    return ("…" if start > 0 else "") + excerpt + ("…" if start + width < len(text) else "")
+
+class _Partition:
+    def __init__(self):
+        # term -> key -> weighted term frequency
+        self.postings: Dict[str, Dict[str, float]] = {}
+        # key -> (length, weighted terms, result data, snippet source)
+        self.entries: Dict[str, Tuple[float, Dict[str, float], Dict[str, Any], str]] = {}
+        self.total_length = 0.0
+        self.loaded_at = time.monotonic()
+
+    def add(self, key: str, fields: Fields, result: Dict[str, Any]):
+        self.remove(key)
+        counts: Dict[str, float] = {}
+        for text, weight in fields:
+            for term in terms(text or ""):
+                counts[term] = counts.get(term, 0.0) + weight
+        length = sum(counts.values())
+        for term, count in counts.items():
+            self.postings.setdefault(term, {})[key] = count
+        # Snippets come from the body, or the title when there is none
+        source = " ".join(text for text, _ in fields[1:] if text) or (fields[0][0] if fields else "")
+        self.entries[key] = (length, counts, result, source)
+        self.total_length += length
+
+    def remove(self, key: str):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return
+        self.total_length -= entry[0]
+        for term in entry[1]:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query_terms: Sequence[str]) -> List[Tuple[float, str]]:
+        lists = [self.postings.get(term) for term in query_terms]
+        if not lists or any(not postings for postings in lists):
+            return []
+        # Intersect starting from the rarest term
+        lists.sort(key=len)
+        candidates = set(lists[0])
+        for postings in lists[1:]:
+            candidates.intersection_update(postings)
+            if not candidates:
+                return []
+        count = len(self.entries)
+        average = self.total_length / count if count else 1.0
+        scored = []
+        for key in candidates:
+            length = self.entries[key][0]
+            score = 0.0
+            for postings in lists:
+                idf = math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+                tf = postings[key]
+                score += idf * tf * (K1 + 1) / (tf + K1 * (1 - B + B * length / average))
+            scored.append((score, key))
+        return scored
+
+class SearchIndex:
+    """Inverted indexes by owner (``None`` for the catalog), least recently used evicted first.
+
+    ``add`` and ``remove`` only touch partitions that are loaded; an unloaded
+    partition is built from scratch with ``load`` when it is next searched.
+    """
+
+    def __init__(self, max_partitions: int, ttl: float):
+        self.max_partitions = max_partitions
+        self.ttl = ttl
+        self._partitions: "OrderedDict[Optional[str], _Partition]" = OrderedDict()
+
+    def loaded(self, owner: Optional[str]) -> bool:
+        partition = self._partitions.get(owner)
+        if partition is None:
+            return False
+        if time.monotonic() - partition.loaded_at >= self.ttl:
+            del self._partitions[owner]
+            return False
+        return True
+
+    def load(self, owner: Optional[str], entries: Iterable[Tuple[str, Fields, Dict[str, Any]]]):
+        partition = _Partition()
+        for key, fields, result in entries:
+            partition.add(key, fields, result)
+        self._partitions[owner] = partition
+        self._partitions.move_to_end(owner)
+        while len(self._partitions) > self.max_partitions:
+            self._partitions.popitem(last=False)
+
+    def drop(self, owner: Optional[str]):
+        self._partitions.pop(owner, None)
+
+    def add(self, owner: Optional[str], key: str, fields: Fields, result: Dict[str, Any]):
+        partition = self._partitions.get(owner)
+        if partition is not None:
+            partition.add(key, fields, result)
+
+    def remove(self, owner: Optional[str], key: str):
+        partition = self._partitions.get(owner)
+        if partition is not None:
+            partition.remove(key)
+
+    def search(self, query: str, owners: Sequence[Optional[str]], offset: int, limit: int,
+               tipo: Optional[str] = None) -> Tuple[int, List[Dict[str, Any]]]:
+        """Total matches and one page of results, best first.
+
+        Each result is the entry's result data plus ``puntuacion`` and
+        ``fragmento``. ``tipo`` keeps only results with that ``tipo``.
+        """
+        query_terms = list(dict.fromkeys(terms(query)))
+        if not query_terms:
+            return 0, []
+        matches = []
+        for owner in owners:
+            partition = self._partitions.get(owner)
+            if partition is None:
+                continue
+            self._partitions.move_to_end(owner)
+            for score, key in partition.search(query_terms):
+                result = partition.entries[key][2]
+                if tipo is None or result.get("tipo") == tipo:
+                    matches.append((score, partition, key))
+        matches.sort(key=lambda match: (-match[0], match[2]))
+        page = []
+        for score, partition, key in matches[offset:offset + limit]:
+            _, _, result, source = partition.entries[key]
+            page.append({**result, "puntuacion": round(score, 4), "fragmento": snippet(source, query_terms)})
+        return len(matches), page
+
+Entry = Tuple[str, Fields, Dict[str, Any]]
+
+def campos_text(campos: Dict[str, Any]) -> str:
+    """Searchable text of a document's field values."""
+    parts: List[str] = []
+    for value in campos.values():
+        if isinstance(value, (list, tuple)):
+            parts.extend(str(item) for item in value if isinstance(item, (str, int, float)) and not isinstance(item, bool))
+        elif isinstance(value, (str, int, float)) and not isinstance(value, bool):
+            parts.append(str(value))
+    return " ".join(part for part in parts if part)
+
+def template_entry(template: Dict[str, Any]) -> Entry:
+    return (
+        f"PLANTILLA:{template['id']}",
+        [(template.get("nombre") or "", 3.0), (template.get("que_incluye") or "", 1.0), (template.get("razones") or "", 1.0)],
+        {"tipo": "PLANTILLA", "id": template["id"], "titulo": template.get("nombre") or ""},
+    )
+
+def tramite_entry(tramite: Dict[str, Any]) -> Entry:
+    return (
+        f"TRAMITE:{tramite['id']}",
+        [(tramite.get("nombre") or "", 3.0), (tramite.get("requisitos") or "", 1.0)],
+        {"tipo": "TRAMITE", "id": tramite["id"], "titulo": tramite.get("nombre") or ""},
+    )
+
+def document_entry(document_id: str, titulo: str, campos: Dict[str, Any]) -> Entry:
+    """Entry for a user document, titled with its template's name."""
+    return (
+        f"DOCUMENTO:{document_id}",
+        [(titulo, 2.0), (campos_text(campos), 1.0)],
+        {"tipo": "DOCUMENTO", "id": document_id, "titulo": titulo},
+    )
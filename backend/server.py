@@ -1,19 +1,37 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import ASCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Iterable, Union
 from datetime import datetime, timedelta
 from enum import Enum
 import uuid
 import hashlib
 import hmac
 import json
+from trusted_rows import load_rows
+from bulk_import import detect_format, format_validation_error, iter_records
+from payment_events import PaymentEventQueue, idempotency_key, verify_signature
+from principal_cache import PrincipalCache
+from leased_task import LeasedTask
+from pdf_renderer import PdfRenderer, pdf_cache_key
+from document_history import history_entry, is_keyframe, rebuild_version, summarize_entry
+from autosave import AutosaveCoalescer, VersionConflict, merge_fields
+from field_validators import ValidatorCache
+from document_jobs import JobRunner, prefill_campos, render_pdfs
+from compliance import ComplianceStore, DOCUMENTO_LISTO, SELECCION_ACTIVADA, TRAMITE_COMPLETADO, VENCIMIENTO, parse_timestamp, reminders
+from deadline_scheduler import DeadlineScheduler
+from file_uploads import MalformedUpload, UploadTooLarge, blob_path, receive_upload
+from search_index import SearchIndex, document_entry, template_entry, tramite_entry
+from course_content import CourseCache
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
 ROOT_DIR = Path(__file__).parent
@@ -77,6 +95,16 @@ class CourseStatus(str, Enum):
     EN_CURSO = "EN_CURSO"
     COMPLETADO = "COMPLETADO"
 
+class DocumentJobStatus(str, Enum):
+    EN_PROCESO = "EN_PROCESO"
+    COMPLETADO = "COMPLETADO"
+    INTERRUMPIDO = "INTERRUMPIDO"
+
+class SearchResultType(str, Enum):
+    PLANTILLA = "PLANTILLA"
+    TRAMITE = "TRAMITE"
+    DOCUMENTO = "DOCUMENTO"
+
 # Pydantic Models
 class UserBase(BaseModel):
     nombre: str = Field(..., min_length=2, max_length=100)
@@ -159,6 +187,47 @@ class Selection(BaseModel):
     estado: SelectionStatus = SelectionStatus.BORRADOR
     completitud_estimado: int = Field(ge=0, le=100, default=0)
 
+class SelectionCreate(BaseModel):
+    items: Dict[str, List[str]]
+    estado: SelectionStatus = SelectionStatus.BORRADOR
+
+class Expediente(BaseModel):
+    usuario_id: str
+    items: Dict[str, List[str]] = {}
+    documentos_listos: Dict[str, int] = {}
+    tramites_completados: Dict[str, Dict[str, Any]] = {}
+    estatus_cumplimiento: ComplianceStatus = ComplianceStatus.ROJO
+    avance: int = Field(ge=0, le=100, default=0)
+    vencimientos: List[Dict[str, Any]] = []
+    proximo_evento: Optional[str] = None
+    rev: int = 0
+
+class TramiteCompletion(BaseModel):
+    fecha_vencimiento: Optional[datetime] = None
+
+class Recordatorio(BaseModel):
+    id: str
+    usuario_id: str
+    tramite_id: str
+    tipo: str
+    fecha: str
+    estatus_cumplimiento: Optional[ComplianceStatus] = None
+    created_at: datetime
+
+class UserFile(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    nombre: str
+    carpeta: Optional[str] = None
+    content_type: str
+    tamano: int
+    sha256: str
+    storage_path: str
+    # The user already had a file with this content; whether anyone else
+    # stores it is never exposed
+    deduplicado: bool = False
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class DocumentInstance(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     usuario_id: str
@@ -167,11 +236,56 @@ class DocumentInstance(BaseModel):
     campos: Dict[str, Any] = {}
     validaciones: Dict[str, Any] = {}
     historial_versiones: List[Dict[str, Any]] = []
+    version: int = 1
     pdf_url: Optional[str] = None
     carpeta: DocumentCategory
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
 
+class DocumentInstanceCreate(BaseModel):
+    plantilla_id: str
+    campos: Dict[str, Any] = {}
+
+class DocumentInstanceUpdate(BaseModel):
+    campos: Optional[Dict[str, Any]] = None
+    estado: Optional[DocumentStatus] = None
+
+class DocumentPatch(BaseModel):
+    campos: Dict[str, Any]
+    version: Optional[int] = None
+
+class AutosaveResponse(BaseModel):
+    id: str
+    version: int
+    updated_at: datetime
+    parches: int = 1
+    validaciones: Dict[str, Any] = {}
+
+class SearchResult(BaseModel):
+    tipo: SearchResultType
+    id: str
+    titulo: str
+    fragmento: str = ""
+    puntuacion: float
+
+class SearchResponse(BaseModel):
+    total: int
+    pagina: int
+    por_pagina: int
+    resultados: List[SearchResult]
+
+class DocumentHistoryEntry(BaseModel):
+    version: int
+    tipo: str
+    autor_id: Optional[str] = None
+    campos_cambiados: List[str] = []
+    created_at: Optional[datetime] = None
+
+class DocumentVersion(BaseModel):
+    documento_id: str
+    version: int
+    campos: Dict[str, Any]
+
 class AIConsultation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     usuario_id: str
@@ -201,6 +315,43 @@ class SuggestionResponse(BaseModel):
     justificacion: str
     completitud_estimado: int
 
+class SuggestionExpandRequest(BaseModel):
+    plantillas: List[str] = []
+    tramites: List[str] = []
+
+class SuggestionExpandResponse(BaseModel):
+    plantillas: List[Dict[str, Any]]
+    tramites: List[Dict[str, Any]]
+
+class DocumentBatchCreate(BaseModel):
+    establecimiento_id: str
+    sugerencias: SuggestionResponse
+    generar_pdf: bool = False
+
+class DocumentBatchJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    establecimiento_id: str
+    estado: DocumentJobStatus = DocumentJobStatus.EN_PROCESO
+    documentos: List[str] = []
+    omitidas: List[str] = []
+    pdf_total: int = 0
+    pdf_generados: int = 0
+    pdf_fallidos: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class ImportRowError(BaseModel):
+    fila: int
+    error: str
+
+class EstablishmentImportReport(BaseModel):
+    importados: int = 0
+    rechazados: int = 0
+    errores: List[ImportRowError] = []
+    establecimientos: List[str] = []
+    sugerencias: Dict[str, SuggestionResponse] = {}
+
 # Authentication helpers
 def hash_password(password: str) -> str:
     return hashlib.sha256(password.encode()).hexdigest()
@@ -212,6 +363,15 @@ def create_token(user_id: str) -> str:
     # Simple token creation - in production, use JWT
     return f"token_{user_id}_{datetime.utcnow().isoformat()}"
 
+# Resolved users are cached briefly per process; call invalidate_principals
+# whenever subscription state or role changes.
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', '30'))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
+
+def invalidate_principals(user_ids):
+    principal_cache.invalidate(user_ids)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     token = credentials.credentials
     if not token.startswith("token_"):
@@ -219,10 +379,15 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     
     try:
         user_id = token.split("_")[1]
+        cached = principal_cache.get(user_id)
+        if cached is not None:
+            return cached
         user = await db.usuarios.find_one({"id": user_id})
         if not user:
             raise HTTPException(status_code=401, detail="User not found")
-        return User(**user)
+        principal = User(**user)
+        principal_cache.put(user_id, principal)
+        return principal
     except:
         raise HTTPException(status_code=401, detail="Invalid token")
 
@@ -287,46 +452,113 @@ def convert_objectid(data):
     else:
         return data
 
-async def generate_suggestions(perfil: Dict[str, Any]) -> SuggestionResponse:
-    """Generate document and procedure suggestions based on establishment profile."""
-    
-    # Get all templates and rules
+# Catalog cache: templates, tramites and rules change only through admin tooling,
+# so they are loaded once per TTL instead of on every suggestion request.
+CATALOG_CACHE_TTL = int(os.environ.get('CATALOG_CACHE_TTL', '300'))
+_catalog_cache: Dict[str, Any] = {"expires_at": 0.0, "data": None}
+
+async def get_catalog() -> Dict[str, Any]:
+    """Return active templates, tramites and rules, indexed by id."""
+    now = datetime.utcnow().timestamp()
+    if _catalog_cache["data"] is not None and now < _catalog_cache["expires_at"]:
+        return _catalog_cache["data"]
+
     templates_raw = await db.documento_plantillas.find({"activo": True}).to_list(None)
     tramites_raw = await db.tramites.find({"activo": True}).to_list(None)
     rules_raw = await db.reglas_sugerencia.find({"activo": True}).to_list(None)
-    
+
     # Convert ObjectIds to avoid serialization errors
     templates = convert_objectid(templates_raw)
     tramites = convert_objectid(tramites_raw)
     rules = convert_objectid(rules_raw)
+
+    data = {
+        "templates": {t["id"]: t for t in templates},
+        "tramites": {t["id"]: t for t in tramites},
+        "rules": rules,
+    }
+    _catalog_cache["data"] = data
+    _catalog_cache["expires_at"] = now + CATALOG_CACHE_TTL
+    return data
+
+def invalidate_catalog_cache():
+    _catalog_cache["data"] = None
+    _catalog_cache["expires_at"] = 0.0
+    field_validators.invalidate()
+    search_index.drop(None)
+
+# Validators compiled from each template's campos_definicion, rebuilt when
+# the template version changes
+VALIDATOR_CACHE_SIZE = int(os.environ.get('VALIDATOR_CACHE_SIZE', '256'))
+field_validators = ValidatorCache(VALIDATOR_CACHE_SIZE)
+
+async def validate_campos(plantilla_id: str, campos: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Per-field validation results; empty if the template is no longer active."""
+    template = (await get_catalog())["templates"].get(plantilla_id)
+    if not template:
+        return {}
+    return field_validators.get(template).validate(campos, fields)
+
+def summarize_template(template: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact view of a template for the suggestions wizard."""
+    return {
+        "id": template["id"],
+        "nombre": template.get("nombre"),
+        "categoria": template.get("categoria"),
+    }
+
+def summarize_tramite(tramite: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact view of a tramite for the suggestions wizard."""
+    return {
+        "id": tramite["id"],
+        "nombre": tramite.get("nombre"),
+        "autoridad": tramite.get("autoridad"),
+    }
+
+async def generate_suggestions(perfil: Dict[str, Any], compact: bool = False) -> SuggestionResponse:
+    """Generate document and procedure suggestions based on establishment profile.
+
+    With ``compact=True`` only ids and a short summary are returned for each
+    item; full entries can be fetched afterwards through ``/suggestions/expand``.
+    """
+    catalog = await get_catalog()
+    templates = catalog["templates"]
+    tramites = catalog["tramites"]
     
     suggested_templates = []
     suggested_tramites = []
+    seen_templates = set()
+    seen_tramites = set()
     justifications = []
     
     # Apply suggestion rules
-    for rule in rules:
+    for rule in catalog["rules"]:
         conditions = rule["condiciones"]
         if evaluate_conditions(perfil, conditions):
             # Add suggested templates
             if "plantillas" in rule["items_sugeridos"]:
                 for template_id in rule["items_sugeridos"]["plantillas"]:
-                    template = next((t for t in templates if t["id"] == template_id), None)
-                    if template and template not in suggested_templates:
+                    template = templates.get(template_id)
+                    if template and template_id not in seen_templates:
+                        seen_templates.add(template_id)
                         suggested_templates.append(template)
             
             # Add suggested tramites
             if "tramites" in rule["items_sugeridos"]:
                 for tramite_id in rule["items_sugeridos"]["tramites"]:
-                    tramite = next((t for t in tramites if t["id"] == tramite_id), None)
-                    if tramite and tramite not in suggested_tramites:
+                    tramite = tramites.get(tramite_id)
+                    if tramite and tramite_id not in seen_tramites:
+                        seen_tramites.add(tramite_id)
                         suggested_tramites.append(tramite)
             
             justifications.append(rule["justificacion"])
     
     # Calculate completeness estimate
-    total_required = len([t for t in suggested_templates if "obligatorio" in t.get("razones", "").lower()])
     completeness = min(100, (len(suggested_templates) + len(suggested_tramites)) * 10)
+
+    if compact:
+        suggested_templates = [summarize_template(t) for t in suggested_templates]
+        suggested_tramites = [summarize_tramite(t) for t in suggested_tramites]
     
     return SuggestionResponse(
         plantillas=suggested_templates,
@@ -366,22 +598,87 @@ def evaluate_single_condition(perfil: Dict[str, Any], condition: Dict[str, Any])
     
     return False
 
+# Database indexes
+# One entry per access path used in this module: (collection, keys, options).
+# Index names are fixed so create_index is a no-op when the index already exists.
+INDEX_SPECS = [
+    ("usuarios", [("email", ASCENDING)], {"name": "usuarios_email_unique", "unique": True}),
+    ("usuarios", [("id", ASCENDING)], {"name": "usuarios_id_unique", "unique": True}),
+    ("usuarios", [("estado_suscripcion", ASCENDING), ("fecha_renovacion", ASCENDING)], {"name": "usuarios_suscripcion_renovacion"}),
+    ("establecimientos", [("usuario_id", ASCENDING)], {"name": "establecimientos_usuario_id"}),
+    ("documento_plantillas", [("activo", ASCENDING)], {"name": "documento_plantillas_activo"}),
+    ("tramites", [("activo", ASCENDING)], {"name": "tramites_activo"}),
+    ("reglas_sugerencia", [("activo", ASCENDING)], {"name": "reglas_sugerencia_activo"}),
+    ("curso_modulos", [("activo", ASCENDING)], {"name": "curso_modulos_activo"}),
+    ("documento_instancias", [("id", ASCENDING)], {"name": "documento_instancias_id_unique", "unique": True}),
+    ("documento_instancias", [("usuario_id", ASCENDING)], {"name": "documento_instancias_usuario_id"}),
+    ("documento_versiones", [("documento_id", ASCENDING), ("version", ASCENDING)], {"name": "documento_versiones_documento_version_unique", "unique": True}),
+    ("documento_lotes", [("id", ASCENDING)], {"name": "documento_lotes_id_unique", "unique": True}),
+    ("expediente", [("usuario_id", ASCENDING)], {"name": "expediente_usuario_id_unique", "unique": True}),
+    ("expediente", [("proximo_evento", ASCENDING)], {"name": "expediente_proximo_evento"}),
+    ("recordatorios", [("id", ASCENDING)], {"name": "recordatorios_id_unique", "unique": True}),
+    ("recordatorios", [("usuario_id", ASCENDING), ("created_at", ASCENDING)], {"name": "recordatorios_usuario_created"}),
+    ("selecciones", [("usuario_id", ASCENDING)], {"name": "selecciones_usuario_id"}),
+    ("archivo_blobs", [("id", ASCENDING)], {"name": "archivo_blobs_id_unique", "unique": True}),
+    ("archivos", [("usuario_id", ASCENDING), ("created_at", ASCENDING)], {"name": "archivos_usuario_created"}),
+    ("archivos", [("usuario_id", ASCENDING), ("sha256", ASCENDING)], {"name": "archivos_usuario_sha256"}),
+]
+
+# Result of the last ensure_indexes() run, kept for diagnostics
+index_report: Dict[str, Any] = {}
+
+async def ensure_indexes() -> Dict[str, Any]:
+    """Create the indexes in INDEX_SPECS and report missing or unused ones.
+
+    Safe to run on every startup. ``missing`` lists expected indexes that could
+    not be created (e.g. duplicate emails blocking the unique index), ``unused``
+    lists indexes with no recorded accesses according to ``$indexStats``.
+    """
+    report: Dict[str, Any] = {"ensured": [], "missing": [], "unused": [], "errors": []}
+
+    for collection_name, keys, options in INDEX_SPECS:
+        try:
+            await db[collection_name].create_index(keys, **options)
+            report["ensured"].append(f"{collection_name}.{options['name']}")
+        except OperationFailure as e:
+            report["errors"].append(f"{collection_name}.{options['name']}: {e}")
+
+    for collection_name in sorted({spec[0] for spec in INDEX_SPECS}):
+        expected = {options["name"] for name, _, options in INDEX_SPECS if name == collection_name}
+        try:
+            existing = await db[collection_name].index_information()
+        except OperationFailure as e:
+            report["errors"].append(f"{collection_name}: {e}")
+            continue
+        report["missing"].extend(f"{collection_name}.{name}" for name in sorted(expected - set(existing)))
+
+        try:
+            stats = await db[collection_name].aggregate([{"$indexStats": {}}]).to_list(None)
+        except Exception:
+            # $indexStats needs the clusterMonitor role; skip usage reporting without it
+            continue
+        for stat in stats:
+            if stat["name"] != "_id_" and stat.get("accesses", {}).get("ops", 0) == 0:
+                report["unused"].append(f"{collection_name}.{stat['name']}")
+
+    index_report.clear()
+    index_report.update(report)
+    return report
+
 # Routes
 @api_router.post("/auth/register", response_model=Dict[str, Any])
 async def register_user(user_data: UserCreate):
-    # Check if user exists
-    existing_user = await db.usuarios.find_one({"email": user_data.email})
-    if existing_user:
-        raise HTTPException(status_code=400, detail="Email already registered")
-    
-    # Create user
+    # Create user; the unique index on usuarios.email rejects duplicates
     hashed_password = hash_password(user_data.password)
     user_dict = user_data.dict()
     del user_dict["password"]
     user_dict["password_hash"] = hashed_password
     
     user = User(**user_dict)
-    await db.usuarios.insert_one(user.dict())
+    try:
+        await db.usuarios.insert_one(user.dict())
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email already registered")
     
     token = create_token(user.id)
     return {"token": token, "user": user}
@@ -405,17 +702,90 @@ async def create_establishment(establishment_data: EstablishmentCreate, current_
     
     return establishment
 
+# Bulk import settings
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+ESTABLISHMENT_LIST_FIELDS = ("servicios", "equipo_especial")
+
+@api_router.post("/establishments/import", response_model=EstablishmentImportReport)
+async def import_establishments(request: Request, formato: Optional[str] = None, sugerencias: bool = False, current_user: User = Depends(get_current_user)):
+    """Create many establishments from a CSV or NDJSON body.
+
+    Rows are parsed as the body streams in, validated against EstablishmentCreate
+    and written IMPORT_BATCH_SIZE at a time. CSV list cells use ';' as separator.
+    With ``sugerencias=true`` a compact suggestion response is returned per branch.
+    """
+    fmt = detect_format(request.headers.get("content-type"), formato)
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Formato no soportado: use CSV (text/csv) o NDJSON (application/x-ndjson)")
+
+    report = EstablishmentImportReport()
+    suggestion_memo: Dict[str, SuggestionResponse] = {}
+    batch: List[tuple] = []
+
+    def reject(row_number: int, error: str):
+        report.rechazados += 1
+        if len(report.errores) < IMPORT_MAX_REPORTED_ERRORS:
+            report.errores.append(ImportRowError(fila=row_number, error=error))
+
+    async def flush_batch():
+        try:
+            await db.establecimientos.insert_many([est.dict() for _, est in batch], ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {err["index"]: err.get("errmsg", "Error de escritura") for err in e.details.get("writeErrors", [])}
+        for index, (row_number, establishment) in enumerate(batch):
+            if index in failed:
+                reject(row_number, failed[index])
+                continue
+            report.importados += 1
+            report.establecimientos.append(establishment.id)
+            if sugerencias:
+                # Branches of the same franchise usually share a profile
+                perfil = establishment.dict(exclude={"id", "usuario_id", "created_at", "updated_at"})
+                key = json.dumps(perfil, sort_keys=True, default=str)
+                if key not in suggestion_memo:
+                    suggestion_memo[key] = await generate_suggestions(perfil, compact=True)
+                report.sugerencias[establishment.id] = suggestion_memo[key]
+        batch.clear()
+
+    async for row_number, record, error in iter_records(request.stream(), fmt, ESTABLISHMENT_LIST_FIELDS):
+        if error:
+            reject(row_number, error)
+            continue
+        try:
+            establishment_data = EstablishmentCreate(**record)
+        except ValidationError as e:
+            reject(row_number, format_validation_error(e))
+            continue
+        batch.append((row_number, Establishment(**establishment_data.dict(), usuario_id=current_user.id)))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush_batch()
+
+    if batch:
+        await flush_batch()
+    return report
+
 @api_router.get("/establishments", response_model=List[Establishment])
 async def get_user_establishments(current_user: User = Depends(get_current_user)):
     establishments = await db.establecimientos.find({"usuario_id": current_user.id}).to_list(None)
-    return [Establishment(**est) for est in establishments]
+    return load_rows(Establishment, establishments)
 
 @api_router.post("/suggestions", response_model=SuggestionResponse)
-async def get_regulatory_suggestions(request: SuggestionRequest):
+async def get_regulatory_suggestions(request: SuggestionRequest, compact: bool = False):
     perfil = request.dict()
-    suggestions = await generate_suggestions(perfil)
+    suggestions = await generate_suggestions(perfil, compact=compact)
     return suggestions
 
+@api_router.post("/suggestions/expand", response_model=SuggestionExpandResponse)
+async def expand_suggestions(request: SuggestionExpandRequest):
+    """Return full catalog entries for ids obtained from a compact suggestion response."""
+    catalog = await get_catalog()
+    return SuggestionExpandResponse(
+        plantillas=[catalog["templates"][i] for i in request.plantillas if i in catalog["templates"]],
+        tramites=[catalog["tramites"][i] for i in request.tramites if i in catalog["tramites"]]
+    )
+
 @api_router.post("/ai/consultation", response_model=AIConsultation)
 async def ai_consultation(request: AIConsultationRequest, current_user: User = Depends(get_current_user)):
     reasoning, conclusion = await get_ai_response(request.perfil, request.pregunta)
@@ -431,33 +801,812 @@ async def ai_consultation(request: AIConsultationRequest, current_user: User = D
     await db.consultas.insert_one(consultation.dict())
     return consultation
 
+# Data export settings
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', '500'))
+EXPORT_CHUNK_BYTES = int(os.environ.get('EXPORT_CHUNK_BYTES', '65536'))
+
+# (record type, collection) pairs included in a user export
+EXPORT_COLLECTIONS = [
+    ("establecimiento", "establecimientos"),
+    ("consulta", "consultas"),
+    ("documento", "documento_instancias"),
+]
+
+def export_line(tipo: str, doc: Dict[str, Any]) -> str:
+    """Encode one exported record as an NDJSON line."""
+    return json.dumps({"tipo": tipo, "data": doc}, ensure_ascii=False, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)) + "\n"
+
+async def stream_user_export(usuario_id: str):
+    """Yield a user's records as NDJSON, a few KB at a time.
+
+    Documents are pulled from the cursor one batch at a time and the generator
+    only advances when the client has consumed the previous chunk, so memory
+    stays constant regardless of account size.
+    """
+    buffer: List[str] = []
+    buffered = 0
+    for tipo, collection_name in EXPORT_COLLECTIONS:
+        cursor = db[collection_name].find({"usuario_id": usuario_id}, {"_id": 0}).batch_size(EXPORT_BATCH_SIZE)
+        async for doc in cursor:
+            line = export_line(tipo, doc)
+            buffer.append(line)
+            buffered += len(line)
+            if buffered >= EXPORT_CHUNK_BYTES:
+                yield "".join(buffer)
+                buffer.clear()
+                buffered = 0
+    if buffer:
+        yield "".join(buffer)
+
+@api_router.get("/export")
+async def export_user_data(current_user: User = Depends(get_current_user)):
+    """Stream all establishments, consultations and documents of the user as NDJSON."""
+    filename = f"cofepris_export_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.ndjson"
+    return StreamingResponse(
+        stream_user_export(current_user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.get("/templates", response_model=List[DocumentTemplate])
 async def get_document_templates():
     templates_raw = await db.documento_plantillas.find({"activo": True}).to_list(None)
     templates = convert_objectid(templates_raw)
-    return [DocumentTemplate(**template) for template in templates]
+    return load_rows(DocumentTemplate, templates)
 
 @api_router.get("/tramites", response_model=List[Tramite])
 async def get_tramites():
     tramites_raw = await db.tramites.find({"activo": True}).to_list(None)
     tramites = convert_objectid(tramites_raw)
-    return [Tramite(**tramite) for tramite in tramites]
+    return load_rows(Tramite, tramites)
 
-@api_router.post("/webhooks/pago")
-async def webhook_payment(payload: Dict[str, Any]):
-    # Mock payment webhook - in production, verify HMAC signature
-    user_id = payload.get("user_id")
-    if user_id:
-        await db.usuarios.update_one(
-            {"id": user_id},
-            {
-                "$set": {
-                    "estado_suscripcion": "ACTIVA",
-                    "fecha_renovacion": (datetime.utcnow() + timedelta(days=30)).isoformat()
-                }
+# Document instances and their PDFs. Rendering runs in a separate process pool;
+# output is cached on disk by a hash of template version plus campos.
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', str(ROOT_DIR / 'pdf_cache')))
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+pdf_renderer = PdfRenderer(PDF_CACHE_DIR, PDF_RENDER_WORKERS)
+
+# Version history lives in documento_versiones as JSON-patch deltas with a
+# full keyframe every HISTORY_KEYFRAME_INTERVAL versions
+HISTORY_KEYFRAME_INTERVAL = int(os.environ.get('HISTORY_KEYFRAME_INTERVAL', '10'))
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+
+async def record_version(document_id: str, version: int, previous: Dict[str, Any], campos: Dict[str, Any], user_id: str):
+    if not is_keyframe(version, HISTORY_KEYFRAME_INTERVAL) and await db.documento_versiones.find_one(
+        {"documento_id": document_id, "version": version - 1}, {"_id": 1}
+    ) is None:
+        # The delta needs the previous entry. Documents created before history
+        # was recorded have no version 1, and an insert that failed after the
+        # version bump leaves a gap; ``previous`` is that version's campos, so
+        # it is restored as a keyframe.
+        if version > 2:
+            logger.warning(f"History of document {document_id} has no version {version - 1}; restoring it")
+        gap = history_entry(document_id, version - 1, {}, previous, HISTORY_KEYFRAME_INTERVAL, None, force_keyframe=True)
+        gap["created_at"] = datetime.utcnow()
+        await db.documento_versiones.insert_one(gap)
+    entry = history_entry(document_id, version, previous, campos, HISTORY_KEYFRAME_INTERVAL, user_id)
+    entry["created_at"] = datetime.utcnow()
+    await db.documento_versiones.insert_one(entry)
+
+async def get_active_template(plantilla_id: str) -> Dict[str, Any]:
+    template = (await get_catalog())["templates"].get(plantilla_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Plantilla no encontrada")
+    return template
+
+async def get_user_document(document_id: str, user_id: str) -> Dict[str, Any]:
+    document = await db.documento_instancias.find_one({"id": document_id, "usuario_id": user_id}, {"_id": 0})
+    if not document:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    return document
+
+# Full-text search: templates and trámites share one in-process index and
+# each user's documents get their own, updated as documents are saved and
+# rebuilt from the database once SEARCH_INDEX_TTL seconds old.
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', '300'))
+SEARCH_INDEX_USERS = int(os.environ.get('SEARCH_INDEX_USERS', '1000'))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+search_index = SearchIndex(SEARCH_INDEX_USERS + 1, SEARCH_INDEX_TTL)
+
+async def index_document(usuario_id: str, document_id: str, plantilla_id: str, campos: Dict[str, Any]):
+    template = (await get_catalog())["templates"].get(plantilla_id) or {}
+    search_index.add(usuario_id, *document_entry(document_id, template.get("nombre", ""), campos))
+
+async def load_search_partitions(usuario_id: str):
+    catalog = await get_catalog()
+    if not search_index.loaded(None):
+        search_index.load(None, [template_entry(t) for t in catalog["templates"].values()] +
+                          [tramite_entry(t) for t in catalog["tramites"].values()])
+    if not search_index.loaded(usuario_id):
+        documents = await db.documento_instancias.find(
+            {"usuario_id": usuario_id}, {"_id": 0, "id": 1, "plantilla_id": 1, "campos": 1}
+        ).to_list(None)
+        search_index.load(usuario_id, [
+            document_entry(d["id"], catalog["templates"].get(d["plantilla_id"], {}).get("nombre", ""), d.get("campos") or {})
+            for d in documents
+        ])
+
+@api_router.get("/search", response_model=SearchResponse)
+async def search(q: str, tipo: Optional[SearchResultType] = None, pagina: int = 1, por_pagina: int = SEARCH_PAGE_SIZE,
+                 current_user: User = Depends(get_current_user)):
+    """Ranked search over templates, trámites and the user's documents.
+
+    Accents and case are ignored and words match their plural and derived
+    forms; results contain every word of ``q``.
+    """
+    pagina = max(1, pagina)
+    por_pagina = max(1, min(por_pagina, SEARCH_PAGE_SIZE))
+    await load_search_partitions(current_user.id)
+    total, resultados = search_index.search(
+        q, [None, current_user.id], (pagina - 1) * por_pagina, por_pagina, tipo.value if tipo else None
+    )
+    return SearchResponse(total=total, pagina=pagina, por_pagina=por_pagina, resultados=resultados)
+
+@api_router.post("/documents", response_model=DocumentInstance)
+async def create_document(request: DocumentInstanceCreate, current_user: User = Depends(get_current_user)):
+    template = await get_active_template(request.plantilla_id)
+    document = DocumentInstance(
+        usuario_id=current_user.id,
+        plantilla_id=request.plantilla_id,
+        campos=request.campos,
+        validaciones=field_validators.get(template).validate(request.campos),
+        carpeta=template["categoria"]
+    )
+    await db.documento_instancias.insert_one(document.dict())
+    await record_version(document.id, 1, {}, document.campos, current_user.id)
+    await index_document(current_user.id, document.id, document.plantilla_id, document.campos)
+    return document
+
+@api_router.get("/documents/{document_id}", response_model=DocumentInstance)
+async def get_document(document_id: str, current_user: User = Depends(get_current_user)):
+    return await get_user_document(document_id, current_user.id)
+
+@api_router.put("/documents/{document_id}", response_model=DocumentInstance)
+async def update_document(document_id: str, request: DocumentInstanceUpdate, current_user: User = Depends(get_current_user)):
+    document = await get_user_document(document_id, current_user.id)
+    changes = request.dict(exclude_none=True)
+    changes["updated_at"] = datetime.utcnow()
+    if "campos" not in changes or changes["campos"] == document.get("campos"):
+        previous = await db.documento_instancias.find_one_and_update(
+            {"id": document_id, "usuario_id": current_user.id},
+            {"$set": changes},
+            projection={"_id": 0},
+            return_document=ReturnDocument.BEFORE
+        )
+        if not previous:
+            raise HTTPException(status_code=404, detail="Documento no encontrado")
+        await record_document_status(current_user.id, previous, changes.get("estado"))
+        return {**previous, **changes}
+    
+    changes["validaciones"] = await validate_campos(document["plantilla_id"], changes["campos"])
+    
+    # Bump the version atomically and diff against what it replaced
+    previous = await db.documento_instancias.find_one_and_update(
+        {"id": document_id, "usuario_id": current_user.id},
+        {"$set": changes, "$inc": {"version": 1}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    version = previous.get("version", 1) + 1
+    await record_version(document_id, version, previous.get("campos") or {}, changes["campos"], current_user.id)
+    await index_document(current_user.id, document_id, document["plantilla_id"], changes["campos"])
+    await record_document_status(current_user.id, previous, changes.get("estado"))
+    return {**previous, **changes, "version": version}
+
+# Autosave patches for the same document arriving within AUTOSAVE_WINDOW
+# seconds are merged and written once
+AUTOSAVE_WINDOW = float(os.environ.get('AUTOSAVE_WINDOW', '0.5'))
+AUTOSAVE_CONFLICT_DETAIL = "El documento fue modificado por otra sesión; recárgalo"
+
+async def flush_autosave(document_id: str, pending) -> Dict[str, Any]:
+    version = pending.base_version + 1
+    now = datetime.utcnow()
+    update: Dict[str, Any] = {"$set": {"version": version, "updated_at": now}}
+    for field, value in pending.changes.items():
+        if value is None:
+            update.setdefault("$unset", {})[f"campos.{field}"] = ""
+        else:
+            update["$set"][f"campos.{field}"] = value
+    validaciones = await validate_campos(pending.plantilla_id, pending.changes, pending.changes)
+    for field, result in validaciones.items():
+        update["$set"][f"validaciones.{field}"] = result
+    
+    # Documents created before versioning have no version field yet
+    expected_version = {"$in": [1, None]} if pending.base_version == 1 else pending.base_version
+    previous = await db.documento_instancias.find_one_and_update(
+        {"id": document_id, "usuario_id": pending.usuario_id, "version": expected_version},
+        update,
+        projection={"_id": 0, "campos": 1},
+        return_document=ReturnDocument.BEFORE
+    )
+    if not previous:
+        raise VersionConflict()
+    campos = previous.get("campos") or {}
+    merged = merge_fields(campos, pending.changes)
+    await record_version(document_id, version, campos, merged, pending.usuario_id)
+    await index_document(pending.usuario_id, document_id, pending.plantilla_id, merged)
+    return {"id": document_id, "version": version, "updated_at": now, "parches": pending.requests, "validaciones": validaciones}
+
+autosave = AutosaveCoalescer(flush_autosave, AUTOSAVE_WINDOW)
+
+@api_router.patch("/documents/{document_id}", response_model=AutosaveResponse)
+async def autosave_document(document_id: str, request: DocumentPatch, current_user: User = Depends(get_current_user)):
+    """Field-level autosave: ``null`` removes a field. Send the last version received
+    to be told (409) when another session saved in between."""
+    invalid = [field for field in request.campos if not field or "." in field or field.startswith("$")]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Nombre de campo inválido: {', '.join(invalid)}")
+    
+    # Batches already buffered or being written for this user's document skip
+    # the ownership read; the coalescer checks the version against them
+    pending = autosave.pending_for(document_id)
+    if pending is not None and pending.usuario_id == current_user.id:
+        base_version, plantilla_id = pending.base_version, pending.plantilla_id
+        if request.version is not None:
+            base_version = request.version
+    else:
+        document = await get_user_document(document_id, current_user.id)
+        base_version, plantilla_id = document.get("version") or 1, document["plantilla_id"]
+        if request.version is not None and request.version != base_version:
+            raise HTTPException(status_code=409, detail=AUTOSAVE_CONFLICT_DETAIL)
+    
+    try:
+        return await autosave.submit(document_id, current_user.id, base_version, request.campos, plantilla_id)
+    except VersionConflict:
+        raise HTTPException(status_code=409, detail=AUTOSAVE_CONFLICT_DETAIL)
+
+@api_router.get("/documents/{document_id}/history", response_model=List[DocumentHistoryEntry])
+async def get_document_history(document_id: str, antes: Optional[int] = None, limite: int = HISTORY_PAGE_SIZE,
+                               current_user: User = Depends(get_current_user)):
+    """Version list, newest first; page with ``antes`` set to the last version seen."""
+    await get_user_document(document_id, current_user.id)
+    query: Dict[str, Any] = {"documento_id": document_id}
+    if antes is not None:
+        query["version"] = {"$lt": antes}
+    entries = await db.documento_versiones.find(query, {"_id": 0}) \
+        .sort("version", -1).limit(max(1, min(limite, HISTORY_PAGE_SIZE))).to_list(None)
+    return [summarize_entry(entry) for entry in entries]
+
+@api_router.get("/documents/{document_id}/versions/{version}", response_model=DocumentVersion)
+async def get_document_version(document_id: str, version: int, current_user: User = Depends(get_current_user)):
+    await get_user_document(document_id, current_user.id)
+    keyframe = await db.documento_versiones.find_one(
+        {"documento_id": document_id, "tipo": "keyframe", "version": {"$lte": version}},
+        {"_id": 0},
+        sort=[("version", -1)]
+    )
+    if not keyframe:
+        raise HTTPException(status_code=404, detail="Versión no disponible")
+    deltas = await db.documento_versiones.find(
+        {"documento_id": document_id, "version": {"$gt": keyframe["version"], "$lte": version}},
+        {"_id": 0}
+    ).sort("version", 1).to_list(None)
+    if keyframe["version"] + len(deltas) != version:
+        raise HTTPException(status_code=404, detail="Versión no disponible")
+    return DocumentVersion(documento_id=document_id, version=version, campos=rebuild_version([keyframe] + deltas))
+
+@api_router.get("/documents/{document_id}/pdf")
+async def download_document_pdf(document_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    document = await get_user_document(document_id, current_user.id)
+    template = await get_active_template(document["plantilla_id"])
+    campos = document.get("campos") or {}
+    
+    # The cache key doubles as ETag, so unchanged documents are not even read
+    etag = f'"{pdf_cache_key(template, campos)}"'
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    
+    key, pdf, cached = await pdf_renderer.render(template, campos)
+    pdf_url = f"/api/documents/{document_id}/pdf"
+    if document.get("pdf_url") != pdf_url:
+        await db.documento_instancias.update_one({"id": document_id}, {"$set": {"pdf_url": pdf_url}})
+    
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={
+            "ETag": etag,
+            "X-PDF-Cache": "HIT" if cached else "MISS",
+            "Content-Disposition": f'attachment; filename="documento_{document_id}.pdf"'
+        }
+    )
+
+# Bulk generation: every suggested template becomes a prefilled document in
+# one insert; PDFs, if requested, render in the background while the job
+# document in documento_lotes tracks progress.
+DOCUMENT_JOB_PDF_CONCURRENCY = int(os.environ.get('DOCUMENT_JOB_PDF_CONCURRENCY', str(PDF_RENDER_WORKERS)))
+document_jobs = JobRunner()
+
+async def run_document_job(job_id: str, documents: List[Dict[str, Any]]):
+    async def render_one(document: Dict[str, Any]):
+        template = await get_active_template(document["plantilla_id"])
+        await pdf_renderer.render(template, document["campos"])
+        await db.documento_instancias.update_one(
+            {"id": document["id"]}, {"$set": {"pdf_url": f"/api/documents/{document['id']}/pdf"}}
+        )
+    
+    async def progress(generados: int, fallidos: int):
+        await db.documento_lotes.update_one(
+            {"id": job_id},
+            {"$set": {"pdf_generados": generados, "pdf_fallidos": fallidos, "updated_at": datetime.utcnow()}}
+        )
+    
+    estado = DocumentJobStatus.INTERRUMPIDO
+    try:
+        await render_pdfs(documents, render_one, progress, DOCUMENT_JOB_PDF_CONCURRENCY)
+        estado = DocumentJobStatus.COMPLETADO
+    finally:
+        await db.documento_lotes.update_one(
+            {"id": job_id}, {"$set": {"estado": estado.value, "updated_at": datetime.utcnow()}}
+        )
+
+@api_router.post("/documents/batch", response_model=DocumentBatchJob)
+async def create_document_batch(request: DocumentBatchCreate, current_user: User = Depends(get_current_user)):
+    """Create one prefilled document per suggested template.
+
+    Templates no longer in the catalog are listed in ``omitidas``. With
+    ``generar_pdf`` the PDFs are rendered afterwards; poll
+    ``GET /documents/batch/{job_id}`` for progress.
+    """
+    establishment = await db.establecimientos.find_one(
+        {"id": request.establecimiento_id, "usuario_id": current_user.id}, {"_id": 0}
+    )
+    if not establishment:
+        raise HTTPException(status_code=404, detail="Establecimiento no encontrado")
+    perfil = {**establishment, "responsable": current_user.nombre,
+              "razon_social": current_user.razon_social, "rfc": current_user.rfc}
+    
+    templates = (await get_catalog())["templates"]
+    documents: List[DocumentInstance] = []
+    omitted: List[str] = []
+    seen = set()
+    for suggestion in request.sugerencias.plantillas:
+        plantilla_id = str(suggestion.get("id"))
+        if plantilla_id in seen:
+            continue
+        seen.add(plantilla_id)
+        template = templates.get(plantilla_id)
+        if not template:
+            omitted.append(plantilla_id)
+            continue
+        validator = field_validators.get(template)
+        campos = prefill_campos(template, validator, perfil)
+        documents.append(DocumentInstance(
+            usuario_id=current_user.id,
+            plantilla_id=plantilla_id,
+            campos=campos,
+            validaciones=validator.validate(campos),
+            carpeta=template["categoria"]
+        ))
+    
+    if documents:
+        now = datetime.utcnow()
+        await db.documento_instancias.insert_many([document.dict() for document in documents])
+        await db.documento_versiones.insert_many([
+            {**history_entry(document.id, 1, {}, document.campos, HISTORY_KEYFRAME_INTERVAL, current_user.id), "created_at": now}
+            for document in documents
+        ])
+        for document in documents:
+            await index_document(current_user.id, document.id, document.plantilla_id, document.campos)
+    
+    render = request.generar_pdf and bool(documents)
+    job = DocumentBatchJob(
+        usuario_id=current_user.id,
+        establecimiento_id=request.establecimiento_id,
+        estado=DocumentJobStatus.EN_PROCESO if render else DocumentJobStatus.COMPLETADO,
+        documentos=[document.id for document in documents],
+        omitidas=omitted,
+        pdf_total=len(documents) if render else 0
+    )
+    await db.documento_lotes.insert_one(job.dict())
+    if render:
+        document_jobs.start(run_document_job(job.id, [document.dict() for document in documents]), name=f"document-job-{job.id}")
+    return job
+
+@api_router.get("/documents/batch/{job_id}", response_model=DocumentBatchJob)
+async def get_document_batch(job_id: str, current_user: User = Depends(get_current_user)):
+    job = await db.documento_lotes.find_one({"id": job_id, "usuario_id": current_user.id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+    return job
+
+# File manager uploads: the body is streamed to a temporary file while it is
+# hashed, then stored once per content hash in the FILES_BUCKET GridFS
+# bucket; archivo_blobs records which hashes are stored and archivos each
+# user's copy of them.
+FILES_BUCKET = os.environ.get('FILES_BUCKET', 'files')
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = Path(os.environ.get('UPLOAD_SPOOL_DIR', str(ROOT_DIR / 'upload_spool')))
+FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE', '100'))
+
+async def store_blob(sha256: str, source: Path, content_type: str, size: int):
+    """Upload the content unless it is already stored."""
+    if await db.archivo_blobs.find_one({"id": sha256}, {"_id": 0, "id": 1}):
+        return
+    bucket = AsyncIOMotorGridFSBucket(db, bucket_name=FILES_BUCKET)
+    path = blob_path(sha256)
+    with open(source, "rb") as f:
+        gridfs_id = await bucket.upload_from_stream(path, f, metadata={"content_type": content_type})
+    try:
+        await db.archivo_blobs.insert_one({
+            "id": sha256,
+            "storage_path": path,
+            "gridfs_id": gridfs_id,
+            "content_type": content_type,
+            "tamano": size,
+            "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        # The same content finished uploading concurrently and registered first
+        await bucket.delete(gridfs_id)
+
+@api_router.post("/files", response_model=UserFile)
+async def upload_file(request: Request, current_user: User = Depends(get_current_user)):
+    """Multipart upload with a ``file`` part and an optional ``carpeta`` field.
+
+    The body is read as a stream, so memory use does not grow with the file.
+    """
+    try:
+        upload = await receive_upload(
+            request.headers.get("content-type", ""), request.stream(), UPLOAD_SPOOL_DIR, UPLOAD_MAX_SIZE
+        )
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413, detail=f"El archivo excede el tamaño máximo de {UPLOAD_MAX_SIZE // (1024 * 1024)} MB"
+        )
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        await store_blob(upload.sha256, upload.path, upload.content_type, upload.size)
+        deduplicado = await db.archivos.find_one(
+            {"usuario_id": current_user.id, "sha256": upload.sha256}, {"_id": 1}
+        ) is not None
+        user_file = UserFile(
+            usuario_id=current_user.id,
+            nombre=upload.filename,
+            carpeta=upload.fields.get("carpeta") or None,
+            content_type=upload.content_type,
+            tamano=upload.size,
+            sha256=upload.sha256,
+            storage_path=blob_path(upload.sha256),
+            deduplicado=deduplicado
+        )
+        await db.archivos.insert_one(user_file.dict())
+        return user_file
+    finally:
+        upload.discard()
+
+@api_router.get("/files", response_model=List[UserFile])
+async def get_files(carpeta: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    query: Dict[str, Any] = {"usuario_id": current_user.id}
+    if carpeta:
+        query["carpeta"] = carpeta
+    files = await db.archivos.find(query, {"_id": 0}).sort("created_at", -1).limit(FILES_PAGE_SIZE).to_list(None)
+    return files
+
+# Payment webhook: verified, deduplicated and queued; a background consumer
+# applies the subscription updates in batches.
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '10000'))
+WEBHOOK_SEEN_KEYS = int(os.environ.get('WEBHOOK_SEEN_KEYS', '50000'))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '200'))
+WEBHOOK_FLUSH_INTERVAL = float(os.environ.get('WEBHOOK_FLUSH_INTERVAL', '0.2'))
+SUBSCRIPTION_DAYS = 30
+
+async def apply_payment_events(events: Dict[str, Dict[str, Any]]):
+    """Activate the subscription of every user in the batch with a single write."""
+    user_ids = list(events)
+    await db.usuarios.update_many(
+        {"id": {"$in": user_ids}},
+        {
+            "$set": {
+                "estado_suscripcion": "ACTIVA",
+                "fecha_renovacion": (datetime.utcnow() + timedelta(days=SUBSCRIPTION_DAYS)).isoformat()
             }
+        }
+    )
+    invalidate_principals(user_ids)
+
+payment_events = PaymentEventQueue(
+    apply_payment_events,
+    max_size=WEBHOOK_QUEUE_SIZE,
+    seen_keys=WEBHOOK_SEEN_KEYS,
+    batch_size=WEBHOOK_BATCH_SIZE,
+    flush_interval=WEBHOOK_FLUSH_INTERVAL,
+)
+
+# Subscription expiry: one worker (holding the lease) periodically flips
+# subscriptions past fecha_renovacion back to INACTIVA, so requests only read
+# estado_suscripcion from the cached principal.
+SUBSCRIPTION_SWEEP_INTERVAL = int(os.environ.get('SUBSCRIPTION_SWEEP_INTERVAL', '60'))
+SUBSCRIPTION_SWEEP_BATCH_SIZE = int(os.environ.get('SUBSCRIPTION_SWEEP_BATCH_SIZE', '500'))
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    now = datetime.utcnow()
+    try:
+        lease = await db.leases.find_one_and_update(
+            {"_id": name, "$or": [{"owner": owner}, {"expires_at": {"$lt": now}}]},
+            {"$set": {"owner": owner, "expires_at": now + timedelta(seconds=ttl)}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
         )
-    return {"status": "ok"}
+    except DuplicateKeyError:
+        # Held by another worker: the filter missed and the upsert hit _id
+        return False
+    return lease is not None
+
+async def release_lease(name: str, owner: str):
+    await db.leases.delete_one({"_id": name, "owner": owner})
+
+async def expire_subscriptions():
+    """Deactivate expired subscriptions in batches of ids found through the index."""
+    now = datetime.utcnow().isoformat()
+    expired_filter = {"estado_suscripcion": "ACTIVA", "fecha_renovacion": {"$lt": now}}
+    total = 0
+    while True:
+        batch = await db.usuarios.find(expired_filter, {"_id": 0, "id": 1}).limit(SUBSCRIPTION_SWEEP_BATCH_SIZE).to_list(None)
+        user_ids = [user["id"] for user in batch]
+        if not user_ids:
+            break
+        # Re-check the condition so a renewal that landed meanwhile is kept
+        await db.usuarios.update_many(
+            {"id": {"$in": user_ids}, **expired_filter},
+            {"$set": {"estado_suscripcion": "INACTIVA"}}
+        )
+        invalidate_principals(user_ids)
+        total += len(user_ids)
+        if len(user_ids) < SUBSCRIPTION_SWEEP_BATCH_SIZE or not await subscription_sweeper.renew():
+            break
+    if total:
+        logger.info(f"Subscriptions expired: {total}")
+
+subscription_sweeper = LeasedTask(
+    "subscription_sweeper",
+    expire_subscriptions,
+    acquire_lease,
+    release_lease,
+    interval=SUBSCRIPTION_SWEEP_INTERVAL,
+)
+
+# Compliance: the expediente collection holds one materialized row per user,
+# updated by events (selection activated, document LISTO, trámite completed)
+# so reading it never scans documents. A periodic audit recounts LISTO
+# documents and re-derives every row, which also applies passed deadlines.
+COMPLIANCE_WARNING_DAYS = int(os.environ.get('COMPLIANCE_WARNING_DAYS', '30'))
+COMPLIANCE_RED_THRESHOLD = int(os.environ.get('COMPLIANCE_RED_THRESHOLD', '50'))
+COMPLIANCE_AUDIT_INTERVAL = int(os.environ.get('COMPLIANCE_AUDIT_INTERVAL', '3600'))
+COMPLIANCE_AUDIT_PAGE_SIZE = int(os.environ.get('COMPLIANCE_AUDIT_PAGE_SIZE', '200'))
+
+async def load_expediente(usuario_id: str) -> Optional[Dict[str, Any]]:
+    return await db.expediente.find_one({"usuario_id": usuario_id}, {"_id": 0})
+
+async def save_expediente(row: Dict[str, Any], expected_rev: int) -> bool:
+    now = datetime.utcnow()
+    if expected_rev == 0:
+        try:
+            await db.expediente.insert_one({**row, "id": str(uuid.uuid4()), "created_at": now, "updated_at": now})
+        except DuplicateKeyError:
+            return False
+        return True
+    result = await db.expediente.update_one(
+        {"usuario_id": row["usuario_id"], "rev": expected_rev},
+        {"$set": {**row, "updated_at": now}}
+    )
+    return result.modified_count == 1
+
+def schedule_deadline(row: Dict[str, Any]):
+    deadline_scheduler.schedule(row["usuario_id"], parse_timestamp(row.get("proximo_evento")))
+
+compliance = ComplianceStore(
+    load_expediente, save_expediente, COMPLIANCE_WARNING_DAYS, COMPLIANCE_RED_THRESHOLD, on_saved=schedule_deadline
+)
+
+async def record_document_status(usuario_id: str, previous: Dict[str, Any], estado: Optional[DocumentStatus]):
+    """Count a document entering or leaving LISTO; a failure is repaired by the audit."""
+    if estado is None or (estado == DocumentStatus.LISTO) == (previous.get("estado") == DocumentStatus.LISTO.value):
+        return
+    event = {"tipo": DOCUMENTO_LISTO, "plantilla_id": previous["plantilla_id"], "delta": 1 if estado == DocumentStatus.LISTO else -1}
+    try:
+        await compliance.apply(usuario_id, event)
+    except Exception as e:
+        logger.error(f"Compliance update failed for {usuario_id}: {e}")
+
+async def audit_compliance():
+    """Recount LISTO documents per template for every expediente and repair drift."""
+    last_user_id, checked, repaired = None, 0, 0
+    while True:
+        query = {"usuario_id": {"$gt": last_user_id}} if last_user_id else {}
+        rows = await db.expediente.find(query, {"_id": 0}).sort("usuario_id", 1).limit(COMPLIANCE_AUDIT_PAGE_SIZE).to_list(None)
+        if not rows:
+            break
+        user_ids = [row["usuario_id"] for row in rows]
+        counts: Dict[str, Dict[str, int]] = {user_id: {} for user_id in user_ids}
+        groups = await db.documento_instancias.aggregate([
+            {"$match": {"usuario_id": {"$in": user_ids}, "estado": DocumentStatus.LISTO.value}},
+            {"$group": {"_id": {"usuario_id": "$usuario_id", "plantilla_id": "$plantilla_id"}, "total": {"$sum": 1}}}
+        ]).to_list(None)
+        for group in groups:
+            counts[group["_id"]["usuario_id"]][group["_id"]["plantilla_id"]] = group["total"]
+        for row in rows:
+            drift = await compliance.reconcile(row, counts[row["usuario_id"]])
+            if "documentos_listos" in drift:
+                repaired += 1
+                logger.warning(f"Compliance state of {row['usuario_id']} was inconsistent: {', '.join(drift)}")
+        checked += len(rows)
+        last_user_id = user_ids[-1]
+        if len(rows) < COMPLIANCE_AUDIT_PAGE_SIZE or not await compliance_auditor.renew():
+            break
+    logger.info(f"Compliance audit: {checked} expedientes checked, {repaired} repaired")
+
+compliance_auditor = LeasedTask(
+    "compliance_auditor",
+    audit_compliance,
+    acquire_lease,
+    release_lease,
+    interval=COMPLIANCE_AUDIT_INTERVAL,
+)
+
+# Deadlines: the lease holder keeps the expedientes due within the next
+# DEADLINE_HORIZON seconds in a heap, loaded through the proximo_evento index,
+# and re-derives them as they come due; passed and upcoming deadlines leave a
+# reminder in recordatorios.
+DEADLINE_TICK_INTERVAL = int(os.environ.get('DEADLINE_TICK_INTERVAL', '15'))
+DEADLINE_HORIZON = int(os.environ.get('DEADLINE_HORIZON', '3600'))
+DEADLINE_REFRESH_INTERVAL = int(os.environ.get('DEADLINE_REFRESH_INTERVAL', '300'))
+DEADLINE_BATCH_SIZE = int(os.environ.get('DEADLINE_BATCH_SIZE', '100'))
+DEADLINE_MAX_LOADED = int(os.environ.get('DEADLINE_MAX_LOADED', '10000'))
+REMINDERS_PAGE_SIZE = int(os.environ.get('REMINDERS_PAGE_SIZE', '50'))
+
+async def load_deadline_window(start: Optional[datetime], end: datetime, limit: int) -> List[tuple]:
+    window: Dict[str, Any] = {"$lte": end.isoformat()}
+    if start is not None:
+        window["$gte"] = start.isoformat()
+    rows = await db.expediente.find({"proximo_evento": window}, {"_id": 0, "usuario_id": 1, "proximo_evento": 1}) \
+        .sort("proximo_evento", 1).limit(limit).to_list(None)
+    return [(parse_timestamp(row["proximo_evento"]), row["usuario_id"]) for row in rows]
+
+async def load_deadline_cursor() -> Optional[datetime]:
+    state = await db.scheduler_cursors.find_one({"_id": "deadlines"})
+    return state["cursor"] if state else None
+
+async def save_deadline_cursor(cursor: datetime):
+    await db.scheduler_cursors.update_one({"_id": "deadlines"}, {"$set": {"cursor": cursor}}, upsert=True)
+
+async def fire_deadlines(usuario_ids: List[str]) -> List[str]:
+    """Re-derive each due expediente and store the reminders of the batch in one write.
+
+    Returns the users whose expediente could not be updated, for a retry.
+    """
+    pending, failed = [], []
+    for usuario_id in usuario_ids:
+        try:
+            row = await compliance.apply(usuario_id, {"tipo": VENCIMIENTO})
+        except Exception as e:
+            logger.error(f"Deadline update failed for {usuario_id}: {e}")
+            failed.append(usuario_id)
+            continue
+        pending.extend(reminders(row))
+    if not pending:
+        return failed
+    now = datetime.utcnow()
+    try:
+        await db.recordatorios.insert_many([{**reminder, "created_at": now} for reminder in pending], ordered=False)
+    except BulkWriteError as e:
+        # Reminder ids are deterministic: duplicate keys were already sent
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+    return failed
+
+deadline_scheduler = DeadlineScheduler(
+    load_deadline_window,
+    fire_deadlines,
+    load_deadline_cursor,
+    save_deadline_cursor,
+    horizon=DEADLINE_HORIZON,
+    refresh_interval=DEADLINE_REFRESH_INTERVAL,
+    batch_size=DEADLINE_BATCH_SIZE,
+    max_loaded=DEADLINE_MAX_LOADED,
+)
+
+deadline_task = LeasedTask(
+    "deadline_scheduler",
+    deadline_scheduler.tick,
+    acquire_lease,
+    release_lease,
+    interval=DEADLINE_TICK_INTERVAL,
+)
+
+@api_router.post("/selections", response_model=Selection)
+async def create_selection(request: SelectionCreate, current_user: User = Depends(get_current_user)):
+    selection = Selection(usuario_id=current_user.id, items=request.items, estado=request.estado)
+    await db.selecciones.insert_one(selection.dict())
+    if selection.estado == SelectionStatus.ACTIVO:
+        await compliance.apply(current_user.id, {"tipo": SELECCION_ACTIVADA, "items": selection.items})
+    return selection
+
+@api_router.get("/expediente", response_model=Expediente)
+async def get_expediente(current_user: User = Depends(get_current_user)):
+    return await compliance.read(current_user.id)
+
+@api_router.get("/expediente/recordatorios", response_model=List[Recordatorio])
+async def get_reminders(current_user: User = Depends(get_current_user)):
+    rows = await db.recordatorios.find({"usuario_id": current_user.id}, {"_id": 0}) \
+        .sort("created_at", -1).limit(REMINDERS_PAGE_SIZE).to_list(None)
+    return rows
+
+@api_router.post("/expediente/tramites/{tramite_id}/completar", response_model=Expediente)
+async def complete_tramite(tramite_id: str, request: TramiteCompletion, current_user: User = Depends(get_current_user)):
+    """Mark a trámite as done; with ``fecha_vencimiento`` it stops counting once that date passes."""
+    if tramite_id not in (await get_catalog())["tramites"]:
+        raise HTTPException(status_code=404, detail="Trámite no encontrado")
+    return await compliance.apply(current_user.id, {
+        "tipo": TRAMITE_COMPLETADO,
+        "tramite_id": tramite_id,
+        "completado_en": datetime.utcnow().isoformat(),
+        "vence": request.fecha_vencimiento.isoformat() if request.fecha_vencimiento else None
+    })
+
+@api_router.post("/webhooks/pago")
+async def webhook_payment(request: Request):
+    body = await request.body()
+    if not verify_signature(WEBHOOK_SECRET, body, request.headers.get("x-signature")):
+        raise HTTPException(status_code=401, detail="Firma inválida")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    
+    user_id = payload.get("user_id")
+    if not user_id:
+        return {"status": "ok"}
+    
+    key = idempotency_key(payload, body, request.headers.get("idempotency-key"))
+    result = payment_events.submit(key, str(user_id), payload)
+    if result == "full":
+        # Let the provider retry later instead of losing the event
+        raise HTTPException(status_code=503, detail="Cola de pagos llena, reintente")
+    return {"status": "ok", "duplicado": result == "duplicate"}
+
+# Course modules: sanitized and serialized once per updated_at and served
+# from memory; the collection is re-read at most once per COURSE_CACHE_TTL.
+COURSE_CACHE_TTL = int(os.environ.get('COURSE_CACHE_TTL', '300'))
+course_cache = CourseCache()
+_course_refresh = {"expires_at": 0.0}
+
+async def get_course() -> CourseCache:
+    now = datetime.utcnow().timestamp()
+    if now >= _course_refresh["expires_at"]:
+        modules = await db.curso_modulos.find({"activo": True}, {"_id": 0}).to_list(None)
+        course_cache.update(modules)
+        _course_refresh["expires_at"] = now + COURSE_CACHE_TTL
+    return course_cache
+
+def invalidate_course_cache():
+    _course_refresh["expires_at"] = 0.0
+
+def cached_json(body: bytes, etag: str, request: Request) -> Response:
+    # no-cache: clients keep the copy but revalidate, so edits show up at once
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/course/modules")
+async def list_course_modules(request: Request):
+    """Active modules in course order, with their headings for navigation."""
+    course = await get_course()
+    return cached_json(course.index_body, course.index_etag, request)
+
+@api_router.get("/course/modules/{slug}")
+async def get_course_module(slug: str, request: Request):
+    module = (await get_course()).get(slug)
+    if module is None:
+        raise HTTPException(status_code=404, detail="Módulo no encontrado")
+    return cached_json(module.body, module.etag, request)
 
 # Initialize sample data
 @api_router.post("/init/sample-data")
@@ -531,6 +1680,40 @@ async def init_sample_data():
         }
     ]
     
+    # Sample course modules
+    course_modules = [
+        {
+            "id": str(uuid.uuid4()),
+            "titulo": "Introducción a COFEPRIS",
+            "slug": "intro-cofepris",
+            "objetivos": "Comprender los fundamentos de la regulación sanitaria en México",
+            "contenido_html": "<h2>¿Qué es COFEPRIS?</h2><p>COFEPRIS es la autoridad sanitaria encargada de la regulación, control y fomento sanitario en México.</p>"
+                              "<h2>Marco legal</h2><p>La Ley General de Salud y sus reglamentos definen las obligaciones de cada establecimiento.</p>",
+            "referencias": "Ley General de Salud",
+            "recursos": [],
+            "quiz": {},
+            "orden": 1,
+            "activo": True,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        },
+        {
+            "id": str(uuid.uuid4()),
+            "titulo": "Requisitos por Tipo de Establecimiento",
+            "slug": "requisitos-establecimiento",
+            "objetivos": "Identificar los requisitos específicos según el giro del establecimiento",
+            "contenido_html": "<h2>Consultorios</h2><p>Cada tipo de establecimiento tiene requisitos específicos.</p>"
+                              "<h3>Aviso de funcionamiento</h3><p>Se presenta ante COFEPRIS antes de iniciar operaciones.</p>",
+            "referencias": None,
+            "recursos": [],
+            "quiz": {},
+            "orden": 2,
+            "activo": True,
+            "created_at": datetime.utcnow(),
+            "updated_at": datetime.utcnow()
+        }
+    ]
+    
     # Insert sample data
     await db.documento_plantillas.delete_many({})
     await db.documento_plantillas.insert_many(templates)
@@ -541,6 +1724,12 @@ async def init_sample_data():
     await db.reglas_sugerencia.delete_many({})
     await db.reglas_sugerencia.insert_many(rules)
     
+    await db.curso_modulos.delete_many({})
+    await db.curso_modulos.insert_many(course_modules)
+    
+    invalidate_catalog_cache()
+    invalidate_course_cache()
+    
     return {"message": "Sample data initialized successfully"}
 
 # Include the router in the main app
@@ -561,6 +1750,31 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def bootstrap_indexes():
+    report = await ensure_indexes()
+    logger.info(f"Indexes ensured: {len(report['ensured'])}")
+    if report["missing"]:
+        logger.warning(f"Missing indexes: {', '.join(report['missing'])}")
+    if report["unused"]:
+        logger.info(f"Indexes with no recorded use: {', '.join(report['unused'])}")
+    for error in report["errors"]:
+        logger.error(f"Index bootstrap error: {error}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    payment_events.start()
+    subscription_sweeper.start()
+    compliance_auditor.start()
+    deadline_task.start()
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await payment_events.stop()
+    await subscription_sweeper.stop()
+    await compliance_auditor.stop()
+    await deadline_task.stop()
+    await autosave.drain()
+    await document_jobs.stop()
+    pdf_renderer.shutdown()
     client.close()
\ No newline at end of file
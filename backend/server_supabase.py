@@ -1,13 +1,15 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Request, status
+from fastapi.responses import Response, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
+from starlette.concurrency import run_in_threadpool
 from starlette.middleware.cors import CORSMiddleware
 from supabase import create_client, Client
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field, EmailStr
-from typing import List, Optional, Dict, Any, Union
+from pydantic import BaseModel, Field, EmailStr, ValidationError
+from typing import List, Optional, Dict, Any, Iterable, Tuple, Union
 from datetime import datetime, timedelta
 import uuid
 import hashlib
@@ -15,6 +17,22 @@ import hmac
 import json
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 import jwt
+from trusted_rows import load_rows
+from bulk_import import detect_format, format_validation_error, iter_records
+from payment_events import PaymentEventQueue, idempotency_key, verify_signature
+from principal_cache import PrincipalCache
+from leased_task import LeasedTask
+from pdf_renderer import PdfRenderer, pdf_cache_key
+from document_history import history_entry, is_keyframe, rebuild_version, summarize_entry
+from autosave import AutosaveCoalescer, VersionConflict, merge_fields
+from field_validators import ValidatorCache
+from document_jobs import JobRunner, prefill_campos, render_pdfs
+from compliance import ComplianceStore, DOCUMENTO_LISTO, SELECCION_ACTIVADA, TRAMITE_COMPLETADO, VENCIMIENTO, parse_timestamp, reminders
+from deadline_scheduler import DeadlineScheduler
+from file_uploads import MalformedUpload, UploadTooLarge, blob_path, receive_upload
+from signed_urls import SignedUrlCache
+from search_index import SearchIndex, document_entry, template_entry, tramite_entry
+from course_content import CourseCache
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -40,15 +58,13 @@ class MockSupabaseClient:
     def __init__(self):
         self.auth = MockAuth()
         self.table_cache = {}
-        self.storage_cache = {}
+        # Attribute, not method, to match supabase.Client.storage
+        self.storage = MockStorage()
     
     def table(self, name):
         if name not in self.table_cache:
             self.table_cache[name] = MockTable(name)
         return self.table_cache[name]
-    
-    def storage(self):
-        return MockStorage()
 
 # Global users database for demo mode (persists across requests)
 DEMO_USERS_DB = {}
@@ -109,58 +125,226 @@ class MockBucket:
     def __init__(self, name):
         self.bucket_name = name
     
-    def upload(self, path, file_data):
+    def upload(self, path, file_data, file_options=None):
         return MockResponse({"path": path, "size": len(file_data) if isinstance(file_data, bytes) else 1024})
     
     def create_signed_url(self, path, expires_in=3600):
-        return MockResponse({"signedURL": f"https://mock-storage.supabase.co/{self.bucket_name}/{path}"})
+        # Plain dicts, like storage3
+        url = f"https://mock-storage.supabase.co/{self.bucket_name}/{path}?expires_in={expires_in}"
+        return {"signedURL": url, "signedUrl": url}
+    
+    def create_signed_urls(self, paths, expires_in=3600):
+        return [{"path": path, "error": None, **self.create_signed_url(path, expires_in)} for path in paths]
+
+# Index bucket for values that can't be hashed
+_UNHASHABLE = object()
 
 class MockTable:
+    """In-memory table for demo mode.
+
+    Rows are kept by id. Columns used in equality filters get a hash index
+    (value -> row ids) built on first use and maintained on every write, so
+    ``eq``/``in_`` lookups do not scan the whole table.
+    """
     def __init__(self, name):
         self.name = name
-        self.data = []
+        self.rows = {}
+        self.indexes = {}
+    
+    @property
+    def data(self):
+        return list(self.rows.values())
+    
+    def _index_key(self, value):
+        try:
+            hash(value)
+            return value
+        except TypeError:
+            # Lists/dicts can't be hashed; keep them in a bucket that is always scanned
+            return _UNHASHABLE
+    
+    def _index_for(self, column):
+        if column not in self.indexes:
+            index = {}
+            for row_id, row in self.rows.items():
+                index.setdefault(self._index_key(row.get(column)), {})[row_id] = None
+            self.indexes[column] = index
+        return self.indexes[column]
+    
+    def _index_add(self, row):
+        for column, index in self.indexes.items():
+            index.setdefault(self._index_key(row.get(column)), {})[row["id"]] = None
+    
+    def _index_remove(self, row):
+        for column, index in self.indexes.items():
+            bucket = index.get(self._index_key(row.get(column)))
+            if bucket is not None:
+                bucket.pop(row["id"], None)
+    
+    def candidate_ids(self, column, values):
+        """Row ids that may match ``column IN values``, or None if the index can't help."""
+        keys = [self._index_key(value) for value in values]
+        if _UNHASHABLE in keys:
+            return None
+        index = self._index_for(column)
+        ids = dict(index.get(_UNHASHABLE, {}))
+        for key in keys:
+            ids.update(index.get(key, {}))
+        return ids
+    
+    def store(self, row):
+        existing = self.rows.get(row["id"])
+        if existing is not None:
+            self._index_remove(existing)
+        self.rows[row["id"]] = row
+        self._index_add(row)
+    
+    def remove(self, row):
+        self._index_remove(row)
+        del self.rows[row["id"]]
     
     def insert(self, data):
-        if isinstance(data, dict):
-            data = data.copy()  # Don't modify original
-            data['id'] = str(uuid.uuid4())
-            data['created_at'] = datetime.utcnow().isoformat()
-            data['updated_at'] = datetime.utcnow().isoformat()
-            self.data.append(data)
-            return MockResponse([data])
-        return MockResponse([])
+        # Accept a single row or a list of rows, like the PostgREST builder
+        rows = data if isinstance(data, list) else [data]
+        inserted = []
+        for row in rows:
+            if isinstance(row, dict):
+                row = row.copy()  # Don't modify original
+                row.setdefault('id', str(uuid.uuid4()))
+                row['created_at'] = datetime.utcnow().isoformat()
+                row['updated_at'] = datetime.utcnow().isoformat()
+                self.store(row)
+                inserted.append(dict(row))
+        return MockResponse(inserted)
     
     def select(self, columns="*"):
-        return MockQuery(self.data)
+        return MockQuery(self, columns=columns)
     
     def update(self, data):
-        return MockQuery(self.data, update_data=data)
+        return MockQuery(self, operation="update", payload=data)
     
     def delete(self):
-        return MockQuery([])
+        return MockQuery(self, operation="delete")
 
 class MockQuery:
-    def __init__(self, data, update_data=None):
-        self.data = data if data else []
-        self.update_data = update_data
+    """Chainable query over a MockTable with PostgREST builder semantics.
+
+    Filters accumulate and are ANDed; ``order`` calls add sort keys in call
+    order; ``limit``/``range`` page the result; nothing runs until ``execute``.
+    """
+    def __init__(self, table, operation="select", columns="*", payload=None):
+        self.table = table
+        self.operation = operation
+        self.columns = None if columns.strip() == "*" else [c.strip() for c in columns.split(",") if c.strip()]
+        self.payload = payload
+        self.filters = []
+        self.orders = []
+        self.offset = 0
+        self.limit_count = None
+    
+    def _filter(self, op, column, value):
+        self.filters.append((op, column, value))
+        return self
     
     def eq(self, column, value):
-        if self.update_data:
-            # Update matching records
-            updated = []
-            for item in self.data:
-                if item.get(column) == value:
-                    item.update(self.update_data)
-                    item['updated_at'] = datetime.utcnow().isoformat()
-                    updated.append(item)
-            return MockResponse(updated)
-        else:
-            # Filter data
-            filtered = [item for item in self.data if item.get(column) == value]
-            return MockResponse(filtered)
+        return self._filter("eq", column, value)
+    
+    def neq(self, column, value):
+        return self._filter("neq", column, value)
+    
+    def in_(self, column, values):
+        return self._filter("in", column, list(values))
+    
+    def gt(self, column, value):
+        return self._filter("gt", column, value)
+    
+    def gte(self, column, value):
+        return self._filter("gte", column, value)
+    
+    def lt(self, column, value):
+        return self._filter("lt", column, value)
+    
+    def lte(self, column, value):
+        return self._filter("lte", column, value)
+    
+    def order(self, column, desc=False):
+        self.orders.append((column, desc))
+        return self
+    
+    def limit(self, count):
+        self.limit_count = count
+        return self
+    
+    def range(self, start, end):
+        # Inclusive bounds, as in PostgREST
+        self.offset = start
+        self.limit_count = end - start + 1
+        return self
+    
+    @staticmethod
+    def _matches(row, op, column, value):
+        current = row.get(column)
+        if op == "eq":
+            return current == value
+        if op == "neq":
+            return current != value
+        if op == "in":
+            return current in value
+        if current is None:
+            return False
+        if op == "gt":
+            return current > value
+        if op == "gte":
+            return current >= value
+        if op == "lt":
+            return current < value
+        if op == "lte":
+            return current <= value
+        return False
+    
+    def _matching_rows(self):
+        # Use the most selective indexed equality filter to pick candidates
+        candidates = None
+        for op, column, value in self.filters:
+            if op not in ("eq", "in"):
+                continue
+            ids = self.table.candidate_ids(column, [value] if op == "eq" else value)
+            if ids is not None and (candidates is None or len(ids) < len(candidates)):
+                candidates = ids
+        rows = self.table.rows.values() if candidates is None else (
+            self.table.rows[row_id] for row_id in candidates if row_id in self.table.rows
+        )
+        return [row for row in rows if all(self._matches(row, op, column, value) for op, column, value in self.filters)]
+    
+    def _project(self, row):
+        if self.columns is None:
+            return dict(row)
+        return {column: row.get(column) for column in self.columns}
     
     def execute(self):
-        return MockResponse(self.data)
+        rows = self._matching_rows()
+        
+        if self.operation == "update":
+            updated = []
+            for row in rows:
+                new_row = {**row, **self.payload, "updated_at": datetime.utcnow().isoformat()}
+                new_row["id"] = row["id"]
+                self.table.store(new_row)
+                updated.append(dict(new_row))
+            return MockResponse(updated)
+        
+        if self.operation == "delete":
+            for row in rows:
+                self.table.remove(row)
+            return MockResponse([dict(row) for row in rows])
+        
+        # Stable sorts applied from the last key to the first; nulls sort last ascending
+        for column, desc in reversed(self.orders):
+            rows.sort(key=lambda row: (row.get(column) is None, row.get(column)), reverse=desc)
+        if self.offset or self.limit_count is not None:
+            end = None if self.limit_count is None else self.offset + self.limit_count
+            rows = rows[self.offset:end]
+        return MockResponse([self._project(row) for row in rows])
 
 class MockResponse:
     def __init__(self, data, error=None):
@@ -170,11 +354,24 @@ class MockResponse:
     def execute(self):
         return self
 
+# Optional SQLite file shared by every worker in demo mode. Without it each
+# worker keeps its own in-memory mock store.
+LOCAL_SUPABASE_DB = os.environ.get('LOCAL_SUPABASE_DB')
+
+def create_demo_clients():
+    if LOCAL_SUPABASE_DB:
+        from local_supabase import LocalSupabaseClient
+        local_client = LocalSupabaseClient(LOCAL_SUPABASE_DB)
+        print(f"✅ SQLite Supabase stand-in initialized at {LOCAL_SUPABASE_DB}")
+        return local_client, local_client
+    print("✅ Mock Supabase clients initialized for demo")
+    # Both keys reach the same database; only RLS differs, which the mock skips
+    mock_client = MockSupabaseClient()
+    return mock_client, mock_client
+
 # Initialize clients
 if DEMO_MODE:
-    supabase = MockSupabaseClient()
-    supabase_admin = MockSupabaseClient()
-    print("✅ Mock Supabase clients initialized for demo")
+    supabase, supabase_admin = create_demo_clients()
 else:
     try:
         supabase: Client = create_client(SUPABASE_URL, SUPABASE_ANON_KEY)
@@ -183,8 +380,7 @@ else:
     except Exception as e:
         print(f"❌ Failed to initialize Supabase clients: {e}")
         # Fallback to mock mode
-        supabase = MockSupabaseClient()
-        supabase_admin = MockSupabaseClient()
+        supabase, supabase_admin = create_demo_clients()
         DEMO_MODE = True
         print("✅ Fallback to mock Supabase clients")
 
@@ -229,6 +425,25 @@ class DocumentStatus(str, Enum):
     BORRADOR = "BORRADOR"
     LISTO = "LISTO"
 
+class SelectionStatus(str, Enum):
+    BORRADOR = "BORRADOR"
+    ACTIVO = "ACTIVO"
+
+class ComplianceStatus(str, Enum):
+    VERDE = "VERDE"
+    AMARILLO = "AMARILLO"
+    ROJO = "ROJO"
+
+class DocumentJobStatus(str, Enum):
+    EN_PROCESO = "EN_PROCESO"
+    COMPLETADO = "COMPLETADO"
+    INTERRUMPIDO = "INTERRUMPIDO"
+
+class SearchResultType(str, Enum):
+    PLANTILLA = "PLANTILLA"
+    TRAMITE = "TRAMITE"
+    DOCUMENTO = "DOCUMENTO"
+
 # Pydantic Models
 class UserBase(BaseModel):
     nombre: str = Field(..., min_length=2, max_length=100)
@@ -311,10 +526,154 @@ class SuggestionResponse(BaseModel):
     justificacion: str
     completitud_estimado: int
 
+class SuggestionExpandRequest(BaseModel):
+    plantillas: List[str] = []
+    tramites: List[str] = []
+
+class SuggestionExpandResponse(BaseModel):
+    plantillas: List[Dict[str, Any]]
+    tramites: List[Dict[str, Any]]
+
+class ImportRowError(BaseModel):
+    fila: int
+    error: str
+
+class EstablishmentImportReport(BaseModel):
+    importados: int = 0
+    rechazados: int = 0
+    errores: List[ImportRowError] = []
+    establecimientos: List[str] = []
+    sugerencias: Dict[str, SuggestionResponse] = {}
+
+class DocumentInstance(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    plantilla_id: str
+    estado: DocumentStatus = DocumentStatus.BORRADOR
+    campos: Dict[str, Any] = {}
+    validaciones: Dict[str, Any] = {}
+    historial_versiones: List[Dict[str, Any]] = []
+    version: int = 1
+    pdf_url: Optional[str] = None
+    carpeta: DocumentCategory
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class DocumentInstanceCreate(BaseModel):
+    plantilla_id: str
+    campos: Dict[str, Any] = {}
+
+class DocumentInstanceUpdate(BaseModel):
+    campos: Optional[Dict[str, Any]] = None
+    estado: Optional[DocumentStatus] = None
+
+class DocumentPatch(BaseModel):
+    campos: Dict[str, Any]
+    version: Optional[int] = None
+
+class AutosaveResponse(BaseModel):
+    id: str
+    version: int
+    updated_at: datetime
+    parches: int = 1
+    validaciones: Dict[str, Any] = {}
+
+class DocumentBatchCreate(BaseModel):
+    establecimiento_id: str
+    sugerencias: SuggestionResponse
+    generar_pdf: bool = False
+
+class DocumentBatchJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    establecimiento_id: str
+    estado: DocumentJobStatus = DocumentJobStatus.EN_PROCESO
+    documentos: List[str] = []
+    omitidas: List[str] = []
+    pdf_total: int = 0
+    pdf_generados: int = 0
+    pdf_fallidos: int = 0
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+class SearchResult(BaseModel):
+    tipo: SearchResultType
+    id: str
+    titulo: str
+    fragmento: str = ""
+    puntuacion: float
+
+class SearchResponse(BaseModel):
+    total: int
+    pagina: int
+    por_pagina: int
+    resultados: List[SearchResult]
+
+class DocumentHistoryEntry(BaseModel):
+    version: int
+    tipo: str
+    autor_id: Optional[str] = None
+    campos_cambiados: List[str] = []
+    created_at: Optional[datetime] = None
+
+class DocumentVersion(BaseModel):
+    documento_id: str
+    version: int
+    campos: Dict[str, Any]
+
 class AIConsultationRequest(BaseModel):
     perfil: Dict[str, Any]
     pregunta: str
 
+class Selection(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    items: Dict[str, List[str]]
+    estado: SelectionStatus = SelectionStatus.BORRADOR
+    completitud_estimado: int = Field(ge=0, le=100, default=0)
+
+class SelectionCreate(BaseModel):
+    items: Dict[str, List[str]]
+    estado: SelectionStatus = SelectionStatus.BORRADOR
+
+class Expediente(BaseModel):
+    usuario_id: str
+    items: Dict[str, List[str]] = {}
+    documentos_listos: Dict[str, int] = {}
+    tramites_completados: Dict[str, Dict[str, Any]] = {}
+    estatus_cumplimiento: ComplianceStatus = ComplianceStatus.ROJO
+    avance: int = Field(ge=0, le=100, default=0)
+    vencimientos: List[Dict[str, Any]] = []
+    proximo_evento: Optional[str] = None
+    rev: int = 0
+
+class TramiteCompletion(BaseModel):
+    fecha_vencimiento: Optional[datetime] = None
+
+class Recordatorio(BaseModel):
+    id: str
+    usuario_id: str
+    tramite_id: str
+    tipo: str
+    fecha: str
+    estatus_cumplimiento: Optional[ComplianceStatus] = None
+    created_at: datetime
+
+class UserFile(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    usuario_id: str
+    nombre: str
+    carpeta: Optional[str] = None
+    content_type: str
+    tamano: int
+    sha256: str
+    storage_path: str
+    # The user already had a file with this content; whether anyone else
+    # stores it is never exposed
+    deduplicado: bool = False
+    url: Optional[str] = None
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+
 class AIConsultation(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     usuario_id: str
@@ -356,6 +715,15 @@ def verify_jwt_token(token: str) -> dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
+# Resolved users are cached briefly per process; call invalidate_principals
+# whenever subscription state or role changes.
+PRINCIPAL_CACHE_TTL = int(os.environ.get('PRINCIPAL_CACHE_TTL', '30'))
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL, PRINCIPAL_CACHE_SIZE)
+
+def invalidate_principals(user_ids):
+    principal_cache.invalidate(user_ids)
+
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Get current user from JWT token"""
     token = credentials.credentials
@@ -383,6 +751,10 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             return User(**user_data)
         
         else:
+            cached = principal_cache.get(user_id)
+            if cached is not None:
+                return cached
+            
             # Get user from real Supabase
             response = supabase.table("users").select("*").eq("id", user_id).execute()
             
@@ -390,7 +762,9 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
                 raise HTTPException(status_code=401, detail="User not found")
             
             user_data = response.data[0]
-            return User(**user_data)
+            principal = User(**user_data)
+            principal_cache.put(user_id, principal)
+            return principal
     
     except HTTPException:
         raise
@@ -504,9 +878,37 @@ SAMPLE_TRAMITES = [
     }
 ]
 
+# Sample catalog validated once at startup instead of on every request
+SAMPLE_TEMPLATE_MODELS = load_rows(DocumentTemplate, SAMPLE_TEMPLATES)
+SAMPLE_TRAMITE_MODELS = load_rows(Tramite, SAMPLE_TRAMITES)
+
+# Catalog lookups by id, used to expand compact suggestion responses
+SAMPLE_TEMPLATES_BY_ID = {t["id"]: t for t in SAMPLE_TEMPLATES}
+SAMPLE_TRAMITES_BY_ID = {t["id"]: t for t in SAMPLE_TRAMITES}
+
+def summarize_template(template: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact view of a template for the suggestions wizard."""
+    return {
+        "id": template["id"],
+        "nombre": template.get("nombre"),
+        "categoria": template.get("categoria"),
+    }
+
+def summarize_tramite(tramite: Dict[str, Any]) -> Dict[str, Any]:
+    """Compact view of a tramite for the suggestions wizard."""
+    return {
+        "id": tramite["id"],
+        "nombre": tramite.get("nombre"),
+        "autoridad": tramite.get("autoridad"),
+    }
+
 # Suggestion engine
-async def generate_suggestions(perfil: Dict[str, Any]) -> SuggestionResponse:
-    """Generate document and procedure suggestions based on establishment profile."""
+async def generate_suggestions(perfil: Dict[str, Any], compact: bool = False) -> SuggestionResponse:
+    """Generate document and procedure suggestions based on establishment profile.
+
+    With ``compact=True`` only ids and a short summary are returned for each
+    item; full entries can be fetched afterwards through ``/suggestions/expand``.
+    """
     
     suggested_templates = []
     suggested_tramites = []
@@ -527,6 +929,10 @@ async def generate_suggestions(perfil: Dict[str, Any]) -> SuggestionResponse:
     
     # Calculate completeness estimate
     completeness = min(100, (len(suggested_templates) + len(suggested_tramites)) * 15)
+
+    if compact:
+        suggested_templates = [summarize_template(t) for t in suggested_templates]
+        suggested_tramites = [summarize_tramite(t) for t in suggested_tramites]
     
     return SuggestionResponse(
         plantillas=suggested_templates,
@@ -663,24 +1069,96 @@ async def create_establishment(establishment_data: EstablishmentCreate, current_
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to create establishment: {str(e)}")
 
+# Bulk import settings
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', '500'))
+IMPORT_MAX_REPORTED_ERRORS = int(os.environ.get('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+ESTABLISHMENT_LIST_FIELDS = ("servicios", "equipo_especial")
+
+@api_router.post("/establishments/import", response_model=EstablishmentImportReport)
+async def import_establishments(request: Request, formato: Optional[str] = None, sugerencias: bool = False, current_user: User = Depends(get_current_user)):
+    """Create many establishments from a CSV or NDJSON body.
+
+    Rows are parsed as the body streams in, validated against EstablishmentCreate
+    and written IMPORT_BATCH_SIZE at a time. CSV list cells use ';' as separator.
+    With ``sugerencias=true`` a compact suggestion response is returned per branch.
+    """
+    fmt = detect_format(request.headers.get("content-type"), formato)
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Formato no soportado: use CSV (text/csv) o NDJSON (application/x-ndjson)")
+
+    report = EstablishmentImportReport()
+    suggestion_memo: Dict[str, SuggestionResponse] = {}
+    batch: List[tuple] = []
+
+    def reject(row_number: int, error: str):
+        report.rechazados += 1
+        if len(report.errores) < IMPORT_MAX_REPORTED_ERRORS:
+            report.errores.append(ImportRowError(fila=row_number, error=error))
+
+    async def flush_batch():
+        try:
+            supabase.table("establishments").insert([est.model_dump(mode="json") for _, est in batch]).execute()
+            failed = {}
+        except Exception as e:
+            failed = {index: f"Error de escritura: {str(e)}" for index in range(len(batch))}
+        for index, (row_number, establishment) in enumerate(batch):
+            if index in failed:
+                reject(row_number, failed[index])
+                continue
+            report.importados += 1
+            report.establecimientos.append(establishment.id)
+            if sugerencias:
+                # Branches of the same franchise usually share a profile
+                perfil = establishment.dict(exclude={"id", "usuario_id", "created_at", "updated_at"})
+                key = json.dumps(perfil, sort_keys=True, default=str)
+                if key not in suggestion_memo:
+                    suggestion_memo[key] = await generate_suggestions(perfil, compact=True)
+                report.sugerencias[establishment.id] = suggestion_memo[key]
+        batch.clear()
+
+    async for row_number, record, error in iter_records(request.stream(), fmt, ESTABLISHMENT_LIST_FIELDS):
+        if error:
+            reject(row_number, error)
+            continue
+        try:
+            establishment_data = EstablishmentCreate(**record)
+        except ValidationError as e:
+            reject(row_number, format_validation_error(e))
+            continue
+        batch.append((row_number, Establishment(**establishment_data.dict(), usuario_id=current_user.id)))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            await flush_batch()
+
+    if batch:
+        await flush_batch()
+    return report
+
 @api_router.get("/establishments", response_model=List[Establishment])
 async def get_user_establishments(current_user: User = Depends(get_current_user)):
     try:
         response = supabase.table("establishments").select("*").eq("usuario_id", current_user.id).execute()
-        return [Establishment(**est) for est in response.data]
+        return load_rows(Establishment, response.data)
     except Exception as e:
         # Return empty list for demo
         return []
 
 @api_router.post("/suggestions", response_model=SuggestionResponse)
-async def get_regulatory_suggestions(request: SuggestionRequest):
+async def get_regulatory_suggestions(request: SuggestionRequest, compact: bool = False):
     try:
         perfil = request.dict()
-        suggestions = await generate_suggestions(perfil)
+        suggestions = await generate_suggestions(perfil, compact=compact)
         return suggestions
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to generate suggestions: {str(e)}")
 
+@api_router.post("/suggestions/expand", response_model=SuggestionExpandResponse)
+async def expand_suggestions(request: SuggestionExpandRequest):
+    """Return full catalog entries for ids obtained from a compact suggestion response."""
+    return SuggestionExpandResponse(
+        plantillas=[SAMPLE_TEMPLATES_BY_ID[i] for i in request.plantillas if i in SAMPLE_TEMPLATES_BY_ID],
+        tramites=[SAMPLE_TRAMITES_BY_ID[i] for i in request.tramites if i in SAMPLE_TRAMITES_BY_ID]
+    )
+
 @api_router.post("/ai/consultation", response_model=AIConsultation)
 async def ai_consultation(request: AIConsultationRequest, current_user: User = Depends(get_current_user)):
     try:
@@ -702,11 +1180,59 @@ async def ai_consultation(request: AIConsultationRequest, current_user: User = D
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"AI consultation failed: {str(e)}")
 
+# Data export settings
+EXPORT_PAGE_SIZE = int(os.environ.get('EXPORT_PAGE_SIZE', '500'))
+
+# (record type, table) pairs included in a user export
+EXPORT_TABLES = [
+    ("establecimiento", "establishments"),
+    ("consulta", "consultations"),
+    ("documento", "document_instances"),
+]
+
+def export_line(tipo: str, doc: Dict[str, Any]) -> str:
+    """Encode one exported record as an NDJSON line."""
+    return json.dumps({"tipo": tipo, "data": doc}, ensure_ascii=False, default=lambda v: v.isoformat() if isinstance(v, datetime) else str(v)) + "\n"
+
+def fetch_export_page(table_name: str, usuario_id: str, after_id: Optional[str]) -> List[Dict[str, Any]]:
+    query = supabase.table(table_name).select("*").eq("usuario_id", usuario_id)
+    if after_id is not None:
+        query = query.gt("id", after_id)
+    return query.order("id").limit(EXPORT_PAGE_SIZE).execute().data
+
+async def stream_user_export(usuario_id: str):
+    """Yield a user's records as NDJSON, one PostgREST page at a time.
+
+    Pages are read by keyset on id, so each one is an index range scan and
+    rows written during the export are neither skipped nor repeated. The
+    next page is only requested once the client has consumed the previous
+    one, so memory stays bounded by EXPORT_PAGE_SIZE rows.
+    """
+    for tipo, table_name in EXPORT_TABLES:
+        after_id = None
+        while True:
+            rows = await run_in_threadpool(fetch_export_page, table_name, usuario_id, after_id)
+            if rows:
+                yield "".join(export_line(tipo, row) for row in rows)
+            if len(rows) < EXPORT_PAGE_SIZE:
+                break
+            after_id = rows[-1]["id"]
+
+@api_router.get("/export")
+async def export_user_data(current_user: User = Depends(get_current_user)):
+    """Stream all establishments, consultations and documents of the user as NDJSON."""
+    filename = f"cofepris_export_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.ndjson"
+    return StreamingResponse(
+        stream_user_export(current_user.id),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
 @api_router.get("/templates", response_model=List[DocumentTemplate])
 async def get_document_templates():
     try:
         # Return sample templates for demo
-        return [DocumentTemplate(**template) for template in SAMPLE_TEMPLATES]
+        return SAMPLE_TEMPLATE_MODELS
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get templates: {str(e)}")
 
@@ -714,28 +1240,914 @@ async def get_document_templates():
 async def get_tramites():
     try:
         # Return sample tramites for demo
-        return [Tramite(**tramite) for tramite in SAMPLE_TRAMITES]
+        return SAMPLE_TRAMITE_MODELS
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to get tramites: {str(e)}")
 
-@api_router.post("/webhooks/pago")
-async def webhook_payment(payload: Dict[str, Any]):
+# Document instances and their PDFs. Rendering runs in a separate process pool;
+# output is cached on disk by a hash of template version plus campos and
+# uploaded once per version to the documents bucket.
+PDF_CACHE_DIR = Path(os.environ.get('PDF_CACHE_DIR', str(ROOT_DIR / 'pdf_cache')))
+PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', '2'))
+DOCUMENTS_BUCKET = os.environ.get('DOCUMENTS_BUCKET', 'documents')
+pdf_renderer = PdfRenderer(PDF_CACHE_DIR, PDF_RENDER_WORKERS)
+
+# Version history lives in document_versions as JSON-patch deltas with a
+# full keyframe every HISTORY_KEYFRAME_INTERVAL versions
+HISTORY_KEYFRAME_INTERVAL = int(os.environ.get('HISTORY_KEYFRAME_INTERVAL', '10'))
+HISTORY_PAGE_SIZE = int(os.environ.get('HISTORY_PAGE_SIZE', '50'))
+
+def record_version(document_id: str, version: int, previous: Dict[str, Any], campos: Dict[str, Any], user_id: str):
+    if not is_keyframe(version, HISTORY_KEYFRAME_INTERVAL) and not supabase.table("document_versions").select("id") \
+            .eq("documento_id", document_id).eq("version", version - 1).execute().data:
+        # The delta needs the previous entry. Documents created before history
+        # was recorded have no version 1, and an insert that failed after the
+        # version bump leaves a gap; ``previous`` is that version's campos, so
+        # it is restored as a keyframe.
+        if version > 2:
+            logger.warning(f"History of document {document_id} has no version {version - 1}; restoring it")
+        gap = history_entry(document_id, version - 1, {}, previous, HISTORY_KEYFRAME_INTERVAL, None, force_keyframe=True)
+        supabase.table("document_versions").insert(gap).execute()
+    entry = history_entry(document_id, version, previous, campos, HISTORY_KEYFRAME_INTERVAL, user_id)
+    supabase.table("document_versions").insert(entry).execute()
+
+# Validators compiled from each template's campos_definicion, rebuilt when
+# the template version changes
+VALIDATOR_CACHE_SIZE = int(os.environ.get('VALIDATOR_CACHE_SIZE', '256'))
+field_validators = ValidatorCache(VALIDATOR_CACHE_SIZE)
+
+def validate_campos(plantilla_id: str, campos: Dict[str, Any], fields: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+    """Per-field validation results; empty if the template is no longer available."""
+    template = SAMPLE_TEMPLATES_BY_ID.get(plantilla_id)
+    if not template:
+        return {}
+    return field_validators.get(template).validate(campos, fields)
+
+def get_active_template(plantilla_id: str) -> Dict[str, Any]:
+    template = SAMPLE_TEMPLATES_BY_ID.get(plantilla_id)
+    if not template:
+        raise HTTPException(status_code=404, detail="Plantilla no encontrada")
+    return template
+
+def get_user_document(document_id: str, user_id: str) -> Dict[str, Any]:
+    response = supabase.table("document_instances").select("*").eq("id", document_id).eq("usuario_id", user_id).execute()
+    if not response.data:
+        raise HTTPException(status_code=404, detail="Documento no encontrado")
+    return response.data[0]
+
+# Full-text search: templates and trámites share one in-process index and
+# each user's documents get their own, updated as documents are saved and
+# rebuilt from the database once SEARCH_INDEX_TTL seconds old.
+SEARCH_INDEX_TTL = int(os.environ.get('SEARCH_INDEX_TTL', '300'))
+SEARCH_INDEX_USERS = int(os.environ.get('SEARCH_INDEX_USERS', '1000'))
+SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', '20'))
+search_index = SearchIndex(SEARCH_INDEX_USERS + 1, SEARCH_INDEX_TTL)
+
+def template_name(plantilla_id: str) -> str:
+    return SAMPLE_TEMPLATES_BY_ID.get(plantilla_id, {}).get("nombre", "")
+
+def index_document(usuario_id: str, document_id: str, plantilla_id: str, campos: Dict[str, Any]):
+    search_index.add(usuario_id, *document_entry(document_id, template_name(plantilla_id), campos))
+
+async def load_search_partitions(usuario_id: str):
+    if not search_index.loaded(None):
+        search_index.load(None, [template_entry(t) for t in SAMPLE_TEMPLATES] + [tramite_entry(t) for t in SAMPLE_TRAMITES])
+    if not search_index.loaded(usuario_id):
+        documents = await run_in_threadpool(
+            lambda: supabase.table("document_instances").select("id,plantilla_id,campos").eq("usuario_id", usuario_id).execute().data
+        )
+        search_index.load(usuario_id, [
+            document_entry(d["id"], template_name(d["plantilla_id"]), d.get("campos") or {}) for d in documents
+        ])
+
+@api_router.get("/search", response_model=SearchResponse)
+async def search(q: str, tipo: Optional[SearchResultType] = None, pagina: int = 1, por_pagina: int = SEARCH_PAGE_SIZE,
+                 current_user: User = Depends(get_current_user)):
+    """Ranked search over templates, trámites and the user's documents.
+
+    Accents and case are ignored and words match their plural and derived
+    forms; results contain every word of ``q``.
+    """
     try:
-        # Mock payment webhook
-        user_id = payload.get("user_id")
-        if user_id:
-            # Update user subscription status
-            update_data = {
-                "estado_suscripcion": "ACTIVA",
-                "fecha_renovacion": (datetime.utcnow() + timedelta(days=30)).isoformat(),
-                "updated_at": datetime.utcnow().isoformat()
+        pagina = max(1, pagina)
+        por_pagina = max(1, min(por_pagina, SEARCH_PAGE_SIZE))
+        await load_search_partitions(current_user.id)
+        total, resultados = search_index.search(
+            q, [None, current_user.id], (pagina - 1) * por_pagina, por_pagina, tipo.value if tipo else None
+        )
+        return SearchResponse(total=total, pagina=pagina, por_pagina=por_pagina, resultados=resultados)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to search: {str(e)}")
+
+@api_router.post("/documents", response_model=DocumentInstance)
+async def create_document(request: DocumentInstanceCreate, current_user: User = Depends(get_current_user)):
+    try:
+        template = get_active_template(request.plantilla_id)
+        document = DocumentInstance(
+            usuario_id=current_user.id,
+            plantilla_id=request.plantilla_id,
+            campos=request.campos,
+            validaciones=field_validators.get(template).validate(request.campos),
+            carpeta=template["categoria"]
+        )
+        supabase.table("document_instances").insert(document.model_dump(mode="json")).execute()
+        record_version(document.id, 1, {}, document.campos, current_user.id)
+        index_document(current_user.id, document.id, document.plantilla_id, document.campos)
+        return document
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create document: {str(e)}")
+
+@api_router.get("/documents/{document_id}", response_model=DocumentInstance)
+async def get_document(document_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        return get_user_document(document_id, current_user.id)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get document: {str(e)}")
+
+@api_router.put("/documents/{document_id}", response_model=DocumentInstance)
+async def update_document(document_id: str, request: DocumentInstanceUpdate, current_user: User = Depends(get_current_user)):
+    try:
+        document = get_user_document(document_id, current_user.id)
+        changes = request.model_dump(mode="json", exclude_none=True)
+        if "campos" not in changes or changes["campos"] == document.get("campos"):
+            query = supabase.table("document_instances").update(changes).eq("id", document_id)
+            if "estado" in changes:
+                # Conditional on the estado we read, so a LISTO transition is counted once
+                query = query.eq("estado", document["estado"])
+            response = query.execute()
+            if not response.data:
+                raise HTTPException(status_code=409, detail="El documento fue modificado por otra sesión; recárgalo")
+            await record_document_status(current_user.id, document, changes.get("estado"))
+            return response.data[0]
+        
+        changes["validaciones"] = validate_campos(document["plantilla_id"], changes["campos"])
+        
+        # Only succeeds if nobody saved since we read the row
+        version = document.get("version") or 1
+        response = supabase.table("document_instances").update({**changes, "version": version + 1}) \
+            .eq("id", document_id).eq("version", version).execute()
+        if not response.data:
+            raise HTTPException(status_code=409, detail="El documento fue modificado por otra sesión; recárgalo")
+        record_version(document_id, version + 1, document.get("campos") or {}, changes["campos"], current_user.id)
+        index_document(current_user.id, document_id, document["plantilla_id"], changes["campos"])
+        await record_document_status(current_user.id, document, changes.get("estado"))
+        return response.data[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to update document: {str(e)}")
+
+# Autosave patches for the same document arriving within AUTOSAVE_WINDOW
+# seconds are merged and written once
+AUTOSAVE_WINDOW = float(os.environ.get('AUTOSAVE_WINDOW', '0.5'))
+AUTOSAVE_CONFLICT_DETAIL = "El documento fue modificado por otra sesión; recárgalo"
+
+def _flush_autosave(document_id: str, pending) -> Tuple[Dict[str, Any], str, Dict[str, Any]]:
+    rows = supabase.table("document_instances").select("campos,validaciones,version,plantilla_id") \
+        .eq("id", document_id).eq("usuario_id", pending.usuario_id).execute().data
+    if not rows or (rows[0].get("version") or 1) != pending.base_version:
+        raise VersionConflict()
+    previous = rows[0].get("campos") or {}
+    campos = merge_fields(previous, pending.changes)
+    validaciones = validate_campos(rows[0]["plantilla_id"], campos, pending.changes)
+    
+    # Conditional on the base version, so a concurrent save makes this a no-op
+    version = pending.base_version + 1
+    response = supabase.table("document_instances") \
+        .update({"campos": campos, "validaciones": {**(rows[0].get("validaciones") or {}), **validaciones}, "version": version}) \
+        .eq("id", document_id).eq("version", pending.base_version).execute()
+    if not response.data:
+        raise VersionConflict()
+    record_version(document_id, version, previous, campos, pending.usuario_id)
+    return {
+        "id": document_id,
+        "version": version,
+        "updated_at": response.data[0].get("updated_at") or datetime.utcnow(),
+        "parches": pending.requests,
+        "validaciones": validaciones
+    }, rows[0]["plantilla_id"], campos
+
+async def flush_autosave(document_id: str, pending) -> Dict[str, Any]:
+    result, plantilla_id, campos = await run_in_threadpool(_flush_autosave, document_id, pending)
+    # On the event loop, where searches read the index
+    index_document(pending.usuario_id, document_id, plantilla_id, campos)
+    return result
+
+autosave = AutosaveCoalescer(flush_autosave, AUTOSAVE_WINDOW)
+
+@api_router.patch("/documents/{document_id}", response_model=AutosaveResponse)
+async def autosave_document(document_id: str, request: DocumentPatch, current_user: User = Depends(get_current_user)):
+    """Field-level autosave: ``null`` removes a field. Send the last version received
+    to be told (409) when another session saved in between."""
+    invalid = [field for field in request.campos if not field or "." in field or field.startswith("$")]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Nombre de campo inválido: {', '.join(invalid)}")
+    
+    # Batches already buffered or being written for this user's document skip
+    # the ownership read; the coalescer checks the version against them
+    pending = autosave.pending_for(document_id)
+    if pending is not None and pending.usuario_id == current_user.id:
+        base_version, plantilla_id = pending.base_version, pending.plantilla_id
+        if request.version is not None:
+            base_version = request.version
+    else:
+        document = get_user_document(document_id, current_user.id)
+        base_version, plantilla_id = document.get("version") or 1, document["plantilla_id"]
+        if request.version is not None and request.version != base_version:
+            raise HTTPException(status_code=409, detail=AUTOSAVE_CONFLICT_DETAIL)
+    
+    try:
+        return await autosave.submit(document_id, current_user.id, base_version, request.campos, plantilla_id)
+    except VersionConflict:
+        raise HTTPException(status_code=409, detail=AUTOSAVE_CONFLICT_DETAIL)
+
+@api_router.get("/documents/{document_id}/history", response_model=List[DocumentHistoryEntry])
+async def get_document_history(document_id: str, antes: Optional[int] = None, limite: int = HISTORY_PAGE_SIZE,
+                               current_user: User = Depends(get_current_user)):
+    """Version list, newest first; page with ``antes`` set to the last version seen."""
+    try:
+        get_user_document(document_id, current_user.id)
+        query = supabase.table("document_versions").select("*").eq("documento_id", document_id)
+        if antes is not None:
+            query = query.lt("version", antes)
+        entries = query.order("version", desc=True).limit(max(1, min(limite, HISTORY_PAGE_SIZE))).execute().data
+        return [summarize_entry(entry) for entry in entries]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get document history: {str(e)}")
+
+@api_router.get("/documents/{document_id}/versions/{version}", response_model=DocumentVersion)
+async def get_document_version(document_id: str, version: int, current_user: User = Depends(get_current_user)):
+    try:
+        get_user_document(document_id, current_user.id)
+        keyframes = supabase.table("document_versions").select("*").eq("documento_id", document_id) \
+            .eq("tipo", "keyframe").lte("version", version).order("version", desc=True).limit(1).execute().data
+        if not keyframes:
+            raise HTTPException(status_code=404, detail="Versión no disponible")
+        keyframe = keyframes[0]
+        deltas = supabase.table("document_versions").select("*").eq("documento_id", document_id) \
+            .gt("version", keyframe["version"]).lte("version", version).order("version").execute().data
+        if keyframe["version"] + len(deltas) != version:
+            raise HTTPException(status_code=404, detail="Versión no disponible")
+        return DocumentVersion(documento_id=document_id, version=version, campos=rebuild_version([keyframe] + deltas))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get document version: {str(e)}")
+
+@api_router.get("/documents/{document_id}/pdf")
+async def download_document_pdf(document_id: str, request: Request, current_user: User = Depends(get_current_user)):
+    try:
+        document = get_user_document(document_id, current_user.id)
+        template = get_active_template(document["plantilla_id"])
+        campos = document.get("campos") or {}
+        
+        # The cache key doubles as ETag, so unchanged documents are not even read
+        etag = f'"{pdf_cache_key(template, campos)}"'
+        if request.headers.get("if-none-match") == etag:
+            return Response(status_code=304, headers={"ETag": etag})
+        
+        key, pdf, cached = await pdf_renderer.render(template, campos)
+        
+        # Content-addressed path: each version is uploaded once
+        pdf_path = f"user_{current_user.id}/pdf/{key}.pdf"
+        if document.get("pdf_url") != pdf_path:
+            await run_in_threadpool(
+                lambda: supabase.storage.from_(DOCUMENTS_BUCKET).upload(
+                    pdf_path, pdf, {"content-type": "application/pdf", "upsert": "true"}
+                )
+            )
+            supabase.table("document_instances").update({"pdf_url": pdf_path}).eq("id", document_id).execute()
+        
+        return Response(
+            content=pdf,
+            media_type="application/pdf",
+            headers={
+                "ETag": etag,
+                "X-PDF-Cache": "HIT" if cached else "MISS",
+                "Content-Disposition": f'attachment; filename="documento_{document_id}.pdf"'
             }
-            
-            supabase.table("users").update(update_data).eq("id", user_id).execute()
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to render PDF: {str(e)}")
+
+# Bulk generation: every suggested template becomes a prefilled document in
+# one insert; PDFs, if requested, render in the background while the
+# document_jobs row tracks progress.
+DOCUMENT_JOB_PDF_CONCURRENCY = int(os.environ.get('DOCUMENT_JOB_PDF_CONCURRENCY', str(PDF_RENDER_WORKERS)))
+document_jobs = JobRunner()
+
+async def run_document_job(job_id: str, documents: List[Dict[str, Any]]):
+    async def render_one(document: Dict[str, Any]):
+        template = get_active_template(document["plantilla_id"])
+        key, pdf, _ = await pdf_renderer.render(template, document["campos"])
+        pdf_path = f"user_{document['usuario_id']}/pdf/{key}.pdf"
+        await run_in_threadpool(
+            lambda: supabase.storage.from_(DOCUMENTS_BUCKET).upload(
+                pdf_path, pdf, {"content-type": "application/pdf", "upsert": "true"}
+            )
+        )
+        await run_in_threadpool(
+            lambda: supabase.table("document_instances").update({"pdf_url": pdf_path}).eq("id", document["id"]).execute()
+        )
+    
+    async def progress(generados: int, fallidos: int):
+        await run_in_threadpool(
+            lambda: supabase.table("document_jobs").update({"pdf_generados": generados, "pdf_fallidos": fallidos})
+            .eq("id", job_id).execute()
+        )
+    
+    estado = DocumentJobStatus.INTERRUMPIDO
+    try:
+        await render_pdfs(documents, render_one, progress, DOCUMENT_JOB_PDF_CONCURRENCY)
+        estado = DocumentJobStatus.COMPLETADO
+    finally:
+        await run_in_threadpool(
+            lambda: supabase.table("document_jobs").update({"estado": estado.value}).eq("id", job_id).execute()
+        )
+
+@api_router.post("/documents/batch", response_model=DocumentBatchJob)
+async def create_document_batch(request: DocumentBatchCreate, current_user: User = Depends(get_current_user)):
+    """Create one prefilled document per suggested template.
+
+    Templates no longer in the catalog are listed in ``omitidas``. With
+    ``generar_pdf`` the PDFs are rendered afterwards; poll
+    ``GET /documents/batch/{job_id}`` for progress.
+    """
+    try:
+        rows = supabase.table("establishments").select("*") \
+            .eq("id", request.establecimiento_id).eq("usuario_id", current_user.id).execute().data
+        if not rows:
+            raise HTTPException(status_code=404, detail="Establecimiento no encontrado")
+        perfil = {**rows[0], "responsable": current_user.nombre,
+                  "razon_social": current_user.razon_social, "rfc": current_user.rfc}
+        
+        documents: List[DocumentInstance] = []
+        omitted: List[str] = []
+        seen = set()
+        for suggestion in request.sugerencias.plantillas:
+            plantilla_id = str(suggestion.get("id"))
+            if plantilla_id in seen:
+                continue
+            seen.add(plantilla_id)
+            template = SAMPLE_TEMPLATES_BY_ID.get(plantilla_id)
+            if not template:
+                omitted.append(plantilla_id)
+                continue
+            validator = field_validators.get(template)
+            campos = prefill_campos(template, validator, perfil)
+            documents.append(DocumentInstance(
+                usuario_id=current_user.id,
+                plantilla_id=plantilla_id,
+                campos=campos,
+                validaciones=validator.validate(campos),
+                carpeta=template["categoria"]
+            ))
+        
+        if documents:
+            supabase.table("document_instances").insert([document.model_dump(mode="json") for document in documents]).execute()
+            supabase.table("document_versions").insert([
+                history_entry(document.id, 1, {}, document.campos, HISTORY_KEYFRAME_INTERVAL, current_user.id)
+                for document in documents
+            ]).execute()
+            for document in documents:
+                index_document(current_user.id, document.id, document.plantilla_id, document.campos)
         
+        render = request.generar_pdf and bool(documents)
+        job = DocumentBatchJob(
+            usuario_id=current_user.id,
+            establecimiento_id=request.establecimiento_id,
+            estado=DocumentJobStatus.EN_PROCESO if render else DocumentJobStatus.COMPLETADO,
+            documentos=[document.id for document in documents],
+            omitidas=omitted,
+            pdf_total=len(documents) if render else 0
+        )
+        supabase.table("document_jobs").insert(job.model_dump(mode="json")).execute()
+        if render:
+            document_jobs.start(
+                run_document_job(job.id, [document.model_dump(mode="json") for document in documents]),
+                name=f"document-job-{job.id}"
+            )
+        return job
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create documents: {str(e)}")
+
+@api_router.get("/documents/batch/{job_id}", response_model=DocumentBatchJob)
+async def get_document_batch(job_id: str, current_user: User = Depends(get_current_user)):
+    try:
+        rows = supabase.table("document_jobs").select("*").eq("id", job_id).eq("usuario_id", current_user.id).execute().data
+        if not rows:
+            raise HTTPException(status_code=404, detail="Trabajo no encontrado")
+        return rows[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get job: {str(e)}")
+
+# File manager uploads: the body is streamed to a temporary file while it is
+# hashed, then stored once per content hash in FILES_BUCKET; file_blobs
+# records which hashes are stored and user_files each user's copy of them.
+FILES_BUCKET = os.environ.get('FILES_BUCKET', 'files')
+UPLOAD_MAX_SIZE = int(os.environ.get('UPLOAD_MAX_SIZE', str(50 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = Path(os.environ.get('UPLOAD_SPOOL_DIR', str(ROOT_DIR / 'upload_spool')))
+FILES_PAGE_SIZE = int(os.environ.get('FILES_PAGE_SIZE', '100'))
+
+# Signed download URLs are cached per (bucket, path) and reused while they
+# stay valid for at least SIGNED_URL_MIN_REMAINING more seconds
+SIGNED_URL_EXPIRES_IN = int(os.environ.get('SIGNED_URL_EXPIRES_IN', '3600'))
+SIGNED_URL_MIN_REMAINING = int(os.environ.get('SIGNED_URL_MIN_REMAINING', '900'))
+SIGNED_URL_CACHE_SIZE = int(os.environ.get('SIGNED_URL_CACHE_SIZE', '10000'))
+
+def _sign_paths(bucket: str, paths: List[str], expires_in: int) -> Dict[str, str]:
+    storage_bucket = supabase.storage.from_(bucket)
+    if hasattr(storage_bucket, "create_signed_urls"):
+        # One round trip for the whole listing
+        signed = storage_bucket.create_signed_urls(paths, expires_in)
+        return {item["path"]: item["signedURL"] for item in signed if not item.get("error")}
+    return {path: storage_bucket.create_signed_url(path, expires_in)["signedURL"] for path in paths}
+
+async def sign_paths(bucket: str, paths: List[str], expires_in: int) -> Dict[str, str]:
+    return await run_in_threadpool(_sign_paths, bucket, paths, expires_in)
+
+signed_urls = SignedUrlCache(sign_paths, SIGNED_URL_EXPIRES_IN, SIGNED_URL_MIN_REMAINING, SIGNED_URL_CACHE_SIZE)
+
+def store_blob(sha256: str, source: Path, content_type: str, size: int):
+    """Upload the content unless it is already stored.
+
+    Blobs are shared by every user who uploads the same content, so they are
+    read and written with the service-role client.
+    """
+    blobs = supabase_admin.table("file_blobs")
+    if blobs.select("id").eq("id", sha256).execute().data:
+        return
+    path = blob_path(sha256)
+    supabase_admin.storage.from_(FILES_BUCKET).upload(path, str(source), {"content-type": content_type, "upsert": "true"})
+    try:
+        blobs.insert({"id": sha256, "storage_path": path, "content_type": content_type, "tamano": size}).execute()
+    except Exception:
+        # The same content finished uploading concurrently and registered first
+        if not blobs.select("id").eq("id", sha256).execute().data:
+            raise
+
+@api_router.post("/files", response_model=UserFile)
+async def upload_file(request: Request, current_user: User = Depends(get_current_user)):
+    """Multipart upload with a ``file`` part and an optional ``carpeta`` field.
+
+    The body is read as a stream, so memory use does not grow with the file.
+    """
+    try:
+        upload = await receive_upload(
+            request.headers.get("content-type", ""), request.stream(), UPLOAD_SPOOL_DIR, UPLOAD_MAX_SIZE
+        )
+    except UploadTooLarge:
+        raise HTTPException(
+            status_code=413, detail=f"El archivo excede el tamaño máximo de {UPLOAD_MAX_SIZE // (1024 * 1024)} MB"
+        )
+    except MalformedUpload as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    try:
+        await run_in_threadpool(store_blob, upload.sha256, upload.path, upload.content_type, upload.size)
+        deduplicado = bool(await run_in_threadpool(
+            lambda: supabase.table("user_files").select("id")
+            .eq("usuario_id", current_user.id).eq("sha256", upload.sha256).limit(1).execute().data
+        ))
+        user_file = UserFile(
+            usuario_id=current_user.id,
+            nombre=upload.filename,
+            carpeta=upload.fields.get("carpeta") or None,
+            content_type=upload.content_type,
+            tamano=upload.size,
+            sha256=upload.sha256,
+            storage_path=blob_path(upload.sha256),
+            deduplicado=deduplicado
+        )
+        await run_in_threadpool(
+            lambda: supabase.table("user_files").insert(user_file.model_dump(mode="json", exclude={"url"})).execute()
+        )
+        user_file.url = await signed_urls.get(FILES_BUCKET, user_file.storage_path)
+        return user_file
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to upload file: {str(e)}")
+    finally:
+        upload.discard()
+
+@api_router.get("/files", response_model=List[UserFile])
+async def get_files(carpeta: Optional[str] = None, current_user: User = Depends(get_current_user)):
+    try:
+        query = supabase.table("user_files").select("*").eq("usuario_id", current_user.id)
+        if carpeta:
+            query = query.eq("carpeta", carpeta)
+        files = query.order("created_at", desc=True).limit(FILES_PAGE_SIZE).execute().data
+        urls = await signed_urls.get_many(FILES_BUCKET, [f["storage_path"] for f in files])
+        return [{**f, "url": urls.get(f["storage_path"])} for f in files]
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get files: {str(e)}")
+
+# Payment webhook: verified, deduplicated and queued; a background consumer
+# applies the subscription updates in batches.
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')
+WEBHOOK_QUEUE_SIZE = int(os.environ.get('WEBHOOK_QUEUE_SIZE', '10000'))
+WEBHOOK_SEEN_KEYS = int(os.environ.get('WEBHOOK_SEEN_KEYS', '50000'))
+WEBHOOK_BATCH_SIZE = int(os.environ.get('WEBHOOK_BATCH_SIZE', '200'))
+WEBHOOK_FLUSH_INTERVAL = float(os.environ.get('WEBHOOK_FLUSH_INTERVAL', '0.2'))
+SUBSCRIPTION_DAYS = 30
+
+async def apply_payment_events(events: Dict[str, Dict[str, Any]]):
+    """Activate the subscription of every user in the batch with a single update."""
+    user_ids = list(events)
+    update_data = {
+        "estado_suscripcion": "ACTIVA",
+        "fecha_renovacion": (datetime.utcnow() + timedelta(days=SUBSCRIPTION_DAYS)).isoformat(),
+        "updated_at": datetime.utcnow().isoformat()
+    }
+    await run_in_threadpool(
+        lambda: supabase.table("users").update(update_data).in_("id", user_ids).execute()
+    )
+    invalidate_principals(user_ids)
+
+payment_events = PaymentEventQueue(
+    apply_payment_events,
+    max_size=WEBHOOK_QUEUE_SIZE,
+    seen_keys=WEBHOOK_SEEN_KEYS,
+    batch_size=WEBHOOK_BATCH_SIZE,
+    flush_interval=WEBHOOK_FLUSH_INTERVAL,
+)
+
+# Subscription expiry: one worker (holding the lease) periodically flips
+# subscriptions past fecha_renovacion back to INACTIVA, so requests only read
+# estado_suscripcion from the cached principal.
+SUBSCRIPTION_SWEEP_INTERVAL = int(os.environ.get('SUBSCRIPTION_SWEEP_INTERVAL', '60'))
+SUBSCRIPTION_SWEEP_BATCH_SIZE = int(os.environ.get('SUBSCRIPTION_SWEEP_BATCH_SIZE', '500'))
+
+# Leases, scheduler cursors and the jobs below act on every user's rows, so
+# they go through the service-role client; RLS would hide them from the anon key.
+def _acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    now = datetime.utcnow()
+    lease_data = {"owner": owner, "expires_at": (now + timedelta(seconds=ttl)).isoformat()}
+    leases = supabase_admin.table("leases")
+    # Renew our own lease, or take over an expired one; each update is atomic
+    if leases.update(lease_data).eq("id", name).eq("owner", owner).execute().data:
+        return True
+    if leases.update(lease_data).eq("id", name).lt("expires_at", now.isoformat()).execute().data:
+        return True
+    if leases.select("id").eq("id", name).execute().data:
+        return False
+    try:
+        leases.insert({"id": name, **lease_data}).execute()
+        return True
+    except Exception:
+        # Another worker created it first
+        return False
+
+async def acquire_lease(name: str, owner: str, ttl: float) -> bool:
+    return await run_in_threadpool(_acquire_lease, name, owner, ttl)
+
+async def release_lease(name: str, owner: str):
+    await run_in_threadpool(
+        lambda: supabase_admin.table("leases").delete().eq("id", name).eq("owner", owner).execute()
+    )
+
+def _expire_subscription_batch(now: str) -> List[str]:
+    batch = (
+        supabase_admin.table("users").select("id")
+        .eq("estado_suscripcion", "ACTIVA").lt("fecha_renovacion", now)
+        .limit(SUBSCRIPTION_SWEEP_BATCH_SIZE).execute().data
+    )
+    user_ids = [user["id"] for user in batch]
+    if user_ids:
+        # Re-check the condition so a renewal that landed meanwhile is kept
+        supabase_admin.table("users").update({"estado_suscripcion": "INACTIVA"}).in_("id", user_ids) \
+            .eq("estado_suscripcion", "ACTIVA").lt("fecha_renovacion", now).execute()
+    return user_ids
+
+async def expire_subscriptions():
+    """Deactivate expired subscriptions in batches of ids found through the index."""
+    now = datetime.utcnow().isoformat()
+    total = 0
+    while True:
+        user_ids = await run_in_threadpool(_expire_subscription_batch, now)
+        if not user_ids:
+            break
+        invalidate_principals(user_ids)
+        total += len(user_ids)
+        if len(user_ids) < SUBSCRIPTION_SWEEP_BATCH_SIZE or not await subscription_sweeper.renew():
+            break
+    if total:
+        logger.info(f"Subscriptions expired: {total}")
+
+subscription_sweeper = LeasedTask(
+    "subscription_sweeper",
+    expire_subscriptions,
+    acquire_lease,
+    release_lease,
+    interval=SUBSCRIPTION_SWEEP_INTERVAL,
+)
+
+# Compliance: the expediente table holds one materialized row per user,
+# updated by events (selection activated, document LISTO, trámite completed)
+# so reading it never scans documents. A periodic audit recounts LISTO
+# documents and re-derives every row, which also applies passed deadlines.
+COMPLIANCE_WARNING_DAYS = int(os.environ.get('COMPLIANCE_WARNING_DAYS', '30'))
+COMPLIANCE_RED_THRESHOLD = int(os.environ.get('COMPLIANCE_RED_THRESHOLD', '50'))
+COMPLIANCE_AUDIT_INTERVAL = int(os.environ.get('COMPLIANCE_AUDIT_INTERVAL', '3600'))
+COMPLIANCE_AUDIT_PAGE_SIZE = int(os.environ.get('COMPLIANCE_AUDIT_PAGE_SIZE', '200'))
+# LISTO documents are read in pages of this many rows; must not exceed the
+# PostgREST max-rows setting, or a short page would end the count early
+COMPLIANCE_COUNT_PAGE_SIZE = int(os.environ.get('COMPLIANCE_COUNT_PAGE_SIZE', '1000'))
+EXPEDIENTE_COLUMNS = (
+    "usuario_id", "items", "documentos_listos", "tramites_completados",
+    "estatus_cumplimiento", "avance", "vencimientos", "proximo_evento", "rev"
+)
+
+async def load_expediente(usuario_id: str) -> Optional[Dict[str, Any]]:
+    rows = await run_in_threadpool(
+        lambda: supabase_admin.table("expediente").select("*").eq("usuario_id", usuario_id).execute().data
+    )
+    return rows[0] if rows else None
+
+def _save_expediente(row: Dict[str, Any], expected_rev: int) -> bool:
+    data = {column: row.get(column) for column in EXPEDIENTE_COLUMNS}
+    if expected_rev == 0:
+        try:
+            supabase_admin.table("expediente").insert(data).execute()
+        except Exception:
+            # UNIQUE (usuario_id): another event created the row first
+            return False
+        return True
+    response = supabase_admin.table("expediente").update(data) \
+        .eq("usuario_id", row["usuario_id"]).eq("rev", expected_rev).execute()
+    return bool(response.data)
+
+async def save_expediente(row: Dict[str, Any], expected_rev: int) -> bool:
+    return await run_in_threadpool(_save_expediente, row, expected_rev)
+
+def schedule_deadline(row: Dict[str, Any]):
+    deadline_scheduler.schedule(row["usuario_id"], parse_timestamp(row.get("proximo_evento")))
+
+compliance = ComplianceStore(
+    load_expediente, save_expediente, COMPLIANCE_WARNING_DAYS, COMPLIANCE_RED_THRESHOLD, on_saved=schedule_deadline
+)
+
+async def record_document_status(usuario_id: str, previous: Dict[str, Any], estado: Optional[str]):
+    """Count a document entering or leaving LISTO; a failure is repaired by the audit."""
+    if estado is None or (estado == DocumentStatus.LISTO.value) == (previous.get("estado") == DocumentStatus.LISTO.value):
+        return
+    event = {"tipo": DOCUMENTO_LISTO, "plantilla_id": previous["plantilla_id"], "delta": 1 if estado == DocumentStatus.LISTO.value else -1}
+    try:
+        await compliance.apply(usuario_id, event)
+    except Exception as e:
+        logger.error(f"Compliance update failed for {usuario_id}: {e}")
+
+def _count_listos(user_ids: List[str]) -> Dict[str, Dict[str, int]]:
+    counts: Dict[str, Dict[str, int]] = {user_id: {} for user_id in user_ids}
+    last_id = None
+    while True:
+        query = supabase_admin.table("document_instances").select("id,usuario_id,plantilla_id") \
+            .in_("usuario_id", user_ids).eq("estado", DocumentStatus.LISTO.value)
+        if last_id is not None:
+            query = query.gt("id", last_id)
+        rows = query.order("id").limit(COMPLIANCE_COUNT_PAGE_SIZE).execute().data
+        for row in rows:
+            per_user = counts[row["usuario_id"]]
+            per_user[row["plantilla_id"]] = per_user.get(row["plantilla_id"], 0) + 1
+        if len(rows) < COMPLIANCE_COUNT_PAGE_SIZE:
+            return counts
+        last_id = rows[-1]["id"]
+
+async def audit_compliance():
+    """Recount LISTO documents per template for every expediente and repair drift."""
+    last_user_id, checked, repaired = None, 0, 0
+    while True:
+        query = supabase_admin.table("expediente").select("*")
+        if last_user_id:
+            query = query.gt("usuario_id", last_user_id)
+        rows = await run_in_threadpool(
+            lambda: query.order("usuario_id").limit(COMPLIANCE_AUDIT_PAGE_SIZE).execute().data
+        )
+        if not rows:
+            break
+        user_ids = [row["usuario_id"] for row in rows]
+        counts = await run_in_threadpool(_count_listos, user_ids)
+        for row in rows:
+            drift = await compliance.reconcile(row, counts[row["usuario_id"]])
+            if "documentos_listos" in drift:
+                repaired += 1
+                logger.warning(f"Compliance state of {row['usuario_id']} was inconsistent: {', '.join(drift)}")
+        checked += len(rows)
+        last_user_id = user_ids[-1]
+        if len(rows) < COMPLIANCE_AUDIT_PAGE_SIZE or not await compliance_auditor.renew():
+            break
+    logger.info(f"Compliance audit: {checked} expedientes checked, {repaired} repaired")
+
+compliance_auditor = LeasedTask(
+    "compliance_auditor",
+    audit_compliance,
+    acquire_lease,
+    release_lease,
+    interval=COMPLIANCE_AUDIT_INTERVAL,
+)
+
+# Deadlines: the lease holder keeps the expedientes due within the next
+# DEADLINE_HORIZON seconds in a heap, loaded through the proximo_evento index,
+# and re-derives them as they come due; passed and upcoming deadlines leave a
+# row in reminders.
+DEADLINE_TICK_INTERVAL = int(os.environ.get('DEADLINE_TICK_INTERVAL', '15'))
+DEADLINE_HORIZON = int(os.environ.get('DEADLINE_HORIZON', '3600'))
+DEADLINE_REFRESH_INTERVAL = int(os.environ.get('DEADLINE_REFRESH_INTERVAL', '300'))
+DEADLINE_BATCH_SIZE = int(os.environ.get('DEADLINE_BATCH_SIZE', '100'))
+DEADLINE_MAX_LOADED = int(os.environ.get('DEADLINE_MAX_LOADED', '10000'))
+REMINDERS_PAGE_SIZE = int(os.environ.get('REMINDERS_PAGE_SIZE', '50'))
+
+def _load_deadline_window(start: Optional[datetime], end: datetime, limit: int) -> List[tuple]:
+    query = supabase_admin.table("expediente").select("usuario_id,proximo_evento").lte("proximo_evento", end.isoformat())
+    if start is not None:
+        query = query.gte("proximo_evento", start.isoformat())
+    rows = query.order("proximo_evento").limit(limit).execute().data
+    return [(parse_timestamp(row["proximo_evento"]), row["usuario_id"]) for row in rows if row.get("proximo_evento")]
+
+async def load_deadline_window(start: Optional[datetime], end: datetime, limit: int) -> List[tuple]:
+    return await run_in_threadpool(_load_deadline_window, start, end, limit)
+
+async def load_deadline_cursor() -> Optional[datetime]:
+    rows = await run_in_threadpool(
+        lambda: supabase_admin.table("scheduler_cursors").select("cursor").eq("id", "deadlines").execute().data
+    )
+    return parse_timestamp(rows[0]["cursor"]) if rows else None
+
+def _save_deadline_cursor(cursor: datetime):
+    response = supabase_admin.table("scheduler_cursors").update({"cursor": cursor.isoformat()}).eq("id", "deadlines").execute()
+    if not response.data:
+        supabase_admin.table("scheduler_cursors").insert({"id": "deadlines", "cursor": cursor.isoformat()}).execute()
+
+async def save_deadline_cursor(cursor: datetime):
+    await run_in_threadpool(_save_deadline_cursor, cursor)
+
+def _store_reminders(pending: List[Dict[str, Any]]):
+    # Reminder ids are deterministic: skip the ones already sent
+    existing = supabase_admin.table("reminders").select("id").in_("id", [reminder["id"] for reminder in pending]).execute().data
+    sent = {row["id"] for row in existing}
+    new = [reminder for reminder in pending if reminder["id"] not in sent]
+    if new:
+        supabase_admin.table("reminders").insert(new).execute()
+
+async def fire_deadlines(usuario_ids: List[str]) -> List[str]:
+    """Re-derive each due expediente and store the reminders of the batch in one write.
+
+    Returns the users whose expediente could not be updated, for a retry.
+    """
+    pending, failed = [], []
+    for usuario_id in usuario_ids:
+        try:
+            row = await compliance.apply(usuario_id, {"tipo": VENCIMIENTO})
+        except Exception as e:
+            logger.error(f"Deadline update failed for {usuario_id}: {e}")
+            failed.append(usuario_id)
+            continue
+        pending.extend(reminders(row))
+    if pending:
+        await run_in_threadpool(_store_reminders, pending)
+    return failed
+
+deadline_scheduler = DeadlineScheduler(
+    load_deadline_window,
+    fire_deadlines,
+    load_deadline_cursor,
+    save_deadline_cursor,
+    horizon=DEADLINE_HORIZON,
+    refresh_interval=DEADLINE_REFRESH_INTERVAL,
+    batch_size=DEADLINE_BATCH_SIZE,
+    max_loaded=DEADLINE_MAX_LOADED,
+)
+
+deadline_task = LeasedTask(
+    "deadline_scheduler",
+    deadline_scheduler.tick,
+    acquire_lease,
+    release_lease,
+    interval=DEADLINE_TICK_INTERVAL,
+)
+
+@api_router.post("/selections", response_model=Selection)
+async def create_selection(request: SelectionCreate, current_user: User = Depends(get_current_user)):
+    try:
+        selection = Selection(usuario_id=current_user.id, items=request.items, estado=request.estado)
+        supabase.table("selections").insert(selection.model_dump(mode="json")).execute()
+        if selection.estado == SelectionStatus.ACTIVO:
+            await compliance.apply(current_user.id, {"tipo": SELECCION_ACTIVADA, "items": selection.items})
+        return selection
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to create selection: {str(e)}")
+
+@api_router.get("/expediente", response_model=Expediente)
+async def get_expediente(current_user: User = Depends(get_current_user)):
+    try:
+        return await compliance.read(current_user.id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get expediente: {str(e)}")
+
+@api_router.get("/expediente/recordatorios", response_model=List[Recordatorio])
+async def get_reminders(current_user: User = Depends(get_current_user)):
+    try:
+        response = supabase.table("reminders").select("*").eq("usuario_id", current_user.id) \
+            .order("created_at", desc=True).limit(REMINDERS_PAGE_SIZE).execute()
+        return response.data
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get reminders: {str(e)}")
+
+@api_router.post("/expediente/tramites/{tramite_id}/completar", response_model=Expediente)
+async def complete_tramite(tramite_id: str, request: TramiteCompletion, current_user: User = Depends(get_current_user)):
+    """Mark a trámite as done; with ``fecha_vencimiento`` it stops counting once that date passes."""
+    try:
+        if tramite_id not in SAMPLE_TRAMITES_BY_ID:
+            raise HTTPException(status_code=404, detail="Trámite no encontrado")
+        return await compliance.apply(current_user.id, {
+            "tipo": TRAMITE_COMPLETADO,
+            "tramite_id": tramite_id,
+            "completado_en": datetime.utcnow().isoformat(),
+            "vence": request.fecha_vencimiento.isoformat() if request.fecha_vencimiento else None
+        })
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to complete tramite: {str(e)}")
+
+@api_router.post("/webhooks/pago")
+async def webhook_payment(request: Request):
+    body = await request.body()
+    if not verify_signature(WEBHOOK_SECRET, body, request.headers.get("x-signature")):
+        raise HTTPException(status_code=401, detail="Firma inválida")
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    if not isinstance(payload, dict):
+        raise HTTPException(status_code=400, detail="JSON inválido")
+    
+    user_id = payload.get("user_id")
+    if not user_id:
         return {"status": "ok"}
+    
+    key = idempotency_key(payload, body, request.headers.get("idempotency-key"))
+    result = payment_events.submit(key, str(user_id), payload)
+    if result == "full":
+        # Let the provider retry later instead of losing the event
+        raise HTTPException(status_code=503, detail="Cola de pagos llena, reintente")
+    return {"status": "ok", "duplicado": result == "duplicate"}
+
+# Course modules: sanitized and serialized once per updated_at and served
+# from memory; the table is re-read at most once per COURSE_CACHE_TTL.
+COURSE_CACHE_TTL = int(os.environ.get('COURSE_CACHE_TTL', '300'))
+course_cache = CourseCache()
+_course_refresh = {"expires_at": 0.0}
+
+async def get_course() -> CourseCache:
+    now = datetime.utcnow().timestamp()
+    if now >= _course_refresh["expires_at"]:
+        modules = await run_in_threadpool(
+            lambda: supabase.table("course_modules").select("*").eq("activo", True).execute().data
+        )
+        course_cache.update(modules)
+        _course_refresh["expires_at"] = now + COURSE_CACHE_TTL
+    return course_cache
+
+def cached_json(body: bytes, etag: str, request: Request) -> Response:
+    # no-cache: clients keep the copy but revalidate, so edits show up at once
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/course/modules")
+async def list_course_modules(request: Request):
+    """Active modules in course order, with their headings for navigation."""
+    try:
+        course = await get_course()
+        return cached_json(course.index_body, course.index_etag, request)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Failed to get course modules: {str(e)}")
+
+@api_router.get("/course/modules/{slug}")
+async def get_course_module(slug: str, request: Request):
+    try:
+        module = (await get_course()).get(slug)
+        if module is None:
+            raise HTTPException(status_code=404, detail="Módulo no encontrado")
+        return cached_json(module.body, module.etag, request)
+    except HTTPException:
+        raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Webhook failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Failed to get course module: {str(e)}")
 
 @api_router.post("/init/sample-data")
 async def init_sample_data():
@@ -774,6 +2186,23 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def start_background_tasks():
+    payment_events.start()
+    subscription_sweeper.start()
+    compliance_auditor.start()
+    deadline_task.start()
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    await payment_events.stop()
+    await subscription_sweeper.stop()
+    await compliance_auditor.stop()
+    await deadline_task.stop()
+    await autosave.drain()
+    await document_jobs.stop()
+    pdf_renderer.shutdown()
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
@@ -0,0 +1,68 @@
+"""
+Cache of signed storage URLs.
+
+Signing is a storage API round trip, and listings would otherwise sign every
+file on every view. URLs are cached by ``(bucket, path)`` and handed out
+while they still have at least ``min_remaining`` seconds of validity, so a
+client never gets one that is about to expire; past that point they are
+signed again on the next request, ahead of their actual expiry. All paths of
+a listing that need signing go to ``sign`` in one call.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+Key = Tuple[str, str]
+
+class SignedUrlCache:
+    """``sign(bucket, paths, expires_in)`` returns ``{path: url}``; paths it
+    could not sign are left out and not cached.
+    """
+
+    def __init__(
+        self,
+        sign: Callable[[str, List[str], int], Awaitable[Dict[str, str]]],
+        expires_in: int,
+        min_remaining: int,
+        max_size: int,
+    ):
+        if min_remaining >= expires_in:
+            raise ValueError("min_remaining must be shorter than expires_in")
+        self.sign = sign
+        self.expires_in = expires_in
+        self.min_remaining = min_remaining
+        self.max_size = max_size
+        self._entries: "OrderedDict[Key, Tuple[float, str]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get_many(self, bucket: str, paths: Iterable[str]) -> Dict[str, str]:
+        now = time.monotonic()
+        urls: Dict[str, str] = {}
+        missing: List[str] = []
+        for path in dict.fromkeys(paths):
+            entry = self._entries.get((bucket, path))
+            if entry is not None and entry[0] - now >= self.min_remaining:
+                self._entries.move_to_end((bucket, path))
+                urls[path] = entry[1]
+            else:
+                missing.append(path)
+        if missing:
+            # Expiry counted from before the call, so it is never overestimated
+            issued = time.monotonic()
+            signed = await self.sign(bucket, missing, self.expires_in)
+            for path, url in signed.items():
+                self._entries[(bucket, path)] = (issued + self.expires_in, url)
+                self._entries.move_to_end((bucket, path))
+                urls[path] = url
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return urls
+
+    async def get(self, bucket: str, path: str) -> Optional[str]:
+        return (await self.get_many(bucket, [path])).get(path)
+
+    def invalidate(self, bucket: str, path: str):
+        self._entries.pop((bucket, path), None)
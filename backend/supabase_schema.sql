@@ -114,6 +114,7 @@ CREATE TABLE IF NOT EXISTS public.document_instances (
     campos JSONB DEFAULT '{}'::jsonb,
     validaciones JSONB DEFAULT '{}'::jsonb,
     historial_versiones JSONB DEFAULT '[]'::jsonb,
+    version INTEGER NOT NULL DEFAULT 1,
     pdf_url TEXT,
     carpeta VARCHAR(50) NOT NULL,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
@@ -124,6 +125,41 @@ CREATE TABLE IF NOT EXISTS public.document_instances (
 CREATE TRIGGER update_document_instances_updated_at BEFORE UPDATE ON public.document_instances
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Version history of document instances: JSON-patch deltas against the
+-- previous version, with a full keyframe of campos every few versions
+CREATE TABLE IF NOT EXISTS public.document_versions (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    documento_id UUID NOT NULL REFERENCES public.document_instances(id) ON DELETE CASCADE,
+    version INTEGER NOT NULL,
+    tipo VARCHAR(10) NOT NULL CHECK (tipo IN ('keyframe', 'delta')),
+    campos JSONB,
+    patch JSONB,
+    autor_id UUID REFERENCES public.users(id) ON DELETE SET NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    UNIQUE (documento_id, version)
+);
+
+-- Bulk document generation jobs: documents created from a suggestion
+-- response, with the progress of their background PDF renders
+CREATE TABLE IF NOT EXISTS public.document_jobs (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    usuario_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    establecimiento_id UUID NOT NULL REFERENCES public.establishments(id) ON DELETE CASCADE,
+    estado VARCHAR(20) DEFAULT 'EN_PROCESO' CHECK (estado IN ('EN_PROCESO', 'COMPLETADO', 'INTERRUMPIDO')),
+    documentos JSONB DEFAULT '[]'::jsonb,
+    omitidas JSONB DEFAULT '[]'::jsonb,
+    pdf_total INTEGER DEFAULT 0,
+    pdf_generados INTEGER DEFAULT 0,
+    pdf_fallidos INTEGER DEFAULT 0,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Apply updated_at trigger to document_jobs table
+CREATE TRIGGER update_document_jobs_updated_at BEFORE UPDATE ON public.document_jobs
+    FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
+
 -- Selections table
 CREATE TABLE IF NOT EXISTS public.selections (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -142,11 +178,17 @@ CREATE TRIGGER update_selections_updated_at BEFORE UPDATE ON public.selections
 -- Expediente table
 CREATE TABLE IF NOT EXISTS public.expediente (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
-    usuario_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
-    items JSONB NOT NULL,
+    usuario_id UUID NOT NULL UNIQUE REFERENCES public.users(id) ON DELETE CASCADE,
+    items JSONB NOT NULL DEFAULT '{}'::jsonb,
+    -- Inputs of the materialized compliance state
+    documentos_listos JSONB DEFAULT '{}'::jsonb,
+    tramites_completados JSONB DEFAULT '{}'::jsonb,
+    -- Derived from the inputs on every event
     estatus_cumplimiento VARCHAR(20) DEFAULT 'ROJO' CHECK (estatus_cumplimiento IN ('VERDE', 'AMARILLO', 'ROJO')),
     avance INTEGER DEFAULT 0 CHECK (avance >= 0 AND avance <= 100),
     vencimientos JSONB DEFAULT '[]'::jsonb,
+    proximo_evento TIMESTAMP WITH TIME ZONE,
+    rev INTEGER NOT NULL DEFAULT 0,
     notas TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
     updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
@@ -156,6 +198,53 @@ CREATE TABLE IF NOT EXISTS public.expediente (
 CREATE TRIGGER update_expediente_updated_at BEFORE UPDATE ON public.expediente
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Reminders left by the deadline scheduler when a trámite is about to
+-- expire or has expired; ids are derived from the deadline, so each is stored once
+CREATE TABLE IF NOT EXISTS public.reminders (
+    id UUID PRIMARY KEY,
+    usuario_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    tramite_id UUID NOT NULL,
+    tipo VARCHAR(20) NOT NULL CHECK (tipo IN ('POR_VENCER', 'VENCIDO')),
+    fecha TIMESTAMP WITH TIME ZONE NOT NULL,
+    estatus_cumplimiento VARCHAR(20),
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Persisted position of background schedulers, so restarts resume from it
+CREATE TABLE IF NOT EXISTS public.scheduler_cursors (
+    id VARCHAR(100) PRIMARY KEY,
+    cursor TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Uploaded file contents, one row per distinct SHA-256; the object is stored
+-- once in the files bucket however many users upload it
+CREATE TABLE IF NOT EXISTS public.file_blobs (
+    id CHAR(64) PRIMARY KEY,
+    storage_path TEXT NOT NULL,
+    content_type VARCHAR(255) NOT NULL,
+    tamano BIGINT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Files uploaded by each user to the file manager
+CREATE TABLE IF NOT EXISTS public.user_files (
+    id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
+    usuario_id UUID NOT NULL REFERENCES public.users(id) ON DELETE CASCADE,
+    nombre VARCHAR(255) NOT NULL,
+    carpeta VARCHAR(100),
+    content_type VARCHAR(255) NOT NULL,
+    tamano BIGINT NOT NULL,
+    sha256 CHAR(64) NOT NULL REFERENCES public.file_blobs(id),
+    storage_path TEXT NOT NULL,
+    deduplicado BOOLEAN DEFAULT false,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Course modules table
 CREATE TABLE IF NOT EXISTS public.course_modules (
     id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -215,15 +304,30 @@ CREATE TABLE IF NOT EXISTS public.audit_events (
     timestamp TIMESTAMP WITH TIME ZONE DEFAULT NOW()
 );
 
+-- Leases for background jobs that must run in a single worker
+CREATE TABLE IF NOT EXISTS public.leases (
+    id VARCHAR(100) PRIMARY KEY,
+    owner VARCHAR(255) NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT NOW(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
 -- Indexes for better performance
+CREATE INDEX IF NOT EXISTS idx_users_suscripcion_renovacion ON public.users(estado_suscripcion, fecha_renovacion);
 CREATE INDEX IF NOT EXISTS idx_establishments_usuario_id ON public.establishments(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_document_instances_usuario_id ON public.document_instances(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_document_instances_plantilla_id ON public.document_instances(plantilla_id);
+CREATE INDEX IF NOT EXISTS idx_document_jobs_usuario_id ON public.document_jobs(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_consultations_usuario_id ON public.consultations(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_course_progress_usuario_id ON public.course_progress(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_course_progress_modulo_id ON public.course_progress(modulo_id);
 CREATE INDEX IF NOT EXISTS idx_selections_usuario_id ON public.selections(usuario_id);
 CREATE INDEX IF NOT EXISTS idx_expediente_usuario_id ON public.expediente(usuario_id);
+CREATE INDEX IF NOT EXISTS idx_expediente_proximo_evento ON public.expediente(proximo_evento);
+CREATE INDEX IF NOT EXISTS idx_reminders_usuario_created ON public.reminders(usuario_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_user_files_usuario_created ON public.user_files(usuario_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_user_files_usuario_sha256 ON public.user_files(usuario_id, sha256);
 CREATE INDEX IF NOT EXISTS idx_audit_events_actor_id ON public.audit_events(actor_id);
 CREATE INDEX IF NOT EXISTS idx_audit_events_timestamp ON public.audit_events(timestamp);
 
@@ -231,8 +335,14 @@ CREATE INDEX IF NOT EXISTS idx_audit_events_timestamp ON public.audit_events(tim
 ALTER TABLE public.users ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.establishments ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.document_instances ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.document_versions ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.document_jobs ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.selections ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.expediente ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.reminders ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.scheduler_cursors ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.file_blobs ENABLE ROW LEVEL SECURITY;
+ALTER TABLE public.user_files ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.course_progress ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.consultations ENABLE ROW LEVEL SECURITY;
 
@@ -251,10 +361,29 @@ CREATE POLICY "Users can view their own establishments" ON public.establishments
 CREATE POLICY "Users can manage their own document instances" ON public.document_instances
     FOR ALL USING (auth.uid()::text = usuario_id::text);
 
+-- Users can read the history of their own document instances
+CREATE POLICY "Users can view their own document versions" ON public.document_versions
+    FOR SELECT USING (EXISTS (
+        SELECT 1 FROM public.document_instances d
+        WHERE d.id = documento_id AND auth.uid()::text = d.usuario_id::text
+    ));
+
+-- Users can view their own document generation jobs
+CREATE POLICY "Users can view their own document jobs" ON public.document_jobs
+    FOR SELECT USING (auth.uid()::text = usuario_id::text);
+
 -- Users can only access their own selections
 CREATE POLICY "Users can manage their own selections" ON public.selections
     FOR ALL USING (auth.uid()::text = usuario_id::text);
 
+-- Users can view their own reminders
+CREATE POLICY "Users can view their own reminders" ON public.reminders
+    FOR SELECT USING (auth.uid()::text = usuario_id::text);
+
+-- Users can only access their own uploaded files
+CREATE POLICY "Users can manage their own files" ON public.user_files
+    FOR ALL USING (auth.uid()::text = usuario_id::text);
+
 -- Users can only access their own expediente
 CREATE POLICY "Users can manage their own expediente" ON public.expediente
     FOR ALL USING (auth.uid()::text = usuario_id::text);
@@ -267,6 +396,9 @@ CREATE POLICY "Users can manage their own course progress" ON public.course_prog
 CREATE POLICY "Users can manage their own consultations" ON public.consultations
     FOR ALL USING (auth.uid()::text = usuario_id::text);
 
+-- Leases are only touched by the backend with the service key
+ALTER TABLE public.leases ENABLE ROW LEVEL SECURITY;
+
 -- Public read access for templates, tramites, course modules, and suggestion rules
 ALTER TABLE public.document_templates ENABLE ROW LEVEL SECURITY;
 ALTER TABLE public.tramites ENABLE ROW LEVEL SECURITY;
@@ -0,0 +1,26 @@
+"""
+Bulk model construction for rows read back from our own database.
+
+Building ``Model(**row)`` once per row pays pydantic's Python-level call
+overhead for every row. Rows coming from our own tables are validated here in
+a single ``TypeAdapter`` call per batch, which keeps the type coercion (enums,
+datetimes from ISO strings) while doing the per-row work inside pydantic-core.
+"""
+
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Type, TypeVar
+
+from pydantic import BaseModel, TypeAdapter
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+@lru_cache(maxsize=None)
+def _list_adapter(model: Type[BaseModel]) -> TypeAdapter:
+    return TypeAdapter(List[model])
+
+def load_rows(model: Type[ModelT], rows: Iterable[Dict[str, Any]]) -> List[ModelT]:
+    """Validate database rows into ``model`` instances in one bulk call."""
+    rows = rows if isinstance(rows, list) else list(rows)
+    if not rows:
+        return []
+    return _list_adapter(model).validate_python(rows)
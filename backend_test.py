@@ -7,7 +7,8 @@ Tests all API endpoints for functionality and integration
 import requests
 import sys
 import json
-from datetime import datetime
+import time
+from datetime import datetime, timedelta
 from typing import Dict, Any
 
 class COFEPRISAPITester:
@@ -60,6 +61,8 @@ class COFEPRISAPITester:
                 response = requests.post(url, json=data, headers=test_headers, timeout=30)
             elif method == 'PUT':
                 response = requests.put(url, json=data, headers=test_headers, timeout=30)
+            elif method == 'PATCH':
+                response = requests.patch(url, json=data, headers=test_headers, timeout=30)
             elif method == 'DELETE':
                 response = requests.delete(url, headers=test_headers, timeout=30)
 
@@ -177,6 +180,50 @@ class COFEPRISAPITester:
         
         return success
 
+    def test_establishments_bulk_import(self):
+        """Test NDJSON bulk import of establishments with a per-row error report"""
+        if not self.token:
+            self.log_test("Establishments Bulk Import", False, "No authentication token")
+            return False
+
+        rows = [
+            {"giro": "SPA", "ubicacion_estado": "Jalisco"},
+            {"giro": "CONSULTORIO_ODONTO", "servicios": ["Limpieza dental"], "maneja_rpbi": True, "ubicacion_estado": "Nuevo León"},
+            {"giro": "NO_EXISTE", "ubicacion_estado": "Puebla"}
+        ]
+        body = "\n".join(json.dumps(row) for row in rows)
+        url = f"{self.api_url}/establishments/import?sugerencias=true"
+        print("\n🔍 Testing Establishments Bulk Import...")
+        print(f"   URL: {url}")
+        
+        try:
+            response = requests.post(
+                url,
+                data=body.encode("utf-8"),
+                headers={
+                    'Content-Type': 'application/x-ndjson',
+                    'Authorization': f'Bearer {self.token}'
+                },
+                timeout=30
+            )
+            print(f"   Status: {response.status_code}")
+            report = response.json()
+        except Exception as e:
+            self.log_test("Establishments Bulk Import", False, f"Request failed: {str(e)}")
+            return False
+
+        if response.status_code != 200:
+            self.log_test("Establishments Bulk Import", False, f"Expected 200, got {response.status_code}")
+            return False
+        if report.get('importados') != 2 or report.get('rechazados') != 1:
+            self.log_test("Establishments Bulk Import", False, f"Unexpected report: {report}")
+            return False
+        if [e['fila'] for e in report.get('errores', [])] != [3]:
+            self.log_test("Establishments Bulk Import", False, "Row error not reported for row 3")
+            return False
+        self.log_test("Establishments Bulk Import", True)
+        return True
+
     def test_regulatory_suggestions(self):
         """Test regulatory suggestions endpoint"""
         suggestion_request = {
@@ -208,6 +255,49 @@ class COFEPRISAPITester:
         
         return success
 
+    def test_compact_suggestions(self):
+        """Test compact suggestions and lazy expansion of selected ids"""
+        suggestion_request = {
+            "giro": "CONSULTORIO_ODONTO",
+            "maneja_rpbi": True,
+            "ubicacion_estado": "Ciudad de México"
+        }
+        
+        success, response = self.run_test(
+            "Compact Suggestions", 
+            "POST", 
+            "/suggestions?compact=true", 
+            200, 
+            suggestion_request
+        )
+        
+        if not success:
+            return False
+        
+        for template in response.get('plantillas', []):
+            if 'que_incluye' in template or 'campos_definicion' in template:
+                self.log_test("Compact Suggestions Payload", False, "Full template returned in compact mode")
+                return False
+        self.log_test("Compact Suggestions Payload", True)
+        
+        expand_request = {
+            "plantillas": [t['id'] for t in response.get('plantillas', [])],
+            "tramites": [t['id'] for t in response.get('tramites', [])]
+        }
+        success, expanded = self.run_test(
+            "Expand Suggestions", 
+            "POST", 
+            "/suggestions/expand", 
+            200, 
+            expand_request
+        )
+        
+        if success and len(expanded.get('plantillas', [])) != len(expand_request['plantillas']):
+            self.log_test("Expand Suggestions Count", False, "Not every id was expanded")
+            return False
+        
+        return success
+
     def test_ai_consultation(self):
         """Test AI consultation endpoint"""
         if not self.token:
@@ -285,6 +375,294 @@ class COFEPRISAPITester:
         
         return success
 
+    def test_document_pdf(self):
+        """Test document creation and cached PDF download"""
+        if not self.token:
+            self.log_test("Document PDF", False, "No authentication token")
+            return False
+
+        success, templates = self.run_test("Get Templates For Document", "GET", "/templates", 200)
+        if not success or not templates:
+            return False
+        success, document = self.run_test(
+            "Create Document",
+            "POST",
+            "/documents",
+            200,
+            {"plantilla_id": templates[0]["id"], "campos": {"responsable": "Dra. Prueba"}}
+        )
+        if not success:
+            return False
+
+        url = f"{self.api_url}/documents/{document['id']}/pdf"
+        print("\n🔍 Testing Document PDF...")
+        print(f"   URL: {url}")
+        try:
+            headers = {'Authorization': f'Bearer {self.token}'}
+            first = requests.get(url, headers=headers, timeout=60)
+            second = requests.get(url, headers={**headers, 'If-None-Match': first.headers.get('ETag', '')}, timeout=30)
+            print(f"   Status: {first.status_code}, revalidation: {second.status_code}")
+        except Exception as e:
+            self.log_test("Document PDF", False, f"Request failed: {str(e)}")
+            return False
+
+        if first.status_code != 200 or not first.content.startswith(b"%PDF"):
+            self.log_test("Document PDF", False, f"Expected a PDF, got {first.status_code}")
+            return False
+        if second.status_code != 304:
+            self.log_test("Document PDF", False, f"Expected 304 for unchanged document, got {second.status_code}")
+            return False
+        self.log_test("Document PDF", True)
+        return True
+
+    def test_document_autosave(self):
+        """Test field-level autosave and stale version rejection"""
+        if not self.token:
+            self.log_test("Document Autosave", False, "No authentication token")
+            return False
+
+        success, templates = self.run_test("Get Templates For Autosave", "GET", "/templates", 200)
+        if not success or not templates:
+            return False
+        success, document = self.run_test(
+            "Create Autosave Document",
+            "POST",
+            "/documents",
+            200,
+            {"plantilla_id": templates[0]["id"], "campos": {"responsable": "Dra. Prueba"}}
+        )
+        if not success:
+            return False
+
+        endpoint = f"/documents/{document['id']}"
+        success, saved = self.run_test(
+            "Autosave Fields", "PATCH", endpoint, 200, {"campos": {"area": "Calidad"}, "version": document["version"]}
+        )
+        if not success:
+            return False
+        if saved.get("version") != document["version"] + 1:
+            self.log_test("Document Autosave", False, f"Expected version {document['version'] + 1}, got {saved.get('version')}")
+            return False
+        success, _ = self.run_test(
+            "Autosave Stale Version", "PATCH", endpoint, 409, {"campos": {"area": "Otra"}, "version": document["version"]}
+        )
+        return success
+
+    def test_document_batch(self):
+        """Test bulk document generation from suggestions and job polling"""
+        if not self.token:
+            self.log_test("Document Batch", False, "No authentication token")
+            return False
+
+        profile = {
+            "giro": "SPA",
+            "servicios": ["Masajes"],
+            "maneja_rpbi": True,
+            "ubicacion_estado": "Jalisco"
+        }
+        success, establishment = self.run_test("Create Batch Establishment", "POST", "/establishments", 200, profile)
+        if not success:
+            return False
+        success, suggestions = self.run_test("Suggestions For Batch", "POST", "/suggestions", 200, profile)
+        if not success:
+            return False
+        success, job = self.run_test(
+            "Create Document Batch",
+            "POST",
+            "/documents/batch",
+            200,
+            {"establecimiento_id": establishment["id"], "sugerencias": suggestions, "generar_pdf": True}
+        )
+        if not success:
+            return False
+        if len(job.get("documentos", [])) != len(suggestions["plantillas"]):
+            self.log_test("Document Batch", False, f"Expected {len(suggestions['plantillas'])} documents, got {len(job.get('documentos', []))}")
+            return False
+
+        for _ in range(30):
+            success, status = self.run_test("Poll Document Batch", "GET", f"/documents/batch/{job['id']}", 200)
+            if not success:
+                return False
+            if status.get("estado") != "EN_PROCESO":
+                break
+            time.sleep(1)
+        if status.get("estado") != "COMPLETADO" or status.get("pdf_generados") != status.get("pdf_total"):
+            self.log_test("Document Batch", False, f"Job ended as {status.get('estado')} with {status.get('pdf_generados')}/{status.get('pdf_total')} PDFs")
+            return False
+        self.log_test("Document Batch", True)
+        return True
+
+    def test_expediente(self):
+        """Test selection activation, compliance progress and expired trámites"""
+        if not self.token:
+            self.log_test("Expediente", False, "No authentication token")
+            return False
+
+        success, templates = self.run_test("Get Templates For Expediente", "GET", "/templates", 200)
+        if not success or not templates:
+            return False
+        success, tramites = self.run_test("Get Tramites For Expediente", "GET", "/tramites", 200)
+        if not success or not tramites:
+            return False
+        plantilla_id = templates[0]["id"]
+        tramite_id = tramites[0]["id"]
+        success, _ = self.run_test(
+            "Activate Selection",
+            "POST",
+            "/selections",
+            200,
+            {"items": {"plantillas": [plantilla_id], "tramites": [tramite_id]}, "estado": "ACTIVO"}
+        )
+        if not success:
+            return False
+
+        success, document = self.run_test(
+            "Create Expediente Document",
+            "POST",
+            "/documents",
+            200,
+            {"plantilla_id": plantilla_id, "campos": {"responsable": "Dra. Prueba"}}
+        )
+        if not success:
+            return False
+        success, _ = self.run_test("Mark Document Ready", "PUT", f"/documents/{document['id']}", 200, {"estado": "LISTO"})
+        if not success:
+            return False
+        success, expediente = self.run_test("Get Expediente", "GET", "/expediente", 200)
+        if not success:
+            return False
+        if plantilla_id not in expediente.get("documentos_listos", {}) or not expediente.get("avance"):
+            self.log_test("Expediente Progress", False, f"Ready document not counted, avance {expediente.get('avance')}")
+            return False
+
+        expired = (datetime.now() - timedelta(days=1)).isoformat()
+        success, expediente = self.run_test(
+            "Complete Expired Tramite",
+            "POST",
+            f"/expediente/tramites/{tramite_id}/completar",
+            200,
+            {"fecha_vencimiento": expired}
+        )
+        if not success:
+            return False
+        vencimientos = [v for v in expediente.get("vencimientos", []) if v.get("tramite_id") == tramite_id]
+        if expediente.get("estatus_cumplimiento") != "ROJO" or not any(v.get("estado") == "VENCIDO" for v in vencimientos):
+            self.log_test("Expediente Expired Tramite", False, f"Expected ROJO/VENCIDO, got {expediente.get('estatus_cumplimiento')} {vencimientos}")
+            return False
+        self.log_test("Expediente", True)
+        return True
+
+    def test_expediente_reminders(self):
+        """Test the stored deadline reminders of the user"""
+        if not self.token:
+            self.log_test("Expediente Reminders", False, "No authentication token")
+            return False
+
+        success, reminders = self.run_test("Get Expediente Reminders", "GET", "/expediente/recordatorios", 200)
+        if not success:
+            return False
+        if not isinstance(reminders, list) or any(r.get("tipo") not in ("POR_VENCER", "VENCIDO") for r in reminders):
+            self.log_test("Expediente Reminders", False, f"Unexpected reminders: {reminders}")
+            return False
+        self.log_test("Expediente Reminders", True)
+        return True
+
+    def test_file_upload(self):
+        """Test streaming file upload and content-hash dedupe"""
+        if not self.token:
+            self.log_test("File Upload", False, "No authentication token")
+            return False
+
+        content = f"Licencia sanitaria {datetime.now().timestamp()}".encode("utf-8") * 1000
+        url = f"{self.api_url}/files"
+        print("\n🔍 Testing File Upload...")
+        print(f"   URL: {url}")
+
+        uploads = []
+        try:
+            for name in ("licencia.pdf", "licencia_sucursal.pdf"):
+                response = requests.post(
+                    url,
+                    files={"file": (name, content, "application/pdf")},
+                    data={"carpeta": "tramites"},
+                    headers={'Authorization': f'Bearer {self.token}'},
+                    timeout=30
+                )
+                print(f"   Status: {response.status_code}")
+                if response.status_code != 200:
+                    self.log_test("File Upload", False, f"Expected 200, got {response.status_code}")
+                    return False
+                uploads.append(response.json())
+        except Exception as e:
+            self.log_test("File Upload", False, f"Request failed: {str(e)}")
+            return False
+
+        first, second = uploads
+        if first.get("tamano") != len(content) or first.get("sha256") != second.get("sha256"):
+            self.log_test("File Upload", False, f"Unexpected uploads: {uploads}")
+            return False
+        if first.get("deduplicado") or not second.get("deduplicado"):
+            self.log_test("File Upload", False, "Second identical upload of the user was not flagged")
+            return False
+        success, files = self.run_test("List Files", "GET", "/files?carpeta=tramites", 200)
+        if not success or {f["id"] for f in files} < {first["id"], second["id"]}:
+            self.log_test("File Upload", False, "Uploaded files missing from listing")
+            return False
+        self.log_test("File Upload", True)
+        return True
+
+    def test_search(self):
+        """Test full-text search with accent folding, stemming and pagination"""
+        if not self.token:
+            self.log_test("Search", False, "No authentication token")
+            return False
+
+        # Accents, case and plurals are ignored
+        success, response = self.run_test("Search Catalog", "GET", "/search?q=LIMPIEZA%20desinfeccion", 200)
+        if not success:
+            return False
+        if not any(r["tipo"] == "PLANTILLA" for r in response.get("resultados", [])):
+            self.log_test("Search", False, f"Template not found: {response}")
+            return False
+
+        success, response = self.run_test("Search Paginated", "GET", "/search?q=licencias&por_pagina=1", 200)
+        if not success:
+            return False
+        if len(response.get("resultados", [])) > 1 or response.get("por_pagina") != 1:
+            self.log_test("Search", False, f"Page size not applied: {response}")
+            return False
+        self.log_test("Search", True)
+        return True
+
+    def test_course_modules(self):
+        """Test course module index, sanitized content and ETag revalidation"""
+        success, modules = self.run_test("Course Modules", "GET", "/course/modules", 200)
+        if not success:
+            return False
+        if not modules:
+            self.log_test("Course Modules", True, "No active modules")
+            return True
+
+        success, module = self.run_test("Course Module", "GET", f"/course/modules/{modules[0]['slug']}", 200)
+        if not success:
+            return False
+        if "<script" in module.get("contenido_html", ""):
+            self.log_test("Course Modules", False, "Content not sanitized")
+            return False
+
+        url = f"{self.api_url}/course/modules"
+        try:
+            first = requests.get(url, timeout=30)
+            second = requests.get(url, headers={'If-None-Match': first.headers.get('ETag', '')}, timeout=30)
+        except Exception as e:
+            self.log_test("Course Modules", False, f"Request failed: {str(e)}")
+            return False
+        if second.status_code != 304:
+            self.log_test("Course Modules", False, f"Expected 304 for unchanged index, got {second.status_code}")
+            return False
+        self.log_test("Course Modules", True)
+        return True
+
     def test_payment_webhook(self):
         """Test payment webhook endpoint"""
         webhook_payload = {
@@ -294,13 +672,31 @@ class COFEPRISAPITester:
             "currency": "MXN"
         }
         
-        return self.run_test(
+        headers = {"Idempotency-Key": f"test-{datetime.now().timestamp()}"}
+        success, response = self.run_test(
             "Payment Webhook", 
             "POST", 
             "/webhooks/pago", 
             200, 
-            webhook_payload
+            webhook_payload,
+            headers=headers
+        )
+        if not success:
+            return success, response
+        
+        # A provider retry with the same key is acknowledged but not applied again
+        retry_success, retry_response = self.run_test(
+            "Payment Webhook Retry", 
+            "POST", 
+            "/webhooks/pago", 
+            200, 
+            webhook_payload,
+            headers=headers
         )
+        if retry_success and not retry_response.get("duplicado"):
+            self.log_test("Payment Webhook Dedupe", False, "Retry was not reported as duplicate")
+            return False, retry_response
+        return retry_success, retry_response
 
     def test_sample_data_init(self):
         """Test sample data initialization"""
@@ -322,10 +718,20 @@ class COFEPRISAPITester:
             ("User Registration", self.test_user_registration),
             ("User Login", self.test_user_login),
             ("Establishments CRUD", self.test_establishments_crud),
+            ("Establishments Bulk Import", self.test_establishments_bulk_import),
             ("Regulatory Suggestions", self.test_regulatory_suggestions),
+            ("Compact Suggestions", self.test_compact_suggestions),
             ("AI Consultation", self.test_ai_consultation),
             ("Document Templates", self.test_document_templates),
             ("Tramites", self.test_tramites),
+            ("Document PDF", self.test_document_pdf),
+            ("Document Autosave", self.test_document_autosave),
+            ("Document Batch", self.test_document_batch),
+            ("Expediente", self.test_expediente),
+            ("Expediente Reminders", self.test_expediente_reminders),
+            ("File Upload", self.test_file_upload),
+            ("Search", self.test_search),
+            ("Course Modules", self.test_course_modules),
             ("Payment Webhook", self.test_payment_webhook),
             ("Sample Data Init", self.test_sample_data_init)
         ]
@@ -1,13 +1,16 @@
-import React, { useState } from "react";
+import React, { useState, useEffect } from "react";
 import { Link } from "react-router-dom";
 import { BookOpen, Shield, CheckCircle, Clock, Play, Award, Brain, FileText } from "lucide-react";
 import { useAuth } from "../App";
+import { api } from "../utils/api";
 
 const CourseSystem = () => {
   const { logout } = useAuth();
   const [selectedModule, setSelectedModule] = useState(null);
+  const [moduleContent, setModuleContent] = useState(null);
   
-  const courseModules = [
+  // Shown until the course API answers, or when it has no modules yet
+  const sampleModules = [
     {
       id: 1,
       title: "Introducción a COFEPRIS",
@@ -81,6 +84,36 @@ const CourseSystem = () => {
       topics: ["Aviso de funcionamiento", "Modificaciones", "Responsable sanitario", "Renovaciones"]
     }
   ];
+  const [courseModules, setCourseModules] = useState(sampleModules);
+
+  useEffect(() => {
+    api.get('/course/modules')
+      .then((modules) => {
+        if (modules.length === 0) return;
+        setCourseModules(modules.map((module) => ({
+          id: module.slug,
+          slug: module.slug,
+          title: module.titulo,
+          duration: "",
+          status: "not_started",
+          progress: 0,
+          description: module.objetivos,
+          topics: module.encabezados.map((heading) => heading.texto)
+        })));
+      })
+      .catch(() => {});
+  }, []);
+
+  const selectModule = async (module) => {
+    setSelectedModule(module);
+    setModuleContent(null);
+    if (!module.slug) return;
+    try {
+      setModuleContent(await api.get(`/course/modules/${module.slug}`));
+    } catch (error) {
+      console.error('Error loading module:', error);
+    }
+  };
 
   const getStatusIcon = (status) => {
     switch (status) {
@@ -185,7 +218,7 @@ const CourseSystem = () => {
               </h2>
               
               <div className="space-y-4" data-testid="course-modules-list">
-                {courseModules.map((module) => (
+                {courseModules.map((module, index) => (
                   <div
                     key={module.id}
                     className={`border-2 rounded-xl p-6 transition-all cursor-pointer ${
@@ -193,7 +226,7 @@ const CourseSystem = () => {
                         ? "border-emerald-500 bg-emerald-50"
                         : "border-gray-200 bg-white hover:border-emerald-200"
                     }`}
-                    onClick={() => setSelectedModule(module)}
+                    onClick={() => selectModule(module)}
                     data-testid={`course-module-${module.id}`}
                   >
                     <div className="flex items-center justify-between mb-4">
@@ -201,7 +234,7 @@ const CourseSystem = () => {
                         {getStatusIcon(module.status)}
                         <div>
                           <h3 className="text-lg font-semibold text-gray-900">
-                            Módulo {module.id}: {module.title}
+                            Módulo {index + 1}: {module.title}
                           </h3>
                           <p className="text-sm text-gray-600">{module.description}</p>
                         </div>
@@ -248,8 +281,8 @@ const CourseSystem = () => {
                     
                     <div className="flex items-center justify-between">
                       <div className="text-xs text-gray-500">
-                        {module.id <= 2 ? "✓ Evaluación aprobada" : 
-                         module.id === 3 ? "⚡ Evaluación pendiente" : "📝 Evaluación disponible"}
+                        {module.status === "completed" ? "✓ Evaluación aprobada" : 
+                         module.status === "in_progress" ? "⚡ Evaluación pendiente" : "📝 Evaluación disponible"}
                       </div>
                       
                       <button
@@ -271,6 +304,50 @@ const CourseSystem = () => {
                 ))}
               </div>
             </div>
+
+            {/* Module Content */}
+            {moduleContent && moduleContent.slug === selectedModule?.slug && (
+              <div className="glass-card p-8 mt-8" data-testid="course-module-content">
+                <h2 className="text-2xl font-semibold text-gray-900 mb-4">
+                  {moduleContent.titulo}
+                </h2>
+                
+                {moduleContent.encabezados.length > 0 && (
+                  <nav className="mb-6 text-sm">
+                    {moduleContent.encabezados.map((heading) => (
+                      <a
+                        key={heading.id}
+                        href={`#${heading.id}`}
+                        className={`block text-emerald-700 hover:text-emerald-800 ${heading.nivel === 3 ? "ml-4" : ""}`}
+                      >
+                        {heading.texto}
+                      </a>
+                    ))}
+                  </nav>
+                )}
+                
+                {/* Sanitized by the course API */}
+                <div
+                  className="prose max-w-none"
+                  dangerouslySetInnerHTML={{ __html: moduleContent.contenido_html }}
+                />
+                
+                <div className="flex justify-between mt-8 text-sm">
+                  {[moduleContent.anterior, moduleContent.siguiente].map((slug, position) => {
+                    const neighbour = courseModules.find((module) => module.slug === slug);
+                    return neighbour ? (
+                      <button
+                        key={slug}
+                        onClick={() => selectModule(neighbour)}
+                        className="btn-ghost"
+                      >
+                        {position === 0 ? `← ${neighbour.title}` : `${neighbour.title} →`}
+                      </button>
+                    ) : <span key={position} />;
+                  })}
+                </div>
+              </div>
+            )}
           </div>
 
           {/* Sidebar */}
@@ -288,10 +365,12 @@ const CourseSystem = () => {
                     <p className="text-sm text-gray-600">{selectedModule.description}</p>
                   </div>
                   
-                  <div className="flex justify-between text-sm">
-                    <span className="text-gray-600">Duración:</span>
-                    <span className="font-medium">{selectedModule.duration}</span>
-                  </div>
+                  {selectedModule.duration && (
+                    <div className="flex justify-between text-sm">
+                      <span className="text-gray-600">Duración:</span>
+                      <span className="font-medium">{selectedModule.duration}</span>
+                    </div>
+                  )}
                   
                   <div className="flex justify-between text-sm">
                     <span className="text-gray-600">Estado:</span>
@@ -25,12 +25,14 @@ const Dashboard = () => {
     try {
       // Load establishments
       const establishments = await api.get('/establishments');
+      // Materialized compliance state, kept up to date by the backend
+      const expediente = await api.get('/expediente');
 
-      // Mock stats for now - in production, these would come from backend
+      // Mock document and task counts for now - in production, these would come from backend
       setStats({
         establishments: establishments.length,
         documents: Math.floor(Math.random() * 20) + 5,
-        completeness: Math.floor(Math.random() * 40) + 60,
+        completeness: expediente.avance,
         pendingTasks: Math.floor(Math.random() * 5) + 2
       });
 
@@ -1,9 +1,12 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { useParams, Link } from "react-router-dom";
 import { FileText, Save, Download, Shield, CheckCircle, AlertTriangle, Eye, History, Copy } from "lucide-react";
 import { toast } from "sonner";
 import { useAuth } from "../App";
-import { api } from "../utils/api";
+import { api, API } from "../utils/api";
+
+// Delay after the last keystroke before changed fields are autosaved
+const AUTOSAVE_DELAY_MS = 2000;
 
 const DocumentEditor = () => {
   const { templateId } = useParams();
@@ -18,11 +21,20 @@ const DocumentEditor = () => {
   const [validationResults, setValidationResults] = useState({});
   const [loading, setLoading] = useState(true);
   const [saving, setSaving] = useState(false);
+  const dirtyFields = useRef(new Set());
 
   useEffect(() => {
     loadTemplate();
   }, [templateId]);
 
+  useEffect(() => {
+    if (!document.id || dirtyFields.current.size === 0) {
+      return;
+    }
+    const timer = setTimeout(autosave, AUTOSAVE_DELAY_MS);
+    return () => clearTimeout(timer);
+  }, [document.campos]);
+
   const loadTemplate = async () => {
     try {
       const templates = await api.get('/templates');
@@ -65,6 +77,7 @@ const DocumentEditor = () => {
   };
 
   const handleFieldChange = (field, value) => {
+    dirtyFields.current.add(field);
     setDocument(prev => ({
       ...prev,
       campos: {
@@ -84,6 +97,7 @@ const DocumentEditor = () => {
 
   const handleArrayFieldAdd = (field, newItem) => {
     if (newItem.trim()) {
+      dirtyFields.current.add(field);
       setDocument(prev => ({
         ...prev,
         campos: {
@@ -95,6 +109,7 @@ const DocumentEditor = () => {
   };
 
   const handleArrayFieldRemove = (field, index) => {
+    dirtyFields.current.add(field);
     setDocument(prev => ({
       ...prev,
       campos: {
@@ -129,10 +144,7 @@ const DocumentEditor = () => {
     setSaving(true);
     
     try {
-      // Mock save - in production, this would create/update document instance
-      await new Promise(resolve => setTimeout(resolve, 1000));
-      
-      setDocument(prev => ({ ...prev, estado: "LISTO" }));
+      await saveDocument("LISTO");
       toast.success("Documento guardado exitosamente");
     } catch (error) {
       toast.error("Error guardando documento");
@@ -141,10 +153,60 @@ const DocumentEditor = () => {
     }
   };
 
+  const autosave = async () => {
+    const fields = [...dirtyFields.current];
+    dirtyFields.current.clear();
+    const campos = Object.fromEntries(fields.map(field => [field, document.campos[field] ?? null]));
+    
+    try {
+      const saved = await api.patch(`/documents/${document.id}`, { campos, version: document.version });
+      setDocument(prev => ({ ...prev, version: saved.version, updated_at: saved.updated_at }));
+      applyServerValidation(saved.validaciones);
+    } catch (error) {
+      // Retry these fields with the next change; a version conflict needs a reload
+      fields.forEach(field => dirtyFields.current.add(field));
+      toast.error(`Autoguardado fallido: ${error.message}`);
+    }
+  };
+
+  // Field results computed by the backend from the template definition
+  const applyServerValidation = (validaciones = {}) => {
+    setValidationResults(prev => {
+      const next = { ...prev };
+      Object.entries(validaciones).forEach(([field, result]) => {
+        next[field] = result.valido ? null : result.mensaje;
+      });
+      return next;
+    });
+  };
+
+  const saveDocument = async (estado) => {
+    dirtyFields.current.clear();
+    const saved = document.id
+      ? await api.put(`/documents/${document.id}`, { campos: document.campos, estado })
+      : await api.post('/documents', { plantilla_id: template.id, campos: document.campos });
+    setDocument(saved);
+    applyServerValidation(saved.validaciones);
+    return saved;
+  };
+
   const handleDownloadPDF = async () => {
     try {
-      // Mock PDF generation
-      await new Promise(resolve => setTimeout(resolve, 2000));
+      // Save first so the PDF reflects what is on screen
+      const saved = await saveDocument(document.estado);
+      const response = await fetch(`${API}/documents/${saved.id}/pdf`, {
+        headers: { 'Authorization': `Bearer ${localStorage.getItem('token')}` }
+      });
+      if (!response.ok) {
+        throw new Error(`HTTP ${response.status}`);
+      }
+      
+      const url = URL.createObjectURL(await response.blob());
+      const link = window.document.createElement('a');
+      link.href = url;
+      link.download = `${template.nombre}.pdf`;
+      link.click();
+      URL.revokeObjectURL(url);
       toast.success("PDF generado exitosamente");
     } catch (error) {
       toast.error("Error generando PDF");
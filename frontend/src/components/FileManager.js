@@ -1,12 +1,106 @@
-import React, { useState } from "react";
+import React, { useState, useEffect, useRef } from "react";
 import { Link } from "react-router-dom";
 import { FolderOpen, Shield, FileText, Download, Calendar, AlertTriangle, CheckCircle, Upload, Search, Filter } from "lucide-react";
+import { toast } from "sonner";
 import { useAuth } from "../App";
+import { api } from "../utils/api";
+
+const formatSize = (bytes) => {
+  if (bytes >= 1024 * 1024) return `${(bytes / (1024 * 1024)).toFixed(1)} MB`;
+  return `${Math.max(1, Math.round(bytes / 1024))} KB`;
+};
+
+// Uploaded files are shown alongside the documents, without an editor link
+const toDocument = (file) => ({
+  id: file.id,
+  name: file.nombre,
+  folder: file.carpeta || "all",
+  status: "listo",
+  lastModified: file.created_at,
+  expirationDate: null,
+  size: formatSize(file.tamano),
+  type: (file.nombre.split(".").pop() || "").toUpperCase(),
+  url: file.url,
+  uploaded: true
+});
 
 const FileManager = () => {
   const { logout } = useAuth();
   const [selectedFolder, setSelectedFolder] = useState("all");
   const [searchTerm, setSearchTerm] = useState("");
+  const [searchType, setSearchType] = useState("");
+  const [searchResults, setSearchResults] = useState(null);
+  const [searchTotal, setSearchTotal] = useState(0);
+  const [searchPage, setSearchPage] = useState(1);
+  const [uploadedFiles, setUploadedFiles] = useState([]);
+  const [uploading, setUploading] = useState(false);
+  const fileInputRef = useRef(null);
+
+  useEffect(() => {
+    loadFiles();
+  }, []);
+
+  // Server-side search over templates, trámites and the user's documents
+  useEffect(() => {
+    if (!searchTerm.trim()) {
+      setSearchResults(null);
+      return;
+    }
+    const timer = setTimeout(() => runSearch(1), 300);
+    return () => clearTimeout(timer);
+  }, [searchTerm, searchType]);
+
+  const runSearch = async (page) => {
+    const params = new URLSearchParams({ q: searchTerm.trim(), pagina: page });
+    if (searchType) params.append("tipo", searchType);
+    try {
+      const response = await api.get(`/search?${params.toString()}`);
+      setSearchResults(prev => page === 1 ? response.resultados : [...(prev || []), ...response.resultados]);
+      setSearchTotal(response.total);
+      setSearchPage(page);
+    } catch (error) {
+      console.error('Error searching:', error);
+    }
+  };
+
+  const searchTypeLabels = {
+    PLANTILLA: "Plantilla",
+    TRAMITE: "Trámite",
+    DOCUMENTO: "Documento"
+  };
+
+  const loadFiles = async () => {
+    try {
+      setUploadedFiles(await api.get('/files'));
+    } catch (error) {
+      console.error('Error loading files:', error);
+    }
+  };
+
+  const handleUpload = async (event) => {
+    const file = event.target.files[0];
+    event.target.value = "";
+    if (!file) return;
+
+    const formData = new FormData();
+    formData.append("file", file);
+    if (selectedFolder !== "all") {
+      formData.append("carpeta", selectedFolder);
+    }
+
+    setUploading(true);
+    try {
+      const uploaded = await api.upload('/files', formData);
+      setUploadedFiles(prev => [uploaded, ...prev]);
+      toast.success(uploaded.deduplicado
+        ? "Archivo agregado (ya tenías un archivo con el mismo contenido)"
+        : "Archivo subido correctamente");
+    } catch (error) {
+      toast.error(error.message || "Error al subir el archivo");
+    } finally {
+      setUploading(false);
+    }
+  };
   
   const folders = [
     { id: "all", name: "Todos los documentos", count: 18, icon: FolderOpen, color: "gray" },
@@ -16,7 +110,7 @@ const FileManager = () => {
     { id: "tramites", name: "Trámites", count: 5, icon: Calendar, color: "purple" }
   ];
 
-  const documents = [
+  const sampleDocuments = [
     {
       id: 1,
       name: "POE de Limpieza y Desinfección",
@@ -79,6 +173,8 @@ const FileManager = () => {
     }
   ];
 
+  const documents = [...uploadedFiles.map(toDocument), ...sampleDocuments];
+
   const getStatusColor = (status) => {
     switch (status) {
       case "listo":
@@ -124,11 +220,10 @@ const FileManager = () => {
     return daysUntilExpiry <= 30;
   };
 
-  const filteredDocuments = documents.filter(doc => {
-    const matchesFolder = selectedFolder === "all" || doc.folder === selectedFolder;
-    const matchesSearch = doc.name.toLowerCase().includes(searchTerm.toLowerCase());
-    return matchesFolder && matchesSearch;
-  });
+  // While searching, the server results replace the folder listing
+  const filteredDocuments = searchResults !== null ? [] : documents.filter(doc =>
+    selectedFolder === "all" || doc.folder === selectedFolder
+  );
 
   const complianceStatus = {
     total: documents.length,
@@ -244,9 +339,21 @@ const FileManager = () => {
                   Nuevo Documento
                 </Link>
                 
-                <button className="w-full btn-secondary flex items-center justify-center">
+                <input
+                  ref={fileInputRef}
+                  type="file"
+                  className="hidden"
+                  onChange={handleUpload}
+                  data-testid="upload-input"
+                />
+                <button
+                  onClick={() => fileInputRef.current?.click()}
+                  disabled={uploading}
+                  className="w-full btn-secondary flex items-center justify-center disabled:opacity-50"
+                  data-testid="upload-button"
+                >
                   <Upload className="h-4 w-4 mr-2" />
-                  Subir Archivo
+                  {uploading ? "Subiendo..." : "Subir Archivo"}
                 </button>
                 
                 <button className="w-full btn-ghost flex items-center justify-center">
@@ -295,12 +402,54 @@ const FileManager = () => {
                     data-testid="search-input"
                   />
                 </div>
-                <button className="btn-ghost flex items-center">
-                  <Filter className="h-5 w-5 mr-2" />
-                  Filtrar
-                </button>
+                <div className="relative flex items-center">
+                  <Filter className="absolute left-3 h-5 w-5 text-gray-400 pointer-events-none" />
+                  <select
+                    value={searchType}
+                    onChange={(e) => setSearchType(e.target.value)}
+                    className="pl-10 pr-4 py-3 border-2 border-gray-200 rounded-xl focus:border-emerald-500 bg-white"
+                    data-testid="search-type"
+                  >
+                    <option value="">Todo</option>
+                    <option value="DOCUMENTO">Mis documentos</option>
+                    <option value="PLANTILLA">Plantillas</option>
+                    <option value="TRAMITE">Trámites</option>
+                  </select>
+                </div>
               </div>
 
+              {/* Search Results */}
+              {searchResults !== null && searchResults.length > 0 && (
+                <div className="space-y-4" data-testid="search-results">
+                  <p className="text-sm text-gray-500">{searchTotal} resultados</p>
+                  {searchResults.map((result) => (
+                    <div
+                      key={`${result.tipo}-${result.id}`}
+                      className="border border-gray-200 rounded-xl p-6 hover:border-emerald-200 transition-colors bg-white/50"
+                    >
+                      <div className="flex items-center justify-between mb-2">
+                        {result.tipo === "DOCUMENTO" ? (
+                          <Link to={`/editor/${result.id}`} className="font-semibold text-gray-900 hover:text-emerald-600">
+                            {result.titulo}
+                          </Link>
+                        ) : (
+                          <h3 className="font-semibold text-gray-900">{result.titulo}</h3>
+                        )}
+                        <span className="px-3 py-1 rounded-full text-xs font-medium border bg-gray-100 text-gray-800 border-gray-200">
+                          {searchTypeLabels[result.tipo]}
+                        </span>
+                      </div>
+                      {result.fragmento && <p className="text-sm text-gray-600">{result.fragmento}</p>}
+                    </div>
+                  ))}
+                  {searchResults.length < searchTotal && (
+                    <button onClick={() => runSearch(searchPage + 1)} className="w-full btn-ghost">
+                      Ver más resultados
+                    </button>
+                  )}
+                </div>
+              )}
+
               {/* Documents List */}
               <div className="space-y-4" data-testid="documents-list">
                 {filteredDocuments.map((document) => (
@@ -343,19 +492,33 @@ const FileManager = () => {
                         )}
                         
                         <div className="flex space-x-2">
-                          <button 
-                            className="p-2 text-gray-500 hover:text-emerald-600 transition-colors"
-                            title="Descargar"
-                          >
-                            <Download className="h-4 w-4" />
-                          </button>
-                          <Link 
-                            to={`/editor/${document.id}`}
-                            className="p-2 text-gray-500 hover:text-emerald-600 transition-colors"
-                            title="Editar"
-                          >
-                            <FileText className="h-4 w-4" />
-                          </Link>
+                          {document.url ? (
+                            <a
+                              href={document.url}
+                              target="_blank"
+                              rel="noopener noreferrer"
+                              className="p-2 text-gray-500 hover:text-emerald-600 transition-colors"
+                              title="Descargar"
+                            >
+                              <Download className="h-4 w-4" />
+                            </a>
+                          ) : (
+                            <button 
+                              className="p-2 text-gray-500 hover:text-emerald-600 transition-colors"
+                              title="Descargar"
+                            >
+                              <Download className="h-4 w-4" />
+                            </button>
+                          )}
+                          {!document.uploaded && (
+                            <Link 
+                              to={`/editor/${document.id}`}
+                              className="p-2 text-gray-500 hover:text-emerald-600 transition-colors"
+                              title="Editar"
+                            >
+                              <FileText className="h-4 w-4" />
+                            </Link>
+                          )}
                         </div>
                       </div>
                     </div>
@@ -372,7 +535,7 @@ const FileManager = () => {
                 ))}
               </div>
 
-              {filteredDocuments.length === 0 && (
+              {filteredDocuments.length === 0 && (searchResults === null || searchResults.length === 0) && (
                 <div className="text-center py-12">
                   <FolderOpen className="h-12 w-12 text-gray-400 mx-auto mb-4" />
                   <h3 className="text-lg font-medium text-gray-900 mb-2">No se encontraron documentos</h3>
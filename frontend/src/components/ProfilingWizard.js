@@ -102,6 +102,7 @@ const ProfilingWizard = () => {
       if (!establishmentResponse.ok) {
         throw new Error('Error creating establishment');
       }
+      const establishment = await establishmentResponse.json();
       
       // Generate suggestions immediately
       const suggestionsResponse = await fetch(`${API}/suggestions`, {
@@ -124,6 +125,7 @@ const ProfilingWizard = () => {
       navigate("/suggestions", { 
         state: { 
           profile: formData, 
+          establishment,
           suggestions: suggestionsData 
         } 
       });
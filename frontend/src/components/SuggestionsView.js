@@ -12,6 +12,7 @@ const SuggestionsView = () => {
   
   const [suggestions, setSuggestions] = useState(null);
   const [profile, setProfile] = useState(null);
+  const [establishment, setEstablishment] = useState(null);
   const [selectedItems, setSelectedItems] = useState({
     plantillas: [],
     tramites: []
@@ -23,6 +24,7 @@ const SuggestionsView = () => {
     if (location.state?.suggestions && location.state?.profile) {
       setSuggestions(location.state.suggestions);
       setProfile(location.state.profile);
+      setEstablishment(location.state.establishment || null);
     } else {
       // Redirect back to profiling if no data
       navigate("/profiling");
@@ -53,6 +55,19 @@ const SuggestionsView = () => {
         estado: "ACTIVO"
       });
       
+      // Create every selected document in one request; PDFs render in the background
+      if (establishment && selectedItems.plantillas.length > 0) {
+        const job = await api.post('/documents/batch', {
+          establecimiento_id: establishment.id,
+          sugerencias: {
+            ...suggestions,
+            plantillas: suggestions.plantillas.filter(p => selectedItems.plantillas.includes(p.id))
+          },
+          generar_pdf: true
+        });
+        toast.success(`${job.documentos.length} documentos creados`);
+      }
+      
       toast.success("¡Documentos activados! Redirigiendo al editor...");
       
       // Navigate to editor with first selected template
@@ -4,10 +4,12 @@ export const API = `${BACKEND_URL}/api`;
 // Helper function for authenticated API calls
 export const apiRequest = async (endpoint, options = {}) => {
   const token = localStorage.getItem('token');
+  // Multipart bodies get their Content-Type (with boundary) from the browser
+  const isFormData = options.body instanceof FormData;
   
   const config = {
     headers: {
-      'Content-Type': 'application/json',
+      ...(!isFormData && { 'Content-Type': 'application/json' }),
       ...(token && { 'Authorization': `Bearer ${token}` }),
       ...options.headers
     },
@@ -40,5 +42,13 @@ export const api = {
     method: 'PUT', 
     body: JSON.stringify(data) 
   }),
+  patch: (endpoint, data) => apiRequest(endpoint, { 
+    method: 'PATCH', 
+    body: JSON.stringify(data) 
+  }),
+  upload: (endpoint, formData) => apiRequest(endpoint, {
+    method: 'POST',
+    body: formData
+  }),
   delete: (endpoint) => apiRequest(endpoint, { method: 'DELETE' })
 };
\ No newline at end of file
@@ -0,0 +1,17 @@
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from compliance import parse_timestamp  # noqa: E402
+
+def test_parse_timestamp_converts_offsets_to_utc():
+    assert parse_timestamp("2026-01-01T00:00:00-06:00") == datetime(2026, 1, 1, 6, 0)
+    assert parse_timestamp("2026-01-01T06:00:00Z") == datetime(2026, 1, 1, 6, 0)
+    assert parse_timestamp(datetime(2026, 1, 1, 6, 0, tzinfo=timezone.utc)) == datetime(2026, 1, 1, 6, 0)
+
+def test_parse_timestamp_keeps_naive_values():
+    assert parse_timestamp("2026-01-01T00:00:00") == datetime(2026, 1, 1)
+    assert parse_timestamp(datetime(2026, 1, 1)) == datetime(2026, 1, 1)
+    assert parse_timestamp(None) is None
@@ -0,0 +1,19 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from course_content import sanitize_html  # noqa: E402
+
+def test_self_closing_dropped_tag_keeps_following_content():
+    html, headings = sanitize_html('<p>a</p><iframe src="x"/><h2>Intro</h2><p>b</p>')
+    assert html == '<p>a</p><h2 id="intro">Intro</h2><p>b</p>'
+    assert headings == [{"nivel": 2, "texto": "Intro", "id": "intro"}]
+
+def test_self_closing_tag_inside_dropped_element():
+    html, _ = sanitize_html('<svg><path d="M0"/><svg/><text>x</text></svg><p>b</p>')
+    assert html == '<p>b</p>'
+
+def test_dropped_tag_content_is_removed():
+    html, _ = sanitize_html('<p>a</p><script>alert(1)</script><p>b</p>')
+    assert html == '<p>a</p><p>b</p>'
@@ -0,0 +1,16 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from field_validators import TemplateValidator  # noqa: E402
+
+def test_invalid_pattern_is_ignored():
+    validator = TemplateValidator({
+        "rfc": {"type": "string", "pattern": "[A-Z", "max_length": 13},
+        "cp": {"type": "string", "pattern": r"\d{5}"},
+    })
+    results = validator.validate({"rfc": "ABC", "cp": "123"})
+    assert results["rfc"] == {"valido": True}
+    assert results["cp"] == {"valido": False, "mensaje": "Formato inválido"}
+    assert validator.validate({"rfc": "X" * 14}, ["rfc"])["rfc"]["valido"] is False
@@ -0,0 +1,54 @@
+import asyncio
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'backend'))
+
+from local_supabase import LocalSupabaseClient  # noqa: E402
+from migrate_to_supabase import DataMigrator  # noqa: E402
+
+def make_migrator(db, checkpoint_file, incremental=False):
+    migrator = DataMigrator(batch_size=4, checkpoint_file=checkpoint_file, incremental=incremental)
+    migrator.mongo_db = db
+    migrator.supabase = None
+    return migrator
+
+def migrate(db, checkpoint_file, collection_name, incremental=False):
+    migrator = make_migrator(db, checkpoint_file, incremental)
+    assert asyncio.run(migrator.migrate_collection(collection_name, 'tramites'))
+    return migrator.migration_stats['collections'].get(collection_name, {}).get('documents', 0)
+
+def test_incremental_run_without_updated_at_only_sends_new_documents(tmp_path):
+    db = AsyncMongoMockClient()['migration_test']
+    checkpoint_file = tmp_path / 'checkpoint.json'
+    asyncio.run(db.tramites.insert_many([{'nombre': f'Trámite {i}'} for i in range(10)]))
+    assert migrate(db, checkpoint_file, 'tramites') == 10
+
+    asyncio.run(db.tramites.insert_one({'nombre': 'Trámite nuevo'}))
+    assert migrate(db, checkpoint_file, 'tramites', incremental=True) == 1
+    assert migrate(db, checkpoint_file, 'tramites', incremental=True) == 0
+
+def test_incremental_run_picks_up_updated_and_new_documents(tmp_path):
+    db = AsyncMongoMockClient()['migration_test']
+    checkpoint_file = tmp_path / 'checkpoint.json'
+    now = datetime(2026, 1, 1)
+    asyncio.run(db.tramites.insert_many([{'nombre': f'Trámite {i}', 'updated_at': now} for i in range(10)]))
+    assert migrate(db, checkpoint_file, 'tramites') == 10
+
+    asyncio.run(db.tramites.update_one({'nombre': 'Trámite 3'}, {'$set': {'updated_at': now + timedelta(hours=1)}}))
+    asyncio.run(db.tramites.insert_one({'nombre': 'Sin fecha'}))
+    assert migrate(db, checkpoint_file, 'tramites', incremental=True) == 2
+
+def test_verify_matches_rows_without_created_at(tmp_path):
+    db = AsyncMongoMockClient()['migration_test']
+    asyncio.run(db.reglas_sugerencia.insert_many([{'nombre': f'Regla {i}', 'prioridad': i} for i in range(10)]))
+    migrator = make_migrator(db, tmp_path / 'checkpoint.json')
+    migrator.supabase = LocalSupabaseClient(str(tmp_path / 'supabase.sqlite3'))
+    assert asyncio.run(migrator.migrate_collection('reglas_sugerencia', 'suggestion_rules'))
+
+    for _ in range(2):
+        result = asyncio.run(migrator.verify_table('reglas_sugerencia', 'suggestion_rules'))
+        assert result['match'], result